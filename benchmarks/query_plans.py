@@ -0,0 +1,271 @@
+"""
+Capture the query plans of the hot SQL statements and report how they changed
+between captures.
+
+Each statement runs under EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) against the
+local database (POSTGRES_DB), inside a transaction that is rolled back:
+
+    open_orders                 the latest_status DISTINCT ON read of process_orders()
+    users_without_signup        the signup anti-join, over the last day of logins
+    successful_logins           the session generator's read of the last day of logins
+    dim_user_base, dim_product  the compiled model SQL (dbt compile)
+
+The generator statements are the exact SQL the Postgres sink runs. A capture keeps
+the plans with execution/planning time, estimated vs actual rows per node and
+buffer counts, and diff flags new sequential scans, new row misestimates and time
+regressions.
+
+    python benchmarks/query_plans.py capture --label before-index
+    python benchmarks/query_plans.py diff                  # the two latest captures
+    python benchmarks/query_plans.py diff old.json new.json
+    python benchmarks/query_plans.py list
+"""
+from datetime import datetime
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+SCRIPTS_DIR = REPO_ROOT / "scripts"
+DBT_PROJECT_DIR = REPO_ROOT / "dbt" / "analytics"
+PLANS_DIR = Path(__file__).resolve().parent / "results" / "plans"
+
+sys.path.insert(0, str(SCRIPTS_DIR))
+from sinks import PostgresSink  # noqa: E402
+
+DBT_MODELS = ["dim_user_base", "dim_product"]
+# Estimated and actual rows further apart than this factor count as a misestimate
+MISESTIMATE_FACTOR = 10
+# Nodes with fewer rows than this on both sides are too small to matter
+MISESTIMATE_MIN_ROWS = 100
+
+
+class CapturingSink(PostgresSink):
+    """Records the statement of each streamed read instead of running it"""
+
+    def _stream(self, name, query, params=None, withhold=False):
+        self.captured = (query, params)
+        return iter(())
+
+
+def sink_statements(sink):
+    """(name, sql, params) of the generator reads, with the parameters of a daily run"""
+    sink.cur.execute("""
+        SELECT MAX(event_id) FROM raw.login_events
+        WHERE timestamp < (SELECT MAX(timestamp) - INTERVAL '1 day' FROM raw.login_events)
+    """)
+    day_start_id = sink.cur.fetchone()[0]
+    sink.cur.execute("SELECT MAX(event_id), MAX(timestamp) FROM raw.login_events")
+    last_id, as_of = sink.cur.fetchone()
+    sink.connection.rollback()
+
+    statements = []
+    for name, read in [
+        ("open_orders", lambda: sink.open_orders(as_of or datetime.now())),
+        ("users_without_signup", lambda: sink.users_without_signup(day_start_id, last_id)),
+        ("successful_logins", lambda: sink.successful_logins(day_start_id, last_id)),
+    ]:
+        read()
+        statements.append((name, *sink.captured))
+    return statements
+
+
+def dbt_statements(dbt_vars=None):
+    """(name, sql, None) of the compiled dbt models, incremental models as the next run would build them"""
+    env = {**os.environ, "DBT_PROFILES_DIR": os.getenv("DBT_PROFILES_DIR", str(REPO_ROOT / "dbt"))}
+    command = ["dbt", "compile", "--select", *DBT_MODELS]
+    if dbt_vars:
+        command += ["--vars", dbt_vars]
+    result = subprocess.run(command, cwd=DBT_PROJECT_DIR, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise Exception(f"dbt compile failed:\n{result.stdout}{result.stderr}")
+
+    compiled_dir = DBT_PROJECT_DIR / "target" / "compiled" / "analytics" / "models" / "marts"
+    return [(model, (compiled_dir / f"{model}.sql").read_text().strip().rstrip(";"), None) for model in DBT_MODELS]
+
+
+def plan_nodes(node, depth=0):
+    yield depth, node
+    for child in node.get("Plans", []):
+        yield from plan_nodes(child, depth + 1)
+
+
+def summarize_plan(explain):
+    """The numbers diff compares, from one EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) result"""
+    root = explain["Plan"]
+    seq_scans = set()
+    misestimates = []
+    for _, node in plan_nodes(root):
+        if node["Node Type"] == "Seq Scan":
+            seq_scans.add(node["Relation Name"])
+
+        loops = node.get("Actual Loops", 1) or 1
+        estimated = node["Plan Rows"] * loops
+        actual = node.get("Actual Rows", 0) * loops
+        if max(estimated, actual) >= MISESTIMATE_MIN_ROWS:
+            factor = max(estimated, 1) / max(actual, 1)
+            if factor >= MISESTIMATE_FACTOR or 1 / factor >= MISESTIMATE_FACTOR:
+                misestimates.append({
+                    "node": node["Node Type"],
+                    "relation": node.get("Relation Name") or node.get("Alias"),
+                    "estimated": estimated,
+                    "actual": actual,
+                })
+
+    return {
+        "planning_ms": explain.get("Planning Time"),
+        "shared_hit_blocks": root.get("Shared Hit Blocks", 0),
+        "shared_read_blocks": root.get("Shared Read Blocks", 0),
+        "temp_written_blocks": root.get("Temp Written Blocks", 0),
+        "estimated_rows": root["Plan Rows"],
+        "actual_rows": root.get("Actual Rows", 0),
+        "seq_scans": sorted(seq_scans),
+        "misestimates": misestimates,
+    }
+
+
+def explain(cur, sql, params):
+    cur.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}", params)
+    result = cur.fetchone()[0]
+    # Decoded by psycopg2 when the column comes back as json
+    return (json.loads(result) if isinstance(result, str) else result)[0]
+
+
+def capture(repeat, dbt_vars=None, include_dbt=True):
+    sink = CapturingSink()
+    statements = sink_statements(sink)
+    if include_dbt:
+        statements += dbt_statements(dbt_vars)
+
+    plans = {}
+    with sink.connection.cursor() as cur:
+        for name, sql, params in statements:
+            timings = []
+            for _ in range(repeat):
+                result = explain(cur, sql, params)
+                # EXPLAIN ANALYZE executes the statement; nothing it does is kept
+                sink.connection.rollback()
+                timings.append(result["Execution Time"])
+            plans[name] = {
+                "execution_ms": round(statistics.median(timings), 3),
+                "timings_ms": [round(timing, 3) for timing in timings],
+                **summarize_plan(result),
+                "sql": sql,
+                "params": [str(param) for param in params] if params else None,
+                "plan": result["Plan"],
+            }
+            print(f"  {name:<24} {plans[name]['execution_ms']:>10.2f} ms  "
+                  f"{plans[name]['shared_hit_blocks'] + plans[name]['shared_read_blocks']:>8} blocks  "
+                  f"seq scans: {', '.join(plans[name]['seq_scans']) or '-'}")
+    sink.close()
+    return plans
+
+
+def compare(old, new, threshold, min_ms):
+    """Human readable findings for every statement in both captures"""
+    findings = []
+    for name, plan in new["plans"].items():
+        before = old["plans"].get(name)
+        if before is None:
+            findings.append(f"{name}: not in the older capture")
+            continue
+
+        change = plan["execution_ms"] - before["execution_ms"]
+        if change > min_ms and change > before["execution_ms"] * threshold:
+            relative = f" ({change / before['execution_ms']:+.0%})" if before["execution_ms"] else ""
+            findings.append(f"{name}: {before['execution_ms']:.2f} -> {plan['execution_ms']:.2f} ms{relative}")
+        for relation in sorted(set(plan["seq_scans"]) - set(before["seq_scans"])):
+            findings.append(f"{name}: new sequential scan on {relation}")
+        known = {(m["node"], m["relation"]) for m in before["misestimates"]}
+        for misestimate in plan["misestimates"]:
+            if (misestimate["node"], misestimate["relation"]) not in known:
+                findings.append(
+                    f"{name}: {misestimate['node']}"
+                    + (f" on {misestimate['relation']}" if misestimate["relation"] else "")
+                    + f" estimated {misestimate['estimated']} rows, got {misestimate['actual']}"
+                )
+    return findings
+
+
+def capture_files():
+    return sorted(PLANS_DIR.glob("*.json")) if PLANS_DIR.exists() else []
+
+
+def load_capture(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Capture and compare query plans of the hot SQL")
+    commands = parser.add_subparsers(dest="command", required=True)
+    capture_parser = commands.add_parser("capture", help="EXPLAIN ANALYZE every statement and store the plans")
+    capture_parser.add_argument("--label", default="", help="Added to the file name and the capture")
+    capture_parser.add_argument("--repeat", type=int, default=3, help="Runs per statement, the median time is kept")
+    capture_parser.add_argument("--no-dbt", action="store_true", help="Skip the dbt model statements")
+    capture_parser.add_argument("--dbt-vars", help="--vars for dbt compile, e.g. 'run_date: 2025-10-01'")
+    diff_parser = commands.add_parser("diff", help="Compare two captures (default: the two latest)")
+    diff_parser.add_argument("old", nargs="?", type=Path)
+    diff_parser.add_argument("new", nargs="?", type=Path)
+    diff_parser.add_argument("--threshold", type=float, default=0.2, help="Relative slowdown that counts as a regression")
+    diff_parser.add_argument("--min-ms", type=float, default=1.0, help="Slowdowns smaller than this are ignored")
+    commands.add_parser("list", help="Show stored captures")
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        for path in capture_files():
+            data = load_capture(path)
+            total = sum(plan["execution_ms"] for plan in data["plans"].values())
+            print(f"  {path.name}  {data['label'] or '-'}  {len(data['plans'])} statements  {total:.1f} ms")
+        return
+
+    if args.command == "capture":
+        print("=" * 50)
+        print(f"CAPTURING QUERY PLANS FROM {os.getenv('POSTGRES_DB', 'analytics_db')}")
+        print("=" * 50)
+        data = {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "label": args.label,
+            "database": os.getenv("POSTGRES_DB", "analytics_db"),
+            "plans": capture(args.repeat, args.dbt_vars, not args.no_dbt),
+        }
+        PLANS_DIR.mkdir(parents=True, exist_ok=True)
+        output = PLANS_DIR / f"{datetime.now():%Y%m%d_%H%M%S}{'_' + args.label if args.label else ''}.json"
+        with open(output, "w") as f:
+            json.dump(data, f, indent=2)
+        print(f"\nPlans written to {output}")
+        return
+
+    if args.old is None:
+        files = capture_files()
+        if len(files) < 2:
+            raise SystemExit(f"Need two captures in {PLANS_DIR} (run 'capture' first)")
+        args.old, args.new = files[-2], files[-1]
+    elif args.new is None:
+        args.new = capture_files()[-1]
+
+    old, new = load_capture(args.old), load_capture(args.new)
+    print("=" * 50)
+    print(f"PLAN DIFF {args.old.name} -> {args.new.name}")
+    print("=" * 50)
+    for name, plan in new["plans"].items():
+        before = old["plans"].get(name, {})
+        print(f"  {name:<24} {before.get('execution_ms', 0):>10.2f} -> {plan['execution_ms']:>10.2f} ms  "
+              f"blocks {before.get('shared_hit_blocks', 0) + before.get('shared_read_blocks', 0):>8} -> "
+              f"{plan['shared_hit_blocks'] + plan['shared_read_blocks']:>8}")
+
+    findings = compare(old, new, args.threshold, args.min_ms)
+    if findings:
+        print(f"\n❌ {len(findings)} finding(s):")
+        for finding in findings:
+            print(f"  {finding}")
+        sys.exit(1)
+    print("\n✅ No new sequential scans, misestimates or slowdowns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""
+Benchmark the data generators and order simulation at one or more scale factors.
+
+Every scale factor gets a fresh scratch database (POSTGRES_DB is never touched),
+the stages run in pipeline order and each one reports throughput, per-batch
+latency percentiles and peak memory. Results are saved as JSON and compared
+against a stored baseline.
+
+With --sink file the generators write CSV into a scratch directory instead of
+Postgres, which isolates generation cost from database cost (the dbt backfill
+stage is skipped there).
+
+    python benchmarks/run_benchmarks.py --scale-factors 0.01,0.1
+    python benchmarks/run_benchmarks.py --scale-factors 0.1 --sink file
+    python benchmarks/run_benchmarks.py --scale-factors 0.1 --save-baseline
+"""
+import psycopg2
+from datetime import datetime, timedelta
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+SCRIPTS_DIR = REPO_ROOT / "scripts"
+DBT_PROJECT_DIR = REPO_ROOT / "dbt" / "analytics"
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+
+# Stages in pipeline order. Selecting a stage still runs everything before it
+# (unreported) because each stage reads what the previous ones wrote.
+STAGES = [
+    "login_events",
+    "products",
+    "signup_events",
+    "session_events",
+    "order_status",
+    "order_status_simulation",
+    "dim_product_backfill",
+]
+
+# Metric name -> True when a higher value is better
+COMPARED_METRICS = {
+    "rows_per_sec": True,
+    "wall_time_s": False,
+    "batch_latency_p95_ms": False,
+    "peak_rss_mb": False,
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def admin_connection():
+    conn = psycopg2.connect(
+        host=os.getenv("POSTGRES_HOST", "localhost"),
+        port=os.getenv("POSTGRES_PORT", "5432"),
+        database="postgres",
+        user=os.getenv("POSTGRES_USER", "analytics_user"),
+        password=os.getenv("POSTGRES_PASSWORD", "analytics_pass")
+    )
+    conn.autocommit = True
+    return conn
+
+
+def recreate_database(name):
+    conn = admin_connection()
+    cur = conn.cursor()
+    cur.execute(f'DROP DATABASE IF EXISTS "{name}"')
+    cur.execute(f'CREATE DATABASE "{name}"')
+    cur.close()
+    conn.close()
+
+
+def run_measured(command, env, cwd=REPO_ROOT):
+    """Run a command and return (elapsed seconds, peak RSS in MB of the child tree)"""
+    with tempfile.TemporaryFile() as output:
+        started = time.perf_counter()
+        process = subprocess.Popen(command, cwd=cwd, env=env, stdout=output, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - started
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+        if process.returncode != 0:
+            output.seek(0)
+            raise Exception(f"{' '.join(command)} failed:\n{output.read().decode(errors='replace')}")
+
+    return elapsed, usage.ru_maxrss / 1024
+
+
+def run_script_stage(script, args, env):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        metrics_path = os.path.join(tmp_dir, "metrics.json")
+        elapsed, peak_rss_mb = run_measured(
+            [sys.executable, str(SCRIPTS_DIR / script), *args],
+            {**env, "RUN_METRICS_PATH": metrics_path}
+        )
+        with open(metrics_path) as f:
+            metrics = json.load(f)
+
+    return summarize(
+        elapsed,
+        metrics["total_rows"],
+        [seconds for _, seconds in metrics["batches"]],
+        peak_rss_mb,
+        metrics["db_round_trips"]
+    )
+
+
+def run_backfill_stage(days, env):
+    """dbt run of dim_product once per day, the same loop as the backfill_dim_product asset"""
+    dbt_env = {**env, "DBT_PROFILES_DIR": str(REPO_ROOT / "dbt")}
+    run_measured(["dbt", "run", "--select", "+dim_product", "--exclude", "dim_product"], dbt_env, DBT_PROJECT_DIR)
+
+    latencies = []
+    peak_rss_mb = 0.0
+    today = datetime.now().date()
+    for offset in range(days - 1, -1, -1):
+        run_date = today - timedelta(days=offset)
+        elapsed, rss = run_measured(
+            ["dbt", "run", "--select", "dim_product", "--vars", f"run_date: {run_date}"],
+            dbt_env,
+            DBT_PROJECT_DIR
+        )
+        latencies.append(elapsed)
+        peak_rss_mb = max(peak_rss_mb, rss)
+
+    conn = psycopg2.connect(
+        host=env.get("POSTGRES_HOST", "localhost"),
+        port=env.get("POSTGRES_PORT", "5432"),
+        database=env["POSTGRES_DB"],
+        user=env.get("POSTGRES_USER", "analytics_user"),
+        password=env.get("POSTGRES_PASSWORD", "analytics_pass")
+    )
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM marts.dim_product")
+    rows = cur.fetchone()[0]
+    cur.close()
+    conn.close()
+
+    return summarize(sum(latencies), rows, latencies, peak_rss_mb, None)
+
+
+def summarize(elapsed, rows, batch_latencies, peak_rss_mb, round_trips):
+    latencies_ms = [seconds * 1000 for seconds in batch_latencies]
+    return {
+        "wall_time_s": round(elapsed, 3),
+        "rows": rows,
+        "rows_per_sec": round(rows / elapsed, 1) if elapsed > 0 else 0.0,
+        "batches": len(latencies_ms),
+        "batch_latency_p50_ms": round(percentile(latencies_ms, 50), 2),
+        "batch_latency_p95_ms": round(percentile(latencies_ms, 95), 2),
+        "batch_latency_p99_ms": round(percentile(latencies_ms, 99), 2),
+        "batch_latency_mean_ms": round(statistics.fmean(latencies_ms), 2) if latencies_ms else 0.0,
+        "peak_rss_mb": round(peak_rss_mb, 1),
+        "db_round_trips": round_trips,
+    }
+
+
+def run_scale_factor(scale_factor, stages, args):
+    database = f"{args.database_prefix}_{str(scale_factor).replace('.', '_')}"
+    env = {**os.environ, "WORKLOAD_SCALE_FACTOR": str(scale_factor), "GENERATOR_SINK": args.sink}
+    if args.bulk_load:
+        env["GENERATOR_BULK_LOAD"] = "1"
+
+    if args.sink == "postgres":
+        recreate_database(database)
+        env["POSTGRES_DB"] = database
+    else:
+        output_dir = tempfile.TemporaryDirectory(prefix=f"{database}_")
+        env["SINK_DIR"] = output_dir.name
+        stages = [stage for stage in stages if stage != "dim_product_backfill"]
+
+    if args.workload:
+        env["WORKLOAD_SPEC"] = str(args.workload)
+    last_stage = max((STAGES.index(stage) for stage in stages), default=-1)
+    results = {}
+
+    for stage in STAGES[:last_stage + 1]:
+        print(f"  [{scale_factor}] {stage}...")
+        if stage == "login_events":
+            result = run_script_stage("generate_login_events.py", [], env)
+        elif stage == "products":
+            result = run_script_stage("generate_products.py", [], env)
+        elif stage == "signup_events":
+            result = run_script_stage("generate_signups.py", [], env)
+        elif stage == "session_events":
+            result = run_script_stage("generate_session_events.py", [], env)
+        elif stage == "order_status":
+            result = run_script_stage("update_order_status.py", [], env)
+        elif stage == "order_status_simulation":
+            result = run_script_stage("update_order_status.py", ["--simulate-days", str(args.simulate_days)], env)
+        else:
+            result = run_backfill_stage(args.backfill_days, env)
+
+        if stage in stages:
+            results[stage] = result
+
+    if args.sink != "postgres":
+        output_dir.cleanup()
+    elif not args.keep_databases:
+        conn = admin_connection()
+        cur = conn.cursor()
+        cur.execute(f'DROP DATABASE IF EXISTS "{database}"')
+        cur.close()
+        conn.close()
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return a list of human readable regressions against the baseline run"""
+    regressions = []
+    for scale_factor, stages in results["scale_factors"].items():
+        baseline_stages = baseline["scale_factors"].get(scale_factor, {})
+        for stage, metrics in stages.items():
+            if stage not in baseline_stages:
+                continue
+            for metric, higher_is_better in COMPARED_METRICS.items():
+                old = baseline_stages[stage].get(metric)
+                new = metrics.get(metric)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old
+                if (higher_is_better and change < -threshold) or (not higher_is_better and change > threshold):
+                    regressions.append(
+                        f"sf={scale_factor} {stage} {metric}: {old} -> {new} ({change:+.1%})"
+                    )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark generators and order simulation")
+    parser.add_argument("--workload", type=Path, help="Workload spec the scale factors are applied to")
+    parser.add_argument("--scale-factors", default="0.01", help="Comma separated, e.g. 0.01,0.1,1")
+    parser.add_argument("--stages", default=",".join(STAGES), help="Comma separated subset of: " + ", ".join(STAGES))
+    parser.add_argument("--simulate-days", type=int, default=30, help="Days for the order simulation stage")
+    parser.add_argument("--backfill-days", type=int, default=7, help="Days for the dim_product backfill stage")
+    parser.add_argument("--output", type=Path, help="Results file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Relative change that counts as a regression")
+    parser.add_argument("--sink", choices=["postgres", "file"], default="postgres",
+                        help="Where the generators write (file skips the dbt backfill stage)")
+    parser.add_argument("--bulk-load", action="store_true", help="Run the generators in bulk-load mode")
+    parser.add_argument("--database-prefix", default="analytics_bench")
+    parser.add_argument("--keep-databases", action="store_true")
+    args = parser.parse_args()
+
+    scale_factors = [float(sf) for sf in args.scale_factors.split(",")]
+    stages = [stage.strip() for stage in args.stages.split(",")]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+    results = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "sink": args.sink,
+        "bulk_load": args.bulk_load,
+        "scale_factors": {}
+    }
+
+    print("=" * 50)
+    print(f"BENCHMARKING {len(stages)} STAGES AT SCALE FACTORS {scale_factors}")
+    print("=" * 50)
+
+    for scale_factor in scale_factors:
+        results["scale_factors"][str(scale_factor)] = run_scale_factor(scale_factor, stages, args)
+
+    print("-" * 50)
+    for scale_factor, stage_results in results["scale_factors"].items():
+        for stage, metrics in stage_results.items():
+            print(
+                f"sf={scale_factor:<6} {stage:<24} {metrics['rows_per_sec']:>10} rows/s  "
+                f"p50 {metrics['batch_latency_p50_ms']:>8} ms  p95 {metrics['batch_latency_p95_ms']:>8} ms  "
+                f"peak {metrics['peak_rss_mb']:>7} MB"
+            )
+
+    output = args.output or RESULTS_DIR / f"{datetime.now():%Y%m%d_%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline updated: {args.baseline}")
+        return
+
+    if not args.baseline.exists():
+        print("No baseline to compare against (use --save-baseline)")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    if baseline.get("sink", "postgres") != args.sink:
+        print(f"Baseline was recorded with the {baseline.get('sink', 'postgres')} sink, not comparing")
+        return
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n❌ {len(regressions)} regression(s) beyond {args.threshold:.0%}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+
+    print(f"\n✅ No regressions beyond {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+from dagster import ConfigurableIOManager, InputContext, OutputContext
+from typing import Optional
+import os
+
+import pyarrow as pa
+
+# Tables kept by the "memory" storage, for runs that execute in a single process
+_TABLES = {}
+
+
+class ArrowIOManager(ConfigurableIOManager):
+    """Hands pyarrow Tables from one asset to the next without going through Postgres.
+
+    "mmap" writes each table once as an uncompressed Arrow IPC file under base_dir and
+    memory-maps it on load, so any step process (and the generator subprocesses it
+    starts) can read it without a copy. "memory" keeps the table in this process and
+    only works with the in-process executor. An asset that outputs None stores
+    nothing, and its downstream assets load None.
+    """
+
+    storage: str = "mmap"
+    base_dir: Optional[str] = None
+
+    def _path(self, context):
+        base_dir = self.base_dir or os.path.join(os.getenv("DAGSTER_HOME", "."), "storage", "arrow")
+        return os.path.join(base_dir, *context.asset_key.path) + ".arrow"
+
+    def handle_output(self, context: OutputContext, obj):
+        path = self._path(context)
+        if obj is None:
+            _TABLES.pop(path, None)
+            if os.path.exists(path):
+                os.remove(path)
+            return
+
+        if self.storage == "memory":
+            _TABLES[path] = obj
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Replaced atomically, a run reading the previous batch keeps its mapping
+            with pa.OSFile(path + ".tmp", "wb") as sink, pa.ipc.new_file(sink, obj.schema) as writer:
+                writer.write_table(obj)
+            os.replace(path + ".tmp", path)
+        context.add_output_metadata({"rows": obj.num_rows, "bytes": obj.nbytes, "storage": self.storage})
+
+    def load_input(self, context: InputContext):
+        path = self._path(context.upstream_output)
+        if self.storage == "memory":
+            return _TABLES.get(path)
+        if not os.path.exists(path):
+            return None
+        with pa.memory_map(path, "r") as source:
+            table = pa.ipc.open_file(source).read_all()
+        # Where the batch lives, so it can be passed on to a subprocess as it is
+        return table.replace_schema_metadata({**(table.schema.metadata or {}), b"path": path.encode()})
+
+
+def read_table(path):
+    """The Arrow IPC file at path, read into memory"""
+    with pa.OSFile(path, "rb") as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def batch_file(table, tmp_dir):
+    """A file holding table: the one it was mapped from, or a copy written to tmp_dir"""
+    path = (table.schema.metadata or {}).get(b"path")
+    if path is not None:
+        return path.decode()
+    path = os.path.join(tmp_dir, "batch.arrow")
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return path
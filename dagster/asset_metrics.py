@@ -0,0 +1,199 @@
+from dagster import MetadataValue
+from datetime import datetime
+import psycopg2
+import psycopg2.extras
+import os
+
+# Event time each asset has processed up to: an epoch-seconds watermark, or a timestamp.
+# Generators keep watermarks in ops.generator_watermarks; dim_user(_base) keeps data_through per user,
+# fct_daily_revenue the newest order it has seen.
+FRESHNESS_QUERIES = {
+    "login_events": "SELECT value FROM ops.generator_watermarks WHERE name = 'login_events.event_time'",
+    "signup_events": "SELECT value FROM ops.generator_watermarks WHERE name = 'signup_events.event_time'",
+    "session_events": "SELECT value FROM ops.generator_watermarks WHERE name = 'session_events.event_time'",
+    "order_status": "SELECT value FROM ops.generator_watermarks WHERE name = 'order_status.placed_through'",
+    "dim_user_base": "SELECT MAX(data_through) FROM marts.dim_user_base",
+    "dim_user": "SELECT MAX(data_through) FROM marts.dim_user",
+    "fct_daily_revenue": "SELECT MAX(orders_through) FROM marts.fct_daily_revenue",
+}
+
+
+def get_connection():
+    return psycopg2.connect(
+        host=os.getenv("POSTGRES_HOST", "localhost"),  # Fallback to localhost
+        port=os.getenv("POSTGRES_PORT", "5432"),
+        database=os.getenv("POSTGRES_DB", "analytics_db"),
+        user=os.getenv("POSTGRES_USER", "analytics_user"),
+        password=os.getenv("POSTGRES_PASSWORD", "analytics_pass")
+    )
+
+
+def metrics_metadata(metrics):
+    """Flatten run metrics into Dagster metadata so each number gets its own plot"""
+    metadata = {
+        "wall_time_s": MetadataValue.float(metrics["wall_time_s"]),
+        "rows_inserted": MetadataValue.int(metrics["total_rows"]),
+        "rows_per_sec": MetadataValue.float(metrics["rows_per_sec"]),
+        "peak_rss_mb": MetadataValue.float(metrics["peak_rss_mb"]),
+    }
+    if metrics["db_round_trips"] is not None:
+        metadata["db_round_trips"] = MetadataValue.int(metrics["db_round_trips"])
+    if metrics.get("freshness_lag_s") is not None:
+        metadata["data_through"] = MetadataValue.text(metrics["data_through"])
+        metadata["freshness_lag_s"] = MetadataValue.float(metrics["freshness_lag_s"])
+    for table, rows in metrics["rows_inserted"].items():
+        metadata[f"rows_inserted.{table}"] = MetadataValue.int(rows)
+    if metrics.get("profile"):
+        metadata.update(profile_metadata(metrics["profile"]))
+    return metadata
+
+
+def profile_metadata(profile):
+    """Wall time split and hotspots of a profiled script run (scripts/profiler.py)"""
+    rows = "\n".join(
+        f"| `{hotspot['function']}` | {hotspot['own_pct']:.1f}% | {hotspot['total_pct']:.1f}% |"
+        for hotspot in profile["hotspots"]
+    )
+    return {
+        "profile.cpu_s": MetadataValue.float(profile["cpu_s"]),
+        "profile.db_wait_s": MetadataValue.float(profile["db_wait_s"]),
+        "profile.samples": MetadataValue.int(profile["samples"]),
+        "profile.hotspots": MetadataValue.md(f"| Function | Own | Total |\n|---|---|---|\n{rows}"),
+        "profile.collapsed": MetadataValue.path(profile["collapsed"]),
+    }
+
+
+def with_freshness(asset_name, metrics):
+    """Add data_through (the newest event time the asset has processed) and freshness_lag_s
+    (seconds from then to now) to metrics, for assets with an event-time watermark"""
+    query = FRESHNESS_QUERIES.get(asset_name)
+    if query is None:
+        return metrics
+
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(query)
+        row = cur.fetchone()
+    except psycopg2.errors.UndefinedTable:
+        row = None
+    cur.close()
+    conn.close()
+    if row is None or row[0] is None:
+        return metrics
+
+    # Watermarks are epoch seconds of the naive local timestamps the generators write
+    data_through = datetime.fromtimestamp(row[0]) if isinstance(row[0], int) else row[0]
+    lag = max((datetime.now() - data_through).total_seconds(), 0.0)
+    return {**metrics, "data_through": data_through.isoformat(timespec="seconds"), "freshness_lag_s": round(lag, 1)}
+
+
+def record_asset_metrics(context, asset_name, metrics):
+    """Append one row per materialization to ops.asset_metrics for run-over-run comparisons"""
+    conn = get_connection()
+    cur = conn.cursor()
+
+    # Assets finishing at the same time would otherwise race on the DDL
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('analytics_ddl'))")
+    cur.execute("CREATE SCHEMA IF NOT EXISTS ops;")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS ops.asset_metrics (
+        metric_id SERIAL PRIMARY KEY,
+        run_id VARCHAR(64),
+        asset_name VARCHAR(200),
+        recorded_at TIMESTAMP DEFAULT NOW(),
+        wall_time_s DOUBLE PRECISION,
+        rows_inserted BIGINT,
+        rows_per_sec DOUBLE PRECISION,
+        db_round_trips BIGINT,
+        peak_rss_mb DOUBLE PRECISION,
+        rows_by_table JSONB
+    );
+    ALTER TABLE ops.asset_metrics ADD COLUMN IF NOT EXISTS data_through TIMESTAMP;
+    ALTER TABLE ops.asset_metrics ADD COLUMN IF NOT EXISTS freshness_lag_s DOUBLE PRECISION;
+    """)
+
+    cur.execute("""
+        INSERT INTO ops.asset_metrics
+        (run_id, asset_name, wall_time_s, rows_inserted, rows_per_sec, db_round_trips, peak_rss_mb, rows_by_table,
+         data_through, freshness_lag_s)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, (
+        context.run_id,
+        asset_name,
+        metrics["wall_time_s"],
+        metrics["total_rows"],
+        metrics["rows_per_sec"],
+        metrics["db_round_trips"],
+        metrics["peak_rss_mb"],
+        psycopg2.extras.Json(metrics["rows_inserted"]),
+        metrics.get("data_through"),
+        metrics.get("freshness_lag_s")
+    ))
+
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+def _ensure_checkpoints(cur):
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('analytics_ddl'))")
+    cur.execute("CREATE SCHEMA IF NOT EXISTS ops;")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS ops.asset_checkpoints (
+        run_key VARCHAR(64),
+        asset_name VARCHAR(200),
+        checkpoint JSONB,
+        updated_at TIMESTAMP DEFAULT NOW(),
+        PRIMARY KEY (run_key, asset_name)
+    );
+    """)
+
+
+def checkpoint_key(context):
+    """Re-executions of a failed run share its root run id, so they resume its checkpoints"""
+    return context.dagster_run.root_run_id or context.run_id
+
+
+def load_checkpoint(context, asset_name):
+    """Last position saved by this run (or the run it re-executes), or None"""
+    conn = get_connection()
+    cur = conn.cursor()
+    _ensure_checkpoints(cur)
+    cur.execute(
+        "SELECT checkpoint FROM ops.asset_checkpoints WHERE run_key = %s AND asset_name = %s",
+        (checkpoint_key(context), asset_name)
+    )
+    row = cur.fetchone()
+    conn.commit()
+    cur.close()
+    conn.close()
+    return row[0] if row else None
+
+
+def save_checkpoint(context, asset_name, checkpoint):
+    conn = get_connection()
+    cur = conn.cursor()
+    _ensure_checkpoints(cur)
+    cur.execute("""
+        INSERT INTO ops.asset_checkpoints (run_key, asset_name, checkpoint) VALUES (%s, %s, %s)
+        ON CONFLICT (run_key, asset_name) DO UPDATE SET checkpoint = EXCLUDED.checkpoint, updated_at = NOW()
+    """, (checkpoint_key(context), asset_name, psycopg2.extras.Json(checkpoint)))
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+def dbt_result_metrics(result, peak_rss_mb):
+    """Shape one entry of dbt's run_results.json like the generator script metrics"""
+    wall_time = result["execution_time"]
+    rows = max(result["adapter_response"].get("rows_affected", 0), 0)
+    return {
+        "wall_time_s": round(wall_time, 3),
+        "rows_inserted": {result["unique_id"].split(".")[-1]: rows},
+        "total_rows": rows,
+        "rows_per_sec": round(rows / wall_time, 1) if wall_time > 0 else 0.0,
+        # dbt runs a handful of statements per model; it does not report how many
+        "db_round_trips": None,
+        "peak_rss_mb": round(peak_rss_mb, 1)
+    }
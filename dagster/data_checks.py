@@ -0,0 +1,275 @@
+"""
+Data-quality checks over the raw tables and marts that only look at the rows loaded
+since the last passing run of the check.
+
+Each check reads an upper bound (the highest serial id, or the newest date for the
+marts) and counts the rows and violations in (checked_through, upper bound], per
+day. A check that passes moves checked_through up; one that fails keeps it, so the
+failing rows are counted again until they are fixed. Every DATA_CHECK_FULL_SWEEP_DAYS
+(or when asked for) a check runs over the whole table instead, which catches rows
+that changed behind the window.
+
+Each run appends one row per check and day to ops.data_check_results.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+import os
+
+from asset_metrics import get_connection
+
+FULL_SWEEP_DAYS = float(os.getenv("DATA_CHECK_FULL_SWEEP_DAYS", "7"))
+
+# Status -> the statuses an order can be in right before it (None: no earlier event),
+# as update_order_status.py moves orders along
+STATUS_TRANSITIONS = {
+    "placed": [None],
+    "processing": ["placed"],
+    "cancelled": ["processing"],
+    "shipped": ["processing"],
+    "delivered": ["shipped"],
+    "returned": ["delivered"],
+    "final": ["delivered"],
+    "refunded": ["cancelled", "returned"],
+}
+
+
+@dataclass(frozen=True)
+class DataCheck:
+    asset: str          # Asset the check belongs to (a raw table, or a dbt model)
+    table: str
+    through: str        # Query for the upper bound of the window
+    sql: str            # (day, rows, violations) for the rows in (%(after)s, %(through)s]; after is NULL in a full sweep
+    writer: str = None  # Generator whose advisory lock covers the inserts, waited out before reading the bound
+    description: str = ""
+
+
+def _valid_transitions():
+    return ", ".join(
+        f"({'NULL' if previous is None else repr(previous)}, '{status}')"
+        for status, previous_statuses in STATUS_TRANSITIONS.items()
+        for previous in previous_statuses
+    )
+
+
+CHECKS = {
+    "login_events_valid": DataCheck(
+        asset="login_events",
+        table="raw.login_events",
+        through="SELECT MAX(event_id) FROM raw.login_events",
+        writer="login_events",
+        sql="""
+            SELECT date(timestamp), COUNT(*),
+                COUNT(*) FILTER (WHERE timestamp IS NULL OR user_id IS NULL
+                    OR status IS NULL OR status NOT IN ('success', 'failed')
+                    OR (status = 'success' AND session_id IS NULL))
+            FROM raw.login_events
+            WHERE event_id > COALESCE(%(after)s::bigint, 0) AND event_id <= %(through)s::bigint
+            GROUP BY 1
+        """,
+        description="Logins have a time, user and a success/failed status, successful ones a session",
+    ),
+    "signup_events_valid": DataCheck(
+        asset="signup_events",
+        table="raw.signup_events",
+        through="SELECT MAX(signup_id) FROM raw.signup_events",
+        writer="signup_events",
+        sql="""
+            SELECT date(timestamp), COUNT(*),
+                COUNT(*) FILTER (WHERE timestamp IS NULL OR user_id IS NULL OR email IS NULL OR signup_method IS NULL)
+            FROM raw.signup_events
+            WHERE signup_id > COALESCE(%(after)s::bigint, 0) AND signup_id <= %(through)s::bigint
+            GROUP BY 1
+        """,
+        description="Signups have a time, user, email and method",
+    ),
+    "session_events_valid": DataCheck(
+        asset="session_events",
+        table="raw.session_events",
+        through="SELECT MAX(event_id) FROM raw.session_events",
+        writer="session_events",
+        sql="""
+            SELECT date(timestamp), COUNT(*),
+                COUNT(*) FILTER (WHERE timestamp IS NULL OR user_id IS NULL OR session_id IS NULL OR event_type IS NULL)
+            FROM raw.session_events
+            WHERE event_id > COALESCE(%(after)s::bigint, 0) AND event_id <= %(through)s::bigint
+            GROUP BY 1
+        """,
+        description="Session events have a time, user, session and type",
+    ),
+    # An order's items are written in the same run as the order, so the orders with items
+    # in the window are complete. Orders are counted on the day they were placed.
+    "order_totals": DataCheck(
+        asset="orders",
+        table="raw.order_items",
+        through="SELECT MAX(order_item_id) FROM raw.order_items",
+        writer="session_events",
+        sql="""
+            WITH items AS (
+                SELECT order_id, COUNT(*) AS items, SUM(line_total) AS line_totals,
+                    bool_or(quantity IS NULL OR quantity <= 0 OR line_total <> unit_price * quantity) AS bad_items
+                FROM raw.order_items
+                WHERE order_item_id > COALESCE(%(after)s::bigint, 0) AND order_item_id <= %(through)s::bigint
+                GROUP BY order_id
+            )
+            SELECT date(o.order_date), COUNT(*),
+                COUNT(*) FILTER (WHERE o.order_id IS NULL OR o.user_id IS NULL OR o.order_date IS NULL OR i.bad_items
+                    OR abs(o.subtotal - i.line_totals) > 0.01 * i.items
+                    OR abs(o.total - (o.subtotal - o.discount_amount + o.tax + o.shipping)) > 0.01)
+            FROM items i
+            LEFT JOIN raw.orders o ON o.order_id = i.order_id
+            GROUP BY 1
+        """,
+        description="Orders exist for their items, subtotals match the line totals and totals add up",
+    ),
+    "status_transitions": DataCheck(
+        asset="order_status_events",
+        table="raw.order_status_events",
+        through="SELECT MAX(status_event_id) FROM raw.order_status_events",
+        writer="order_status",
+        sql=f"""
+            WITH transitions (previous, status) AS (
+                VALUES {_valid_transitions()}
+            )
+            , history AS (
+                SELECT status_event_id, status, timestamp,
+                    LAG(status) OVER (PARTITION BY order_id ORDER BY timestamp, status_event_id) AS previous
+                FROM raw.order_status_events
+                WHERE order_id IN (
+                    SELECT order_id FROM raw.order_status_events
+                    WHERE status_event_id > COALESCE(%(after)s::bigint, 0) AND status_event_id <= %(through)s::bigint
+                )
+            )
+            SELECT date(h.timestamp), COUNT(*), COUNT(*) FILTER (WHERE t.status IS NULL)
+            FROM history h
+            LEFT JOIN transitions t ON t.status = h.status AND t.previous IS NOT DISTINCT FROM h.previous
+            WHERE h.status_event_id > COALESCE(%(after)s::bigint, 0) AND h.status_event_id <= %(through)s::bigint
+            GROUP BY 1
+        """,
+        description="Every status follows one it can follow, in event time",
+    ),
+    # dim_product rebuilds its latest date on every run, so that date is checked again
+    "dim_product_unique": DataCheck(
+        asset="dim_product",
+        table="marts.dim_product",
+        through="SELECT MAX(date_key) FROM marts.dim_product",
+        sql="""
+            SELECT date_key, COUNT(*), COUNT(*) - COUNT(DISTINCT product_id)
+            FROM marts.dim_product
+            WHERE date_key >= COALESCE(%(after)s::date, '-infinity') AND date_key <= %(through)s::date
+            GROUP BY 1
+        """,
+        description="One row per product and date",
+    ),
+    "dim_user_valid": DataCheck(
+        asset="dim_user",
+        table="marts.dim_user",
+        through="SELECT MAX(data_through) FROM marts.dim_user",
+        sql="""
+            SELECT date(data_through), COUNT(*),
+                COUNT(*) FILTER (WHERE user_id IS NULL OR signup_date IS NULL
+                    OR first_login_date > last_login_date OR login_days > total_logins
+                    OR first_purchase_date > last_purchase_date OR has_purchased <> (first_purchase_date IS NOT NULL))
+            FROM marts.dim_user
+            WHERE data_through > COALESCE(%(after)s::timestamp, '-infinity') AND data_through <= %(through)s::timestamp
+            GROUP BY 1
+        """,
+        description="Rebuilt users have a signup and consistent login and purchase dates",
+    ),
+}
+
+
+def _ensure_tables(cur):
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('analytics_ddl'))")
+    cur.execute("CREATE SCHEMA IF NOT EXISTS ops;")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS ops.data_check_state (
+        check_name VARCHAR(100) PRIMARY KEY,
+        checked_through TEXT,
+        last_full_sweep TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT NOW()
+    );
+
+    CREATE TABLE IF NOT EXISTS ops.data_check_results (
+        result_id SERIAL PRIMARY KEY,
+        run_id VARCHAR(64),
+        check_name VARCHAR(100),
+        asset_name VARCHAR(200),
+        partition_date DATE,
+        checked_after TEXT,
+        checked_through TEXT,
+        full_sweep BOOLEAN,
+        rows_checked BIGINT,
+        violations BIGINT,
+        checked_at TIMESTAMP DEFAULT NOW()
+    );
+    """)
+
+
+def run_check(name, run_id, full_sweep=False):
+    """Run one check over its window and record it. Returns a summary with the per-day results."""
+    check = CHECKS[name]
+    conn = get_connection()
+    cur = conn.cursor()
+    _ensure_tables(cur)
+    conn.commit()
+
+    cur.execute("SELECT checked_through, last_full_sweep FROM ops.data_check_state WHERE check_name = %s", (name,))
+    after, last_full_sweep = cur.fetchone() or (None, None)
+    # Checks that never ran, or not for a while, sweep the whole table
+    full_sweep = full_sweep or after is None or last_full_sweep is None \
+        or datetime.now() - last_full_sweep > timedelta(days=FULL_SWEEP_DAYS)
+
+    cur.execute("SELECT to_regclass(%s)", (check.table,))
+    built = cur.fetchone()[0] is not None
+    if check.writer is not None:
+        # As in PostgresSink.high_water: waits out a run of the writer that is still inserting
+        cur.execute("SELECT pg_advisory_lock_shared(hashtext(%s))", (f"generator:{check.writer}",))
+    through = None
+    if built:
+        cur.execute(check.through)
+        through = cur.fetchone()[0]
+    if check.writer is not None:
+        cur.execute("SELECT pg_advisory_unlock_shared(hashtext(%s))", (f"generator:{check.writer}",))
+    through = None if through is None else str(through)
+
+    partitions = []
+    if through is not None:
+        cur.execute(check.sql, {"after": None if full_sweep else after, "through": through})
+        partitions = sorted(cur.fetchall(), key=lambda row: (row[0] is None, row[0]))
+
+    violations = sum(row[2] for row in partitions)
+    for day, rows, failed in partitions:
+        cur.execute("""
+            INSERT INTO ops.data_check_results
+            (run_id, check_name, asset_name, partition_date, checked_after, checked_through, full_sweep, rows_checked, violations)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, (run_id, name, check.asset, day, None if full_sweep else after, through, full_sweep, rows, failed))
+
+    # Only a passing check moves the window on; a full sweep counts as one either way
+    cur.execute("""
+        INSERT INTO ops.data_check_state (check_name, checked_through, last_full_sweep) VALUES (%s, %s, %s)
+        ON CONFLICT (check_name) DO UPDATE SET
+            checked_through = EXCLUDED.checked_through,
+            last_full_sweep = COALESCE(EXCLUDED.last_full_sweep, ops.data_check_state.last_full_sweep),
+            updated_at = NOW()
+    """, (
+        name,
+        through if violations == 0 and through is not None else after,
+        datetime.now() if full_sweep else None,
+    ))
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    return {
+        "passed": violations == 0,
+        "full_sweep": full_sweep,
+        "checked_after": None if full_sweep else after,
+        "checked_through": through,
+        "rows_checked": sum(row[1] for row in partitions),
+        "violations": violations,
+        "partitions": [
+            {"date": None if day is None else day.isoformat(), "rows": rows, "violations": failed}
+            for day, rows, failed in partitions
+        ],
+    }
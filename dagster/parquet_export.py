@@ -0,0 +1,191 @@
+"""
+Columnar export of the marts, for analysts and notebooks that would otherwise pull
+them row by row over the Postgres wire protocol.
+
+Each mart is streamed from a server-side cursor into zstd-compressed Parquet files:
+
+    <export_dir>/manifest.json
+    <export_dir>/dim_user/part-0.parquet
+    <export_dir>/dim_product/date_key=2025-09-29/part-0.parquet
+
+and read with pyarrow.parquet.read_table(path, memory_map=True), or the whole
+directory with pyarrow.dataset (hive partitioning: the partition column is in the
+directory name, not in the files). The manifest lists every file with its rows.
+
+Every partition (the whole table for unpartitioned marts) has a fingerprint: its row
+count and the sum of a 64-bit hash of each row, computed in Postgres. Partitions
+whose fingerprint matches the manifest are left as they are, partitions that no
+longer exist are deleted.
+"""
+from datetime import datetime
+import hashlib
+import json
+import os
+import shutil
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from asset_metrics import get_connection
+
+# Mart -> the column its files are partitioned by (None for a single file)
+MARTS = {
+    "dim_user": None,
+    "dim_product": "date_key",
+    "dim_date": None,
+    "fct_daily_revenue": "revenue_date",
+    "fct_returned_items": "return_date",
+}
+MANIFEST = "manifest.json"
+# Rows per round trip and per Parquet row group, which bounds the memory used
+BATCH_ROWS = 10000
+# Partition key of unpartitioned marts
+WHOLE_TABLE = "all"
+
+ARROW_TYPES = {
+    "smallint": pa.int16(),
+    "integer": pa.int32(),
+    "bigint": pa.int64(),
+    "real": pa.float32(),
+    "double precision": pa.float64(),
+    "boolean": pa.bool_(),
+    "date": pa.date32(),
+    "timestamp without time zone": pa.timestamp("us"),
+    "timestamp with time zone": pa.timestamp("us", tz="UTC"),
+    "text": pa.string(),
+    "character varying": pa.string(),
+    "character": pa.string(),
+}
+
+
+def mart_columns(cur, mart):
+    """(name, select expression, Arrow type) of each column, empty if the mart isn't built"""
+    cur.execute("""
+        SELECT column_name, data_type, numeric_precision, numeric_scale
+        FROM information_schema.columns
+        WHERE table_schema = 'marts' AND table_name = %s
+        ORDER BY ordinal_position
+    """, (mart,))
+    columns = []
+    for name, data_type, precision, scale in cur.fetchall():
+        if data_type == "numeric" and precision is not None:
+            columns.append((name, name, pa.decimal128(precision, scale or 0)))
+        elif data_type == "numeric":
+            columns.append((name, f"{name}::double precision", pa.float64()))
+        elif data_type in ARROW_TYPES:
+            columns.append((name, name, ARROW_TYPES[data_type]))
+        else:
+            columns.append((name, f"{name}::text", pa.string()))
+    return columns
+
+
+def fingerprints(cur, mart, partition_column, columns):
+    """Partition key -> fingerprint of its rows (and of the columns, so a schema change re-exports)"""
+    key = f"{partition_column}::text" if partition_column else f"'{WHOLE_TABLE}'"
+    cur.execute(f"""
+        SELECT {key}, COUNT(*), SUM(hashtextextended(t::text, 0))
+        FROM marts.{mart} t
+        GROUP BY 1
+    """)
+    schema = hashlib.sha256(repr([(name, str(type_)) for name, _, type_ in columns]).encode()).hexdigest()[:8]
+    return {partition: f"{schema}:{rows}:{hash_sum}" for partition, rows, hash_sum in cur.fetchall()}
+
+
+def partition_file(mart, partition_column, partition):
+    if partition_column is None:
+        return os.path.join(mart, "part-0.parquet")
+    return os.path.join(mart, f"{partition_column}={partition}", "part-0.parquet")
+
+
+def write_partition(conn, mart, columns, partition_column, partition, path):
+    """Stream one partition into a Parquet file, BATCH_ROWS at a time, and return its row count"""
+    schema = pa.schema([(name, type_) for name, _, type_ in columns])
+    select = ", ".join(expression for _, expression, _ in columns)
+    where, params = "", ()
+    if partition_column is not None:
+        where, params = f"WHERE {partition_column} = %s", (partition,)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    rows = 0
+    # A named cursor keeps the result on the server and fetches it batch by batch
+    with conn.cursor(name=f"export_{mart}") as cur, \
+            pq.ParquetWriter(path + ".tmp", schema, compression="zstd") as writer:
+        cur.itersize = BATCH_ROWS
+        cur.execute(f"SELECT {select} FROM marts.{mart} {where} ORDER BY 1", params)
+        while True:
+            batch = cur.fetchmany(BATCH_ROWS)
+            if not batch:
+                break
+            arrays = [pa.array(values, type_) for values, (_, _, type_) in zip(zip(*batch), columns)]
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            rows += len(batch)
+    os.replace(path + ".tmp", path)
+    return rows
+
+
+def load_manifest(export_dir):
+    path = os.path.join(export_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {"marts": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def export_marts(export_dir, marts=MARTS):
+    """Export the changed partitions of every mart into export_dir and rewrite its manifest.
+    Returns the manifest and, per mart, how many partitions/rows/bytes were written."""
+    manifest = load_manifest(export_dir)
+    stats = {}
+
+    conn = get_connection()
+    # Fingerprints and exported rows come from one snapshot, so the manifest matches the files
+    conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+
+    for mart, partition_column in marts.items():
+        with conn.cursor() as cur:
+            columns = mart_columns(cur, mart)
+            if not columns:
+                continue
+            current = fingerprints(cur, mart, partition_column, columns)
+        file_columns = [column for column in columns if column[0] != partition_column]
+
+        previous = manifest["marts"].get(mart, {}).get("partitions", {})
+        mart_stats = {"written": 0, "unchanged": 0, "deleted": 0, "rows": 0, "bytes": 0}
+        partitions = {}
+        for partition, fingerprint in sorted(current.items()):
+            entry = previous.get(partition)
+            if entry and entry["fingerprint"] == fingerprint and os.path.exists(os.path.join(export_dir, entry["file"])):
+                partitions[partition] = entry
+                mart_stats["unchanged"] += 1
+                continue
+
+            file = partition_file(mart, partition_column, partition)
+            path = os.path.join(export_dir, file)
+            rows = write_partition(conn, mart, file_columns, partition_column, partition, path)
+            partitions[partition] = {"file": file, "rows": rows, "bytes": os.path.getsize(path), "fingerprint": fingerprint}
+            mart_stats["written"] += 1
+            mart_stats["rows"] += rows
+            mart_stats["bytes"] += partitions[partition]["bytes"]
+
+        for partition in previous.keys() - current.keys():
+            shutil.rmtree(os.path.dirname(os.path.join(export_dir, previous[partition]["file"])), ignore_errors=True)
+            mart_stats["deleted"] += 1
+
+        manifest["marts"][mart] = {
+            "partition_column": partition_column,
+            "columns": [{"name": name, "type": str(type_)} for name, _, type_ in columns],
+            "rows": sum(entry["rows"] for entry in partitions.values()),
+            "partitions": partitions,
+        }
+        stats[mart] = mart_stats
+
+    conn.rollback()
+    conn.close()
+
+    manifest["exported_at"] = datetime.now().isoformat(timespec="seconds")
+    path = os.path.join(export_dir, MANIFEST)
+    os.makedirs(export_dir, exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+    return manifest, stats
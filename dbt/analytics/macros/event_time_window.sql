@@ -0,0 +1,12 @@
+{% macro event_time_window(column, watermark_column='data_through') -%}
+    {#- Incremental runs keep rows newer than the model's event-time watermark, minus
+        the allowed lateness for events committed after later ones. Full builds, and a
+        model that doesn't have the watermark column yet, keep everything. -#}
+    {%- set columns = adapter.get_columns_in_relation(this) | map(attribute='name') | list if is_incremental() else [] -%}
+    {%- if watermark_column in columns -%}
+        {{ column }} > (select coalesce(max({{ watermark_column }}), '-infinity') from {{ this }})
+            - interval '{{ var("lateness_hours", 3) }} hours'
+    {%- else -%}
+        true
+    {%- endif -%}
+{%- endmacro %}
@@ -1,9 +1,14 @@
 {% macro generate_schema_name(custom_schema_name, node)-%}
 
+    {#- Sampled builds go to schemas of their own per sample size (marts_sample_5 for
+        5%), so they never merge into the full incremental marts, or another sample's,
+        or get read in their place -#}
+    {%- set pct = var('sample_pct', none) -%}
+    {%- set suffix = '_sample_' ~ ((pct | float | string).rstrip('0').rstrip('.') | replace('.', '_')) if pct else '' -%}
     {%- if custom_schema_name is none -%}
-        {{ target.schema }}
+        {{ target.schema }}{{ suffix }}
     {%- else -%}
-        {{ custom_schema_name | trim }}
+        {{ custom_schema_name | trim }}{{ suffix }}
     {%- endif -%}
 
-{%- endmacro %}
\ No newline at end of file
+{%- endmacro %}
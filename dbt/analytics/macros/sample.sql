@@ -0,0 +1,33 @@
+{% macro in_sample(user_id) -%}
+    {#- With --vars '{sample_pct: 5}', keeps about 5% of users, picked by a hash of the
+        user id so a user's logins, signup, sessions and orders are kept or dropped together.
+        Without the var, keeps everything. From the command line, also pass
+        --target-path target/sample so target/manifest.json (which Dagster reads) keeps
+        naming the full relations. -#}
+    {%- set pct = var('sample_pct', none) -%}
+    {%- if pct -%}
+        mod(abs(hashtext({{ user_id }})::bigint), 10000) < {{ (pct | float * 100) | round | int }}
+    {%- else -%}
+        true
+    {%- endif -%}
+{%- endmacro %}
+
+
+{% macro in_sampled_orders(order_id) -%}
+    {#- For rows that only carry an order id: keeps those of the sampled users' orders -#}
+    {%- if var('sample_pct', none) -%}
+        {{ order_id }} in (select order_id from {{ source('raw', 'orders') }} where {{ in_sample('user_id') }})
+    {%- else -%}
+        true
+    {%- endif -%}
+{%- endmacro %}
+
+
+{% macro record_sample() -%}
+    {#- Post-hook: the comment of every model says whether it was built from a sample -#}
+    {%- set pct = var('sample_pct', none) -%}
+    {%- set relation_type = 'view' if model.config.materialized == 'view' else 'table' -%}
+    comment on {{ relation_type }} {{ this }} is '{{
+        "sample: " ~ pct ~ "% of users by hashtext(user_id)" if pct else "full build"
+    }}, built {{ run_started_at.strftime("%Y-%m-%d %H:%M:%S") }}'
+{%- endmacro %}
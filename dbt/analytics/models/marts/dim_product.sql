@@ -1,22 +1,38 @@
-
 {{
     config(
         materialized = 'incremental',
-        unique_key = ['product_id', 'date_key']
+        unique_key = ['product_id', 'date_key'],
+        indexes = [{'columns': ['date_key']}]
     )
 }}
 
-{% set run_date = var('run_date', 'current_date') %}
+{% set run_date = var('run_date', none) %}
+{% set through_date = run_date or run_started_at.strftime('%Y-%m-%d') %}
 
 
-with price_update as (
+-- A backfill builds its run_date. Otherwise every day from the last one built
+-- (again, for orders that arrived after that run) through today.
+with run_dates as (
+    {% if is_incremental() and not run_date %}
+    select generate_series(
+        least((select max(date_key) from {{ this }}), '{{ through_date }}'::date)
+        , '{{ through_date }}'::date
+        , interval '1 day'
+    )::date as date_key
+    {% else %}
+    select '{{ through_date }}'::date as date_key
+    {% endif %}
+)
+, price_update as (
     select oi.product_id
+        , o.order_date as date_key
         , unit_price as product_price
     from {{ ref('stg_order_items') }} oi
     inner join {{ ref('stg_orders') }} o
         on oi.order_id = o.order_id
-    where o.order_date = '{{ run_date }}'
+    where o.order_date in (select date_key from run_dates)
     group by oi.product_id
+        , o.order_date
         , unit_price
 )
 
@@ -25,7 +41,9 @@ select p.product_id
     , p.product_brand
     , p.product_name
     , coalesce(pu.product_price, p.product_price) as product_price
-    , '{{ run_date }}'::date as date_key
+    , d.date_key
 from {{ ref('stg_products') }} p
+cross join run_dates d
 left join price_update pu
-    on p.product_id = pu.product_id
\ No newline at end of file
+    on p.product_id = pu.product_id
+    and pu.date_key = d.date_key
@@ -0,0 +1,68 @@
+{{
+    config(
+        materialized = 'incremental',
+        unique_key = 'user_id',
+        on_schema_change = 'append_new_columns',
+        indexes = [{'columns': ['data_through']}]
+    )
+}}
+
+-- dim_user without the columns that change with the date of the query, which
+-- dim_user adds on top. Incremental runs rebuild only the users with signups,
+-- logins or orders since the last run.
+with changed_users as (
+    select user_id
+    from {{ ref('stg_signup_events') }}
+    where {{ event_time_window('event_timestamp') }}
+    union
+    select user_id
+    from {{ ref('stg_login_events') }}
+    where {{ event_time_window('event_timestamp') }}
+    union
+    select user_id
+    from {{ ref('stg_orders') }}
+    where {{ event_time_window('event_timestamp') }}
+)
+, logins as (
+    select user_id
+        , min(event_date) as first_login_date
+        , max(event_date) as last_login_date
+        , count(event_date) as total_logins
+        , count(distinct event_date) as login_days
+        , max(event_timestamp) as last_login_at
+    from {{ ref('stg_login_events')}}
+    where user_id in (select user_id from changed_users)
+    group by user_id
+)
+, purchases as (
+    select user_id
+        , min(order_date) as first_purchase_date
+        , max(order_date) as last_purchase_date
+        , count(order_id) as total_orders
+        , max(event_timestamp) as last_purchase_at
+    from {{ ref('stg_orders')}}
+    where user_id in (select user_id from changed_users)
+    group by user_id
+)
+select su.user_id
+    , su.signup_date
+    , l.first_login_date
+    , l.first_login_date - su.signup_date as days_to_first_login
+    , l.last_login_date
+    , l.total_logins
+    , l.login_days
+    , su.signup_method
+    , su.country
+    , su.state
+    , su.city
+    , case when p.user_id is not null then TRUE else FALSE end as has_purchased
+    , p.first_purchase_date
+    , p.first_purchase_date - l.first_login_date as days_to_first_purchase
+    , p.last_purchase_date
+    , greatest(su.event_timestamp, l.last_login_at, p.last_purchase_at) as data_through
+from {{ ref('stg_signup_events')}} su
+left join logins l
+    on su.user_id = l.user_id
+left join purchases p
+    on su.user_id = p.user_id
+where su.user_id in (select user_id from changed_users)
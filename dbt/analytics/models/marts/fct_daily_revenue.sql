@@ -0,0 +1,134 @@
+{{
+    config(
+        materialized = 'incremental',
+        unique_key = ['revenue_date', 'product_category'],
+        indexes = [{'columns': ['revenue_date']}]
+    )
+}}
+
+-- Money in and out per day and product category. Sales count on the day the order
+-- was placed, refunds and returns on the day they were paid out, however long after
+-- the order that is. Discounts, tax and shipping are per order, and so are the
+-- refunds of cancelled orders: they are split over the order's categories by their
+-- share of its line totals. Returns list their items, so they go to the items' categories.
+--
+-- Incremental runs rebuild the dates of orders newer than orders_through (less the
+-- allowed lateness) and of refund/return events after refund_event_id.
+with new_orders as (
+    select order_date as revenue_date
+    from {{ ref('stg_orders') }}
+    where {{ event_time_window('event_timestamp', 'orders_through') }}
+)
+, new_refunds as (
+    select refund_return_date as revenue_date
+    from {{ ref('stg_refund_return_events') }}
+    {% if is_incremental() %}
+    where event_id > (select coalesce(max(refund_event_id), 0) from {{ this }})
+    {% endif %}
+)
+, run_dates as (
+    select revenue_date from new_orders
+    union
+    select revenue_date from new_refunds
+)
+, run_orders as (
+    select order_id
+        , order_date
+        , discount_amount
+        , tax
+        , shipping
+    from {{ ref('stg_orders') }}
+    where order_date in (select revenue_date from run_dates)
+)
+, run_refunds as (
+    select order_id
+        , refund_return_date as revenue_date
+        , event_type
+        , refund_amount
+    from {{ ref('stg_refund_return_events') }}
+    where refund_return_date in (select revenue_date from run_dates)
+)
+, order_categories as (
+    select order_id
+        , product_category
+        , sum(quantity) as units
+        , sum(line_total) as line_total
+        , sum(line_total) / nullif(sum(sum(line_total)) over (partition by order_id), 0) as share
+    from {{ ref('stg_order_items') }}
+    where order_id in (select order_id from run_orders)
+    or order_id in (select order_id from run_refunds where event_type = 'refund')
+    group by order_id
+        , product_category
+)
+, sales as (
+    select o.order_date as revenue_date
+        , oc.product_category
+        , count(*) as orders
+        , sum(oc.units) as units_sold
+        , sum(oc.line_total) as gross_sales
+        , sum(o.discount_amount * oc.share) as discounts
+        , sum(o.tax * oc.share) as tax
+        , sum(o.shipping * oc.share) as shipping
+    from run_orders o
+    inner join order_categories oc
+        on o.order_id = oc.order_id
+    group by o.order_date
+        , oc.product_category
+)
+, refunds as (
+    select r.revenue_date
+        , oc.product_category
+        , sum(r.refund_amount * oc.share) as refunds
+    from run_refunds r
+    inner join order_categories oc
+        on r.order_id = oc.order_id
+    where r.event_type = 'refund'
+    group by r.revenue_date
+        , oc.product_category
+)
+, returns as (
+    select return_date as revenue_date
+        , product_category
+        , sum(quantity) as units_returned
+        , sum(refund_amount) as returns
+    from {{ ref('fct_returned_items') }}
+    where return_date in (select revenue_date from run_dates)
+    group by return_date
+        , product_category
+)
+, grain as (
+    select revenue_date, product_category from sales
+    union
+    select revenue_date, product_category from refunds
+    union
+    select revenue_date, product_category from returns
+)
+
+select g.revenue_date
+    , g.product_category
+    , coalesce(s.orders, 0) as orders
+    , coalesce(s.units_sold, 0) as units_sold
+    , coalesce(rt.units_returned, 0) as units_returned
+    , round(coalesce(s.gross_sales, 0), 2) as gross_sales
+    , round(coalesce(s.discounts, 0), 2) as discounts
+    , round(coalesce(s.tax, 0), 2) as tax
+    , round(coalesce(s.shipping, 0), 2) as shipping
+    , round(coalesce(rf.refunds, 0), 2) as refunds
+    , round(coalesce(rt.returns, 0), 2) as returns
+    -- What customers paid for the day's orders, less what was paid back that day
+    , round(
+        coalesce(s.gross_sales, 0) - coalesce(s.discounts, 0) + coalesce(s.tax, 0) + coalesce(s.shipping, 0)
+        - coalesce(rf.refunds, 0) - coalesce(rt.returns, 0)
+    , 2) as net_revenue
+    , (select max(event_timestamp) from {{ ref('stg_orders') }}) as orders_through
+    , (select max(event_id) from {{ ref('stg_refund_return_events') }}) as refund_event_id
+from grain g
+left join sales s
+    on g.revenue_date = s.revenue_date
+    and g.product_category = s.product_category
+left join refunds rf
+    on g.revenue_date = rf.revenue_date
+    and g.product_category = rf.product_category
+left join returns rt
+    on g.revenue_date = rt.revenue_date
+    and g.product_category = rt.product_category
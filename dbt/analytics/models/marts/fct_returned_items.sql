@@ -0,0 +1,32 @@
+{{
+    config(
+        materialized = 'incremental',
+        unique_key = ['refund_event_id', 'item_number'],
+        indexes = [
+            {'columns': ['product_id']},
+            {'columns': ['return_date']},
+        ]
+    )
+}}
+
+-- One row per product of a return, typed out of returned_items so return rates by
+-- product are index lookups instead of a jsonb_array_elements over every refund.
+-- Events are only ever added, so incremental runs read the ones after the newest here.
+select r.event_id as refund_event_id
+    , item.item_number::int as item_number
+    , r.order_id
+    , item.value ->> 'product_id' as product_id
+    , item.value ->> 'product_name' as product_name
+    , item.value ->> 'product_category' as product_category
+    , (item.value ->> 'quantity')::int as quantity
+    , (item.value ->> 'unit_price')::numeric(10, 2) as unit_price
+    , (item.value ->> 'refund_amount')::numeric(10, 2) as refund_amount
+    , r.reason
+    , r.refund_return_date as return_date
+    , r.event_timestamp
+from {{ ref('stg_refund_return_events') }} r
+cross join lateral jsonb_array_elements(r.returned_items) with ordinality as item (value, item_number)
+where r.event_type = 'return'
+{% if is_incremental() %}
+and r.event_id > (select coalesce(max(refund_event_id), 0) from {{ this }})
+{% endif %}
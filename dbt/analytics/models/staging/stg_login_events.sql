@@ -16,3 +16,4 @@ select event_id
     , now()::timestamp(0) as load_timestamp
     , timestamp::timestamp(0) as event_timestamp
 from {{ source('raw', 'login_events')}}
+where {{ in_sample('user_id') }}
@@ -10,3 +10,4 @@ select order_item_id
     , line_total
     , now()::timestamp(0) as load_timestamp
 from {{ source('raw', 'order_items')}}
+where {{ in_sampled_orders('order_id') }}
@@ -11,3 +11,4 @@ select status_event_id
     , now()::timestamp(0) as load_timestamp
     , timestamp::timestamp(0) as event_timestamp
 from {{ source('raw', 'order_status_events')}}
+where {{ in_sampled_orders('order_id') }}
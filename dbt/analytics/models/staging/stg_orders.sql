@@ -12,4 +12,5 @@ select order_id
     , total
     , now()::timestamp(0) as load_timestamp
     , order_date::timestamp(0) as event_timestamp
-from {{ source('raw', 'orders')}}
\ No newline at end of file
+from {{ source('raw', 'orders')}}
+where {{ in_sample('user_id') }}
\ No newline at end of file
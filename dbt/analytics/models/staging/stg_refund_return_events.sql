@@ -11,4 +11,5 @@ select event_id
     , status
     , now()::timestamp(0) as load_timestamp
     , event_date::timestamp(0) as event_timestamp
-from {{ source('raw', 'refund_return_events')}}
\ No newline at end of file
+from {{ source('raw', 'refund_return_events')}}
+where {{ in_sampled_orders('order_id') }}
\ No newline at end of file
@@ -9,4 +9,5 @@ select event_id
     , parameters
     , now()::timestamp(0) as load_timestamp
     , timestamp::timestamp(0) as event_timestamp
-from {{ source('raw', 'session_events')}}
\ No newline at end of file
+from {{ source('raw', 'session_events')}}
+where {{ in_sample('user_id') }}
\ No newline at end of file
@@ -16,4 +16,5 @@ select signup_id
     , postal_code
     , now()::timestamp(0) as load_timestamp
     , timestamp::timestamp(0) as event_timestamp
-from {{ source('raw', 'signup_events')}}
\ No newline at end of file
+from {{ source('raw', 'signup_events')}}
+where {{ in_sample('user_id') }}
\ No newline at end of file
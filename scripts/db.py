@@ -0,0 +1,17 @@
+import psycopg2
+import os
+
+from telemetry import MetricsConnection, MetricsCursor
+
+
+def connect():
+    """Open an instrumented connection to the analytics database"""
+    return psycopg2.connect(
+        host=os.getenv("POSTGRES_HOST", "localhost"),  # Fallback to localhost
+        port=os.getenv("POSTGRES_PORT", "5432"),
+        database=os.getenv("POSTGRES_DB", "analytics_db"),
+        user=os.getenv("POSTGRES_USER", "analytics_user"),
+        password=os.getenv("POSTGRES_PASSWORD", "analytics_pass"),
+        connection_factory=MetricsConnection,
+        cursor_factory=MetricsCursor
+    )
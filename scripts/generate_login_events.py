@@ -1,132 +1,119 @@
-from faker import Faker
-import psycopg2
-import psycopg2.extras
 from datetime import datetime, timedelta
-import random
+import argparse
 import os
+import random
 import uuid
 
-fake = Faker()
-
-# Configurations
-
-# PRODUCTS = ['Product A', 'Product B', 'Product C']
-NEW_USER_PERCENTAGE = 0.2 # Weighted for 20% new users in incremental mode
-POWER_USERS_PERCENTAGE = 0.2 # Weighted for 20% of events from top 20% of users
-
-
-# Connect to Postgres
-
-conn = psycopg2.connect(
-    host=os.getenv("POSTGRES_HOST", "localhost"),  # Fallback to localhost
-    port=os.getenv("POSTGRES_PORT", "5432"),
-    database=os.getenv("POSTGRES_DB", "analytics_db"),
-    user=os.getenv("POSTGRES_USER", "analytics_user"),
-    password=os.getenv("POSTGRES_PASSWORD", "analytics_pass")
-)
-
-cur = conn.cursor()
-
-# Create raw schema and table
-
-cur.execute('CREATE SCHEMA IF NOT EXISTS raw;')
-
-cur.execute("""
-    CREATE TABLE IF NOT EXISTS raw.login_events (
-        event_id SERIAL PRIMARY KEY,
-        timestamp TIMESTAMP,
-        user_id VARCHAR(12),
-        session_id VARCHAR(50),
-        status VARCHAR(20),
-        ip_address VARCHAR(45),
-        parameters JSONB
-    );
-""")
-
-# Check if this is initialization or incremental load
-cur.execute("SELECT DISTINCT user_id FROM raw.login_events")
-existing_users = [row[0] for row in cur.fetchall()]
-
-if len(existing_users) == 0:
-    # Initial load -- First run
-    print("=" * 50)
-    print("INITIL LOAD MODE")
-    print("=" * 50)
-    mode = 'initial'
-    NUM_EVENTS = 400000
-    DAYS_BACK = 60
-    USER_POOL_SIZE = random.randint(25000, 45000)
-
-    # Generating fresh user pool
-    USER_POOL = [str(random.randint(100000000000, 999999999999)) for _ in range(USER_POOL_SIZE)]
-
-    # Date range
-    start_date = f'-{DAYS_BACK}d'
-    end_date = 'now'
-
-
-    print(f"Generating {NUM_EVENTS} login events across {DAYS_BACK} days")
-    print(f"User pool: {USER_POOL_SIZE} users")
-else:
-    print("=" * 50)
-    print("INCREMENTAL LOAD MODE")
-    print("=" * 50)
-    mode = 'incremental'
-    NUM_EVENTS = random.randint(5000, 15000)
-    num_new_users = int(len(existing_users) * NEW_USER_PERCENTAGE)
-    new_users = [str(random.randint(100000000000, 999999999999)) for _ in range(num_new_users)]
-    USER_POOL = existing_users + new_users
+import run_stats
+from sinks import open_sink, sink_arguments
+from user_pool import UserPool, cache_path, load_existing, merged, new_user_ids, sampler, save as save_user_pool
+from value_pools import ValuePools
+from workload import load_workload, reseed, workload_arguments
+
+# Event time (epoch seconds) the login events are generated up to
+EVENT_TIME_WATERMARK = "login_events.event_time"
+
+
+def build_user_pool(sink, workload, micro_batch=False, cache=None):
+    """Pick the mode from existing users and return (user pool, ids of its users not seen
+    before, events to generate, date range)"""
+
+    # Check if this is initialization or incremental load
+    existing_users, through_event_id = load_existing(sink, cache)
+    # Logins are drawn in sequence, so a seeded run continues from its position in the
+    # table rather than replaying the previous run's draws (and session ids)
+    reseed(workload, "login_events", through_event_id)
+
+    if len(existing_users) == 0:
+        # Initial load -- First run
+        print("=" * 50)
+        print("INITIL LOAD MODE")
+        print("=" * 50)
+        num_events = workload.initial_events
+        days_back = workload.history_days
+        user_pool_size = random.randint(*workload.initial_users)
+
+        # Generating fresh user pool
+        new_users = new_user_ids(user_pool_size, existing_users)
+        user_pool = UserPool([new_users])
+
+        # Date range
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=days_back)
+
+        print(f"Generating {num_events} login events across {days_back} days")
+        print(f"User pool: {user_pool_size} users")
+    elif micro_batch:
+        # The slice of event time since the last run, with daily volumes prorated to it
+        print("=" * 50)
+        print("MICRO-BATCH MODE")
+        print("=" * 50)
+        end_date = datetime.now()
+        event_time = sink.watermark(EVENT_TIME_WATERMARK)
+        start_date = datetime.fromtimestamp(event_time) if event_time else end_date - timedelta(days=1)
+        day_fraction = max((end_date - start_date).total_seconds(), 0) / 86400
+
+        num_events = round(random.randint(*workload.daily_events) * day_fraction)
+        num_new_users = round(len(existing_users) * workload.new_user_rate * day_fraction)
+        new_users = new_user_ids(num_new_users, existing_users)
+        user_pool = UserPool([*existing_users.parts, new_users])
+
+        print(f"Generating {num_events} login events from {start_date:%Y-%m-%d %H:%M} to {end_date:%H:%M}")
+        print(f"Existing Users: {len(existing_users)}")
+        print(f"New Users: {len(new_users)}")
+    else:
+        print("=" * 50)
+        print("INCREMENTAL LOAD MODE")
+        print("=" * 50)
+        num_events = random.randint(*workload.daily_events)
+        num_new_users = int(len(existing_users) * workload.new_user_rate)
+        new_users = new_user_ids(num_new_users, existing_users)
+        user_pool = UserPool([*existing_users.parts, new_users])
 
-    # Date range
-    start_date = 'now'
-    end_date = 'now'
+        # Date range
+        start_date = datetime.now()
+        end_date = start_date
 
+        print(f"Generating {num_events} login events for today")
+        print(f"Existing Users: {len(existing_users)}")
+        print(f"New Users: {len(new_users)}")
+        print(f"Total User pool: {len(user_pool)} users")
 
-    print(f"Generating {NUM_EVENTS} login events for today")
-    print(f"Existing Users: {len(existing_users)}")
-    print(f"New Users: {len(new_users)}")
-    print(f"Total User pool: {len(USER_POOL)} users")
+    print("-" * 50)
+    return user_pool, new_users, num_events, start_date, end_date
 
-print("-" * 50)
 
-power_user_cutoff = int(len(USER_POOL) * 0.2)
-power_users = USER_POOL[:power_user_cutoff]
+def make_login_event(workload, pools, users, power_users, timestamp):
+    """One raw.login_events row at timestamp, its user drawn from the user_pool.sampler
+    of the whole pool or the one of the power users"""
 
-for i in range(NUM_EVENTS):
     # Select users (weighted towards power users)
-    if random.random() < POWER_USERS_PERCENTAGE:
-        user_id = random.choice(power_users)
+    if random.random() < workload.power_user_rate:
+        user_id = next(power_users)
     else:
-        user_id = random.choice(USER_POOL)
-
-    # Generate random timestamp within data range
-    timestamp = fake.date_time_between(
-        start_date = start_date,
-        end_date = end_date
-    )
-
-    # product_name = random.choice(PRODUCTS)
+        user_id = next(users)
 
     status = random.choices(['success', 'failed'], weights=[0.8, 0.2])[0]
 
-    session_id = str(uuid.uuid4()) if status == 'success' else None
+    # Drawn from random (not uuid4) so a seeded run repeats
+    session_id = str(uuid.UUID(int=random.getrandbits(128), version=4)) if status == 'success' else None
 
     device_type = random.choice(['mobile', 'broswer'])
 
     # OS based on device tyoe
     if device_type == 'mobile':
-        os = random.choice(['ios', 'android'])
+        operating_system = random.choice(['ios', 'android'])
     else:
-        os = random.choice(['pc', 'mac', 'linux'])
+        operating_system = random.choice(['pc', 'mac', 'linux'])
 
     # Build parameters JSON
     parameters = {
         'device_type': device_type,
-        'os': os,
-        'mac_address': fake.mac_address(),
+        'os': operating_system,
+        'mac_address': pools.mac_address.sample(),
         'login_method': random.choice(['password', 'sso', 'oauth', 'biometric']),
-        'country': fake.country_code(),
-        'city': fake.city()
+        'country': pools.country_code.sample(),
+        'city': pools.city.sample()
     }
 
     # Add browser or app_version based on device
@@ -145,54 +132,122 @@ for i in range(NUM_EVENTS):
             'network_error'
         ])
 
-    # Insert into database
-    cur.execute("""
-        INSERT INTO raw.login_events
-        (timestamp, user_id, session_id, status, ip_address, parameters)
-        VALUES (%s, %s, %s, %s, %s, %s)
-    """, (
+    return (
         timestamp,
         user_id,
         session_id,
         status,
-        fake.ipv4(),
-        psycopg2.extras.Json(parameters)
-    ))
-
-    if (i + 1) % 100 == 0:
-        print(f"   Generated {i + 1} events...")
-
-conn.commit()
-print("-" * 50)
-print(f"✅ Successfully generated {NUM_EVENTS} login events")
-
-# Show summary stats
-print("\n" + "=" * 50)
-print("DATABASE SUMMARY")
-print("=" * 50)
-
-if mode == 'initial':
-
-    cur.execute("SELECT COUNT(*) FROM raw.login_events")
-    total_events = cur.fetchone()[0]
-    print(f"Total events in database: {total_events}")
-
-    cur.execute("SELECT COUNT(DISTINCT user_id) FROM raw.login_events")
-    total_users = cur.fetchone()[0]
-    print(f"Total unique users: {total_users}")
-
-    cur.execute("SELECT MIN(date(timestamp)), MAX(date(timestamp)) FROM raw.login_events")
-    date_range_result = cur.fetchone()
-    print(f"Date range: {date_range_result[0]} to {date_range_result[1]}")
-
-else:
-    cur.execute("SELECT COUNT(*) FROM raw.login_events where date(timestamp) = date(now())")
-    daily_events = cur.fetchone()[0]
-    print(f"Todays total events: {daily_events}")
+        pools.ipv4.sample(),
+        parameters
+    )
 
-    cur.execute("SELECT COUNT(DISTINCT user_id) from raw.login_events where date(timestamp) = date(now())")
-    daily_unique_users = cur.fetchone()[0]
-    print(f"Unique users today: {daily_unique_users}")
 
-cur.close()
-conn.close()
+def generate_login_events(sink, workload, pools, user_pool, num_events, start_date, end_date, recorder=None):
+    """Write num_events logins and return the set of users that logged in. With a
+    login_batch.BatchRecorder, every row is also kept for the batch file."""
+    power_user_cutoff = int(len(user_pool) * 0.2)
+    users = sampler(user_pool)
+    power_users = sampler(user_pool.head(power_user_cutoff))
+
+    window_seconds = (end_date - start_date).total_seconds()
+    active_users = set()
+
+    for i in range(num_events):
+        # Generate random timestamp within data range
+        timestamp = start_date + timedelta(seconds=random.uniform(0, window_seconds))
+
+        row = make_login_event(workload, pools, users, power_users, timestamp)
+        sink.write("raw.login_events", row)
+        active_users.add(row[1])
+        if recorder is not None:
+            recorder.add(row)
+
+        # Commit per batch so large loads don't hold one huge transaction open
+        if (i + 1) % workload.batch_size == 0:
+            print(f"   Generated {i + 1} events...")
+            sink.commit()
+
+    sink.commit()
+    print("-" * 50)
+    print(f"✅ Successfully generated {num_events} login events")
+    return active_users
+
+
+def main(argv=None, sink=None):
+    parser = argparse.ArgumentParser(parents=[workload_arguments(), sink_arguments()])
+    parser.add_argument('--micro-batch', action='store_true',
+                        default=os.getenv("GENERATOR_MICRO_BATCH", "").lower() in ("1", "true"),
+                        help='Generate the event time since the last run instead of a day of events '
+                             '(default: $GENERATOR_MICRO_BATCH)')
+    parser.add_argument('--batch-out', default=os.getenv("LOGIN_BATCH_OUT"),
+                        help='Also write the generated logins to this Arrow file, for the signup and session '
+                             'generators to take instead of reading them back (default: $LOGIN_BATCH_OUT)')
+    parser.add_argument('--user-pool-cache', default=os.getenv("USER_POOL_CACHE"),
+                        help='Directory to keep the user pool in between runs, memory-mapped instead of '
+                             'read from raw.login_events every run (default: $USER_POOL_CACHE)')
+    args = parser.parse_args(argv)
+    workload = load_workload(args)
+
+    # Precomputed Faker values, sampled by index instead of calling Faker per event
+    pools = ValuePools(workload.value_pools)
+
+    owns_sink = sink is None
+    if owns_sink:
+        sink = open_sink(args, workload.batch_size)
+    sink.ensure_tables("raw.login_events")
+    if not sink.begin_run("login_events", args.run_id):
+        print(f"✅ Run {sink.run_id} already completed, nothing to do")
+        if owns_sink:
+            sink.close()
+        return
+
+    cache = None
+    if args.user_pool_cache and args.sink in ("postgres", "file"):
+        target = args.output_dir if args.sink == "file" else \
+            f"{os.getenv('POSTGRES_HOST', 'localhost')}:{os.getenv('POSTGRES_PORT', '5432')}/{os.getenv('POSTGRES_DB', 'analytics_db')}"
+        cache = cache_path(args.user_pool_cache, f"{args.sink}:{target}")
+
+    user_pool, new_ids, num_events, start_date, end_date = build_user_pool(sink, workload, args.micro_batch, cache)
+    # As strings, like the user_id of the rows
+    new_users = {str(user_id) for user_id in new_ids}
+
+    recorder = None
+    if args.batch_out:
+        # pyarrow is only needed when batches are handed on
+        import login_batch
+        after_id = sink.high_water("raw.login_events", "login_events")
+        sink.collect_ids("raw.login_events", "event_id")
+        recorder = login_batch.BatchRecorder()
+
+    active_users = generate_login_events(sink, workload, pools, user_pool, num_events, start_date, end_date, recorder)
+    sink.set_watermark(EVENT_TIME_WATERMARK, int(end_date.timestamp()))
+    print(f"Active users: {len(active_users)} ({len(active_users & new_users)} new)")
+
+    # Kept as a running total in the catalog instead of a COUNT(DISTINCT) per run
+    sink.add_stat("raw.login_events", "distinct_users", len(active_users & new_users))
+    sink.finish_run()
+
+    if cache:
+        # The users now in raw.login_events: the pool less the new users that didn't log in
+        logged_in = [user_id for user_id in new_ids if str(user_id) in active_users]
+        existing = user_pool.head(len(user_pool) - len(new_ids))
+        through_event_id = sink.high_water("raw.login_events", "login_events")
+        save_user_pool(cache, UserPool([merged(existing, logged_in)]), through_event_id,
+                       sink.login_fingerprint(through_event_id) if through_event_id else None)
+
+    if recorder is not None:
+        batch = recorder.table(sink.inserted_ids["raw.login_events"], after_id)
+        login_batch.write_batch(batch, args.batch_out)
+        print(f"Wrote the batch of {batch.num_rows} logins to {args.batch_out}")
+
+    # Show summary stats
+    if sink.connection is not None:
+        with sink.connection.cursor() as cur:
+            run_stats.print_summary(cur, ["raw.login_events"], sink.stats.run_totals)
+
+    if owns_sink:
+        sink.close()
+
+
+if __name__ == "__main__":
+    main()
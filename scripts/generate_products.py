@@ -1,10 +1,9 @@
-import psycopg2
-import psycopg2.extras
-from faker import Faker
+import argparse
 import random
-import os
 
-fake = Faker()
+from sinks import open_sink, sink_arguments
+from value_pools import ValuePools
+from workload import load_workload, workload_arguments
 
 # Product categories and realistic products
 PRODUCT_CATALOG = {
@@ -70,56 +69,69 @@ PRODUCT_CATALOG = {
     ]
 }
 
-# Connect to Postgres
-conn = psycopg2.connect(
-    host=os.getenv("POSTGRES_HOST", "localhost"),  # Fallback to localhost
-    port=os.getenv("POSTGRES_PORT", "5432"),
-    database=os.getenv("POSTGRES_DB", "analytics_db"),
-    user=os.getenv("POSTGRES_USER", "analytics_user"),
-    password=os.getenv("POSTGRES_PASSWORD", "analytics_pass")
-)
-cur = conn.cursor()
-
-# Create products table
-cur.execute("""
-CREATE TABLE IF NOT EXISTS raw.products (
-    product_id VARCHAR(20) PRIMARY KEY,
-    product_name VARCHAR(200),
-    product_category VARCHAR(100),
-    product_price DECIMAL(10,2),
-    product_brand VARCHAR(100),
-    created_at TIMESTAMP DEFAULT NOW()
-);
-""")
-
-print("Generating products...")
-
-product_count = 0
-for category, products in PRODUCT_CATALOG.items():
-    for product_name, base_price in products:
+# Cycle through the catalog until it reaches the workload's size; repeats become new models
+BASE_PRODUCTS = [
+    (category, product_name, base_price)
+    for category, products in PRODUCT_CATALOG.items()
+    for product_name, base_price in products
+]
+
+
+def generate_products(sink, workload, pools):
+    print("Generating products...")
+
+    product_count = 0
+    for i in range(workload.catalog_size):
+        category, product_name, base_price = BASE_PRODUCTS[i % len(BASE_PRODUCTS)]
+        generation = i // len(BASE_PRODUCTS)
+        if generation > 0:
+            product_name = f"{product_name} Gen {generation + 1}"
+
         product_count += 1
         product_id = f"PROD_{product_count:04d}"
-        
+
         # Add some price variation
         price = round(base_price * random.uniform(0.9, 1.1), 2)
-        
+
         # Generate a fake brand
-        brand = fake.company()
-        
-        cur.execute("""
-            INSERT INTO raw.products (product_id, product_name, product_category, product_price, product_brand)
-            VALUES (%s, %s, %s, %s, %s)
-        """, (product_id, product_name, category, price, brand))
+        brand = pools.company.sample()
+
+        sink.write("raw.products", (product_id, product_name, category, price, brand))
+
+    sink.commit()
+
+    print(f"✅ Generated {product_count} products")
+
+
+def main(argv=None, sink=None):
+    parser = argparse.ArgumentParser(parents=[workload_arguments(), sink_arguments()])
+    args = parser.parse_args(argv)
+    workload = load_workload(args)
+    pools = ValuePools(workload.value_pools)
+
+    owns_sink = sink is None
+    if owns_sink:
+        sink = open_sink(args, workload.batch_size)
+
+    # Create products table
+    sink.ensure_tables("raw.products")
+    if not sink.begin_run("products", args.run_id):
+        print(f"✅ Run {sink.run_id} already completed, nothing to do")
+        if owns_sink:
+            sink.close()
+        return
+
+    generate_products(sink, workload, pools)
+    sink.finish_run()
 
-conn.commit()
+    # Show sample
+    print("\nSample products:")
+    for row in sink.products()[:5]:
+        print(row)
 
-print(f"✅ Generated {product_count} products")
+    if owns_sink:
+        sink.close()
 
-# Show sample
-cur.execute("SELECT * FROM raw.products LIMIT 5")
-print("\nSample products:")
-for row in cur.fetchall():
-    print(row)
 
-cur.close()
-conn.close()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
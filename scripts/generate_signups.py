@@ -1,103 +1,139 @@
-from faker import Faker
-import psycopg2
 from datetime import timedelta
+import argparse
 import os
 
-fake = Faker()
-
-conn = psycopg2.connect(
-    host=os.getenv("POSTGRES_HOST", "localhost"),  # Fallback to localhost
-    port=os.getenv("POSTGRES_PORT", "5432"),
-    database=os.getenv("POSTGRES_DB", "analytics_db"),
-    user=os.getenv("POSTGRES_USER", "analytics_user"),
-    password=os.getenv("POSTGRES_PASSWORD", "analytics_pass")
-)
-cur = conn.cursor()
-
-# Create signup_events table
-cur.execute("CREATE SCHEMA IF NOT EXISTS raw;")
-
-cur.execute("""
-CREATE TABLE IF NOT EXISTS raw.signup_events (
-    signup_id SERIAL PRIMARY KEY,
-    user_id VARCHAR(12),
-    timestamp TIMESTAMP,
-    email VARCHAR(100),
-    first_name VARCHAR(50),
-    last_name VARCHAR(50),
-    address VARCHAR(200),
-    city VARCHAR(100),
-    state VARCHAR(50),
-    postal_code VARCHAR(20),
-    country VARCHAR(10),
-    signup_method VARCHAR(50)
-);
-""")
-
-# Find users without signup records (incremental detection)
-cur.execute("""
-    SELECT l.user_id, MIN(l.timestamp) as first_login
-    FROM raw.login_events l
-    LEFT JOIN raw.signup_events s ON l.user_id = s.user_id
-    WHERE s.user_id IS NULL
-    GROUP BY l.user_id
-    ORDER BY first_login
-""")
-
-new_users = cur.fetchall()
-
-if len(new_users) == 0:
-    print("✅ No new users to process. All users have signup records.")
-    cur.close()
-    conn.close()
-    exit()
-
-print("=" * 50)
-print(f"GENERATING SIGNUP EVENTS FOR {len(new_users)} NEW USERS")
-print("=" * 50)
-
-for i, (user_id, first_login) in enumerate(new_users):
-    # Signup happens 1-60 minutes before first login
-    signup_time = first_login - timedelta(minutes=fake.random_int(min=1, max=60))
-    
-    # Generate user details
-    first_name = fake.first_name()
-    last_name = fake.last_name()
-    email = f"{first_name.lower()}.{last_name.lower()}{fake.random_int(min=1, max=999)}@{fake.free_email_domain()}"
-    
-    signup_method = fake.random_element(['email', 'google', 'facebook', 'apple'])
-    
-    cur.execute("""
-        INSERT INTO raw.signup_events 
-        (user_id, timestamp, email, first_name, last_name, address, city, state, postal_code, country, signup_method)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-    """, (
-        user_id,
-        signup_time,
-        email,
-        first_name,
-        last_name,
-        fake.street_address(),
-        fake.city(),
-        fake.state(),
-        fake.postcode(),
-        fake.country_code(),
-        signup_method
-    ))
-    
-    if (i + 1) % 1000 == 0:
-        print(f"  Processed {i + 1} users...")
-        conn.commit()
-
-conn.commit()
-
-# Summary
-cur.execute("SELECT COUNT(*) FROM raw.signup_events")
-total_signups = cur.fetchone()[0]
-
-print("-" * 50)
-print(f"✅ Generated {len(new_users)} new signup events")
-print(f"Total signups in database: {total_signups}")
-
-cur.close()
-conn.close()
\ No newline at end of file
+import run_stats
+from generate_login_events import EVENT_TIME_WATERMARK as LOGIN_TIME_WATERMARK
+from keyed_random import stream
+from sinks import open_sink, sink_arguments
+from value_pools import ValuePools
+from workload import load_workload, workload_arguments
+
+# Last login event_id whose users all have a signup
+LOGIN_WATERMARK = "signup_events.login_event_id"
+# Login event time (epoch seconds) covered, for freshness reporting
+EVENT_TIME_WATERMARK = "signup_events.event_time"
+# Signups per commit. Kept apart from the workload's batch_size (which sizes fetches,
+# flushes and progress output), so an interrupted run loses at most this many.
+COMMIT_EVERY = 1000
+
+
+def users_without_signup(sink, last_login, high_water, login_batch_path=None):
+    """Users of the logins since last_login that have no signup, taken from the login
+    run's batch file when it holds exactly those logins"""
+    if login_batch_path and os.path.exists(login_batch_path):
+        import login_batch
+        batch = login_batch.read_batch(login_batch_path)
+        if login_batch.covers(batch, last_login, high_water):
+            print(f"Using the {batch.num_rows} logins of {login_batch_path}")
+            first_logins = login_batch.first_logins(batch, last_login)
+            signed_up = sink.signed_up(user_id for user_id, _ in first_logins)
+            return [(user_id, first_login) for user_id, first_login in first_logins if user_id not in signed_up]
+        print(f"{login_batch_path} is not the latest logins, reading them from the table")
+    return sink.users_without_signup(last_login, high_water)
+
+
+def generate_signups(sink, workload, pools, login_batch_path=None):
+    """Write a signup for every user with logins but no signup record, returns how many"""
+
+    print("=" * 50)
+    print("GENERATING SIGNUP EVENTS FOR NEW USERS")
+    print("=" * 50)
+
+    # Only logins since the last run can belong to users without a signup. Without a
+    # watermark every login is checked once.
+    last_login = sink.watermark(LOGIN_WATERMARK)
+    high_water = sink.high_water("raw.login_events", "login_events")
+    login_time = sink.watermark(LOGIN_TIME_WATERMARK)
+
+    # Find users without signup records (incremental detection)
+    new_signups = 0
+    for i, (user_id, first_login) in enumerate(users_without_signup(sink, last_login, high_water, login_batch_path)):
+        # The user's profile comes from their own stream, the same in any batch
+        rng = stream(workload, "user", user_id)
+
+        # Signup happens 1-60 minutes before first login
+        signup_time = first_login - timedelta(minutes=rng.randint(1, 60))
+
+        # Generate user details
+        first_name = pools.first_name.sample(rng)
+        last_name = pools.last_name.sample(rng)
+        email = f"{first_name.lower()}.{last_name.lower()}{rng.randint(1, 999)}@{pools.free_email_domain.sample(rng)}"
+
+        signup_method = rng.choice(['email', 'google', 'facebook', 'apple'])
+
+        sink.write("raw.signup_events", (
+            user_id,
+            signup_time,
+            email,
+            first_name,
+            last_name,
+            pools.street_address.sample(rng),
+            pools.city.sample(rng),
+            pools.state.sample(rng),
+            pools.postcode.sample(rng),
+            pools.country_code.sample(rng),
+            signup_method
+        ))
+
+        new_signups += 1
+
+        if (i + 1) % COMMIT_EVERY == 0:
+            # A retry finds the users still without a signup, so it continues from here
+            sink.commit()
+
+        if (i + 1) % workload.batch_size == 0:
+            print(f"  Processed {i + 1} users...")
+
+    if high_water is not None:
+        sink.set_watermark(LOGIN_WATERMARK, high_water)
+    if login_time is not None:
+        sink.set_watermark(EVENT_TIME_WATERMARK, login_time)
+    sink.commit()
+    return new_signups
+
+
+def main(argv=None, sink=None):
+    parser = argparse.ArgumentParser(parents=[workload_arguments(), sink_arguments()])
+    parser.add_argument('--login-batch', default=os.getenv("LOGIN_BATCH_IN"),
+                        help='Arrow file written by generate_login_events.py --batch-out, used instead of '
+                             'reading the new logins back when it covers them (default: $LOGIN_BATCH_IN)')
+    args = parser.parse_args(argv)
+    workload = load_workload(args)
+
+    # Precomputed Faker values, sampled by index instead of calling Faker per signup
+    pools = ValuePools(workload.value_pools)
+
+    owns_sink = sink is None
+    if owns_sink:
+        sink = open_sink(args, workload.batch_size)
+
+    # Create signup_events table
+    sink.ensure_tables("raw.signup_events", reads=("raw.login_events",))
+    if not sink.begin_run("signup_events", args.run_id):
+        print(f"✅ Run {sink.run_id} already completed, nothing to do")
+        if owns_sink:
+            sink.close()
+        return
+
+    new_signups = generate_signups(sink, workload, pools, args.login_batch)
+    sink.finish_run()
+
+    if new_signups == 0:
+        print("✅ No new users to process. All users have signup records.")
+    else:
+        print("-" * 50)
+        print(f"✅ Generated {new_signups} new signup events")
+
+        # Summary
+        if sink.connection is not None:
+            with sink.connection.cursor() as cur:
+                total_signups = run_stats.catalog_stats(cur, "raw.signup_events")["rows"][0]
+                print(f"Total signups in database: {total_signups}")
+
+    if owns_sink:
+        sink.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Random streams keyed by what they generate rather than by the order it is generated in.
+
+    rng = stream(workload, "session", session_id)
+    rng = stream(workload, "order", order_id, day=current_date.date())
+
+The draws of a stream depend only on the workload seed, the entity type, the entity
+id and the day, so one user's profile, one session's events or one order's step on
+a day come out the same whether they are generated alone, in another shard or batch
+order, or as part of a full run. Unseeded workloads key every stream with a seed
+drawn once per process.
+
+The generator is counter-based: the n-th block of 64-bit words of a stream is
+BLAKE2b of n, keyed with a hash of the stream key. There is no state to carry
+from one draw to the next except the position, and creating a stream costs one hash.
+"""
+import hashlib
+import operator
+import random
+import struct
+
+# One BLAKE2b digest is eight 64-bit words
+_BLOCK = struct.Struct("<8Q")
+_WORDS_PER_BLOCK = 8
+_FLOAT_SCALE = 1.0 / (1 << 53)
+
+# Keys the streams of unseeded runs, so they differ from run to run
+_RUN_SEED = random.SystemRandom().getrandbits(64)
+
+
+class KeyedRandom(random.Random):
+    """random.Random over a counter-based stream, for the methods random.Random builds on
+    random() and getrandbits() (randint, choice, choices, sample, shuffle, ...)"""
+
+    def __init__(self, key):
+        self._key = hashlib.blake2b(key, digest_size=32).digest()
+        super().__init__()
+
+    def seed(self, a=None, version=2):
+        # The key is the seed; this only restarts the stream (random.Random.__init__ calls it)
+        if a is not None:
+            raise TypeError("KeyedRandom is seeded by its key")
+        self._counter = 0
+        self._words = iter(())
+        self.gauss_next = None
+
+    def _next_block(self):
+        digest = hashlib.blake2b(self._counter.to_bytes(8, "little"), key=self._key).digest()
+        self._counter += 1
+        self._words = iter(_BLOCK.unpack(digest))
+
+    def random(self):
+        # A for loop takes the next word without the cost of catching StopIteration
+        for word in self._words:
+            return (word >> 11) * _FLOAT_SCALE
+        self._next_block()
+        return self.random()
+
+    def _randbelow(self, n):
+        # What randint, choice and sample build on: one word, multiplied and shifted, instead of
+        # drawing bits until they fall below n. The bias is at most n / 2**64.
+        if n >= 1 << 64:
+            return self._randbelow_with_getrandbits(n)
+        for word in self._words:
+            return (word * n) >> 64
+        self._next_block()
+        return self._randbelow(n)
+
+    def getrandbits(self, k):
+        if 0 < k <= 64:
+            for word in self._words:
+                return word >> (64 - k)
+            self._next_block()
+            return self.getrandbits(k)
+        value = 0
+        for _ in range((k + 63) // 64):
+            value = (value << 64) | self.getrandbits(64)
+        return value >> (-k % 64)
+
+    def getstate(self):
+        # The block in use and how many of its words are left
+        return self._key, self._counter, operator.length_hint(self._words), self.gauss_next
+
+    def setstate(self, state):
+        self._key, counter, remaining, self.gauss_next = state
+        self._counter, self._words = counter, iter(())
+        if remaining:
+            self._counter = counter - 1
+            self._next_block()
+            for _ in range(_WORDS_PER_BLOCK - remaining):
+                next(self._words)
+
+    def __reduce__(self):
+        # The placeholder key is replaced by the state's
+        return self.__class__, (b"",), self.getstate()
+
+
+def stream(workload, kind, entity_id, day=None):
+    """The random stream of one entity (of one day, for entities that change daily)"""
+    seed = _RUN_SEED if workload.seed is None else workload.seed
+    return KeyedRandom(f"{seed}:{kind}:{entity_id}:{'' if day is None else day}".encode())
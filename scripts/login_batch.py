@@ -0,0 +1,98 @@
+"""
+The login events one login_events run wrote, as a columnar Arrow table, so the
+signup and session generators can take them from the run before instead of
+reading them back from raw.login_events.
+
+A batch is an uncompressed Arrow IPC file, which readers memory-map instead of
+loading. Its metadata holds the login event_id range it covers: every login with
+after_id < event_id <= up_to_id is in it, so a generator can tell whether the
+batch is exactly the slice it would otherwise query.
+
+Needs pyarrow, which only this module imports.
+"""
+import pyarrow as pa
+import pyarrow.compute as pc
+
+SCHEMA = pa.schema([
+    ("event_id", pa.int64()),
+    ("timestamp", pa.timestamp("us")),
+    ("user_id", pa.string()),
+    ("session_id", pa.string()),
+    ("success", pa.bool_()),
+])
+
+
+class BatchRecorder:
+    """Collects the columns of a batch while the rows are written"""
+
+    def __init__(self):
+        self.timestamps = []
+        self.user_ids = []
+        self.session_ids = []
+
+    def add(self, row):
+        timestamp, user_id, session_id, *_ = row
+        self.timestamps.append(timestamp)
+        self.user_ids.append(user_id)
+        self.session_ids.append(session_id)
+
+    def table(self, event_ids, after_id):
+        if len(event_ids) != len(self.user_ids):
+            raise ValueError(f"{len(self.user_ids)} rows but {len(event_ids)} event ids")
+        up_to_id = max(event_ids, default=after_id)
+        columns = [
+            pa.array(event_ids, pa.int64()),
+            pa.array(self.timestamps, pa.timestamp("us")),
+            pa.array(self.user_ids, pa.string()),
+            pa.array(self.session_ids, pa.string()),
+            pa.array([session_id is not None for session_id in self.session_ids], pa.bool_()),
+        ]
+        metadata = {"after_id": str(after_id or 0), "up_to_id": str(up_to_id or 0)}
+        return pa.Table.from_arrays(columns, schema=SCHEMA.with_metadata(metadata))
+
+
+def write_batch(table, path):
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+def read_batch(path):
+    """The batch at path, memory-mapped rather than read into memory"""
+    with pa.memory_map(path, "r") as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def id_range(table):
+    metadata = table.schema.metadata or {}
+    return int(metadata.get(b"after_id", 0)), int(metadata.get(b"up_to_id", 0))
+
+
+def covers(table, after_id, up_to_id):
+    """Whether the batch holds every login with after_id < event_id <= up_to_id"""
+    batch_after, batch_up_to = id_range(table)
+    return batch_after <= (after_id or 0) <= batch_up_to and batch_up_to == (up_to_id or 0)
+
+
+def successful_logins(table, after_id=None):
+    """(event_id, session_id, user_id, timestamp) of successful logins after after_id,
+    in event_id order, like Sink.successful_logins"""
+    logins = table.filter(pc.and_(table["success"], pc.greater(table["event_id"], after_id or 0)))
+    logins = logins.sort_by("event_id")
+    return zip(
+        logins["event_id"].to_pylist(),
+        logins["session_id"].to_pylist(),
+        logins["user_id"].to_pylist(),
+        logins["timestamp"].to_pylist(),
+    )
+
+
+def first_logins(table, after_id=None):
+    """(user_id, first_login) of every user with logins after after_id, oldest first.
+    Sink.users_without_signup is this less the users that already signed up."""
+    first_logins = (
+        table.filter(pc.greater(table["event_id"], after_id or 0))
+        .group_by("user_id")
+        .aggregate([("timestamp", "min")])
+        .sort_by([("timestamp_min", "ascending"), ("user_id", "ascending")])
+    )
+    return list(zip(first_logins["user_id"].to_pylist(), first_logins["timestamp_min"].to_pylist()))
@@ -0,0 +1,346 @@
+"""
+Local HTTP/JSON service for the dashboard KPIs, answered from a cache in front of
+the marts so repeated dashboard refreshes don't rerun the same aggregations.
+
+    python scripts/metrics_service.py --port 8050
+    curl localhost:8050/kpis
+    curl 'localhost:8050/kpi/daily_active_users?days=14'
+    curl localhost:8050/stats
+    curl -X POST 'localhost:8050/invalidate?asset=dim_user'
+
+Results are cached per KPI and parameters for --ttl seconds, at most --max-entries
+of them (the least recently used go first). Every KPI names the assets it reads;
+when one of them materializes again, seen as a new row in ops.asset_metrics
+(polled every --poll seconds) or a POST to /invalidate, its results are dropped.
+Identical requests that arrive while a query runs wait for its result instead of
+running their own.
+"""
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import argparse
+import json
+import queue
+import threading
+import time
+
+import psycopg2
+
+from db import connect
+
+
+@dataclass(frozen=True)
+class Kpi:
+    sql: str
+    assets: tuple                                # Assets whose materialization invalidates it
+    params: dict = field(default_factory=dict)  # Parameter -> default, all integers of at least 1
+    description: str = ""
+
+
+KPIS = {
+    "daily_active_users": Kpi(
+        sql="""
+            SELECT event_date, COUNT(DISTINCT user_id) AS active_users
+            FROM staging.stg_login_events
+            WHERE status = 'success' AND event_date > CURRENT_DATE - %(days)s
+            GROUP BY event_date
+            ORDER BY event_date
+        """,
+        assets=("login_events", "stg_login_events"),
+        params={"days": 30},
+        description="Users with a successful login, per day",
+    ),
+    "conversion": Kpi(
+        sql="""
+            SELECT COUNT(*) AS users,
+                COUNT(*) FILTER (WHERE has_purchased) AS purchasers,
+                ROUND(COUNT(*) FILTER (WHERE has_purchased)::numeric / NULLIF(COUNT(*), 0), 4) AS conversion_rate
+            FROM marts.dim_user
+        """,
+        assets=("dim_user",),
+        description="Share of users that purchased at least once",
+    ),
+    "revenue_by_category": Kpi(
+        sql="""
+            SELECT product_category, SUM(gross_sales) AS revenue, SUM(orders) AS orders,
+                SUM(refunds + returns) AS refunded, SUM(net_revenue) AS net_revenue
+            FROM marts.fct_daily_revenue
+            WHERE revenue_date > CURRENT_DATE - %(days)s
+            GROUP BY product_category
+            ORDER BY revenue DESC
+        """,
+        assets=("fct_daily_revenue",),
+        params={"days": 30},
+        description="Order item revenue, refunds and net revenue per product category",
+    ),
+    "days_since_last_purchase": Kpi(
+        sql="""
+            SELECT days_since_last_purchase / %(bucket)s * %(bucket)s AS days_from, COUNT(*) AS users
+            FROM marts.dim_user
+            WHERE days_since_last_purchase IS NOT NULL
+            GROUP BY 1
+            ORDER BY 1
+        """,
+        assets=("dim_user",),
+        params={"bucket": 7},
+        description="Purchasers by days since their last purchase, in buckets of bucket days",
+    ),
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))]
+
+
+def json_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+class MetricsService:
+    """The cache, request coalescing and statistics; the HTTP handler only routes to it"""
+
+    def __init__(self, ttl=300, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()   # (kpi, params) -> (expires at, rows), least recently used first
+        self._inflight = {}           # (kpi, params) -> Future of the query running for it
+        self._generation = {name: 0 for name in KPIS}   # Bumped on invalidation
+        self._connections = queue.SimpleQueue()
+        self._materializations = None
+        self.counters = {"hits": 0, "misses": 0, "coalesced": 0, "expired": 0, "evicted": 0, "invalidated": 0}
+        self.latencies = {}           # (kpi, "hit" or "query") -> recent latencies in ms
+
+    def parse_params(self, name, query):
+        """The KPI's parameters from a query string, with defaults filled in"""
+        params = dict(KPIS[name].params)
+        for key, values in query.items():
+            if key not in params:
+                raise ValueError(f"{name} has no parameter {key}")
+            params[key] = int(values[-1])
+            # Day counts and bucket widths; a bucket of 0 would divide by zero in Postgres
+            if params[key] < 1:
+                raise ValueError(f"{key} must be at least 1")
+        return params
+
+    def get(self, name, params):
+        """(rows, whether they came from the cache)"""
+        key = (name, tuple(sorted(params.items())))
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._cache.move_to_end(key)
+                self.counters["hits"] += 1
+                return entry[1], True
+            if entry is not None:
+                del self._cache[key]
+                self.counters["expired"] += 1
+
+            running = self._inflight.get(key)
+            if running is None:
+                running = self._inflight[key] = Future()
+                generation = self._generation[name]
+                self.counters["misses"] += 1
+            else:
+                self.counters["coalesced"] += 1
+                generation = None
+
+        if generation is None:
+            return running.result(), True
+
+        try:
+            rows = self._query(KPIS[name].sql, params)
+        except Exception as e:
+            with self._lock:
+                del self._inflight[key]
+            running.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._inflight[key]
+            # A result that started before an invalidation may already be stale
+            if self._generation[name] == generation:
+                self._cache[key] = (time.monotonic() + self.ttl, rows)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+                    self.counters["evicted"] += 1
+        running.set_result(rows)
+        return rows, False
+
+    def _query(self, sql, params=None):
+        try:
+            conn = self._connections.get_nowait()
+        except queue.Empty:
+            conn = connect()
+            conn.set_session(readonly=True, autocommit=True)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                columns = [column.name for column in cur.description]
+                rows = [dict(zip(columns, map(json_value, row))) for row in cur.fetchall()]
+        except psycopg2.OperationalError:
+            # Broken connection, the next query opens a new one
+            conn.close()
+            raise
+        except Exception:
+            self._connections.put(conn)
+            raise
+        self._connections.put(conn)
+        return rows
+
+    def invalidate(self, asset=None, kpi=None):
+        """Drop the cached results of one KPI, or of every KPI that reads asset; returns the KPIs"""
+        names = [kpi] if kpi else [name for name, definition in KPIS.items() if asset in definition.assets]
+        with self._lock:
+            for name in names:
+                self._generation[name] += 1
+                for key in [key for key in self._cache if key[0] == name]:
+                    del self._cache[key]
+                    self.counters["invalidated"] += 1
+        return names
+
+    def check_materializations(self):
+        """Invalidate the KPIs of every asset recorded in ops.asset_metrics since the last check"""
+        try:
+            rows = self._query("SELECT asset_name, MAX(metric_id) AS metric_id FROM ops.asset_metrics GROUP BY asset_name")
+        except psycopg2.errors.UndefinedTable:
+            return []
+        latest = {row["asset_name"]: row["metric_id"] for row in rows}
+        previous, self._materializations = self._materializations, latest
+        if previous is None:
+            return []
+        changed = [asset for asset, metric_id in latest.items() if previous.get(asset) != metric_id]
+        for asset in changed:
+            self.invalidate(asset=asset)
+        return changed
+
+    def record_latency(self, name, source, ms):
+        with self._lock:
+            self.latencies.setdefault((name, source), deque(maxlen=1000)).append(ms)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"] + self.counters["coalesced"]
+            return {
+                **self.counters,
+                "hit_rate": round((self.counters["hits"] + self.counters["coalesced"]) / lookups, 4) if lookups else 0.0,
+                "entries": len(self._cache),
+                "latency_ms": {
+                    f"{name}.{source}": {
+                        "count": len(values),
+                        "p50": round(percentile(values, 50), 2),
+                        "p95": round(percentile(values, 95), 2),
+                        "max": round(max(values), 2),
+                    }
+                    for (name, source), values in sorted(self.latencies.items())
+                },
+            }
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/kpis":
+            return self.send_json(200, {
+                name: {"params": kpi.params, "assets": list(kpi.assets), "description": kpi.description}
+                for name, kpi in KPIS.items()
+            })
+        if url.path == "/stats":
+            return self.send_json(200, self.service.stats())
+        if not url.path.startswith("/kpi/"):
+            return self.send_json(404, {"error": f"no route {url.path}"})
+
+        name = url.path[len("/kpi/"):]
+        if name not in KPIS:
+            return self.send_json(404, {"error": f"unknown KPI {name}"})
+        try:
+            params = self.service.parse_params(name, parse_qs(url.query))
+        except ValueError as e:
+            return self.send_json(400, {"error": str(e)})
+
+        started = time.perf_counter()
+        try:
+            rows, cached = self.service.get(name, params)
+        except psycopg2.Error as e:
+            return self.send_json(502, {"error": str(e).strip()})
+        latency = (time.perf_counter() - started) * 1000
+        self.service.record_latency(name, "hit" if cached else "query", latency)
+        self.send_json(200, {"kpi": name, "params": params, "cached": cached, "latency_ms": round(latency, 2), "rows": rows})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/invalidate":
+            return self.send_json(404, {"error": f"no route {url.path}"})
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if query.get("kpi") and query["kpi"] not in KPIS:
+            return self.send_json(404, {"error": f"unknown KPI {query['kpi']}"})
+        if not query.get("kpi") and not query.get("asset"):
+            return self.send_json(400, {"error": "pass asset= or kpi="})
+        self.send_json(200, {"invalidated": self.service.invalidate(query.get("asset"), query.get("kpi"))})
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def watch_materializations(service, interval):
+    while True:
+        try:
+            for asset in service.check_materializations():
+                print(f"{asset} materialized, cached results invalidated")
+        except psycopg2.Error as e:
+            print(f"❌ Could not check ops.asset_metrics: {str(e).strip()}")
+        time.sleep(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the dashboard KPIs as JSON, cached")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8050)
+    parser.add_argument('--ttl', type=float, default=300, help='Seconds a cached result stays valid')
+    parser.add_argument('--max-entries', type=int, default=256, help='Cached results kept, least recently used evicted')
+    parser.add_argument('--poll', type=float, default=10, help='Seconds between checks for new materializations')
+    parser.add_argument('--verbose', action='store_true', help='Log every request')
+    args = parser.parse_args(argv)
+
+    service = MetricsService(args.ttl, args.max_entries)
+    server = ThreadingHTTPServer((args.host, args.port), type("Handler", (MetricsHandler,), {"service": service}))
+    server.verbose = args.verbose
+    threading.Thread(target=watch_materializations, args=(service, args.poll), daemon=True).start()
+
+    print("=" * 50)
+    print(f"METRICS SERVICE ON http://{args.host}:{args.port}")
+    print("=" * 50)
+    print(f"KPIs: {', '.join(KPIS)}")
+    print(f"Cache: {args.max_entries} entries, {args.ttl:.0f}s TTL, invalidated on materialization")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    print(f"✅ Stopped, {service.stats()['hit_rate']:.1%} of requests served from the cache")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Opt-in sampling profiler for the generator scripts.
+
+With RUN_PROFILE_DIR set, a background thread takes the main thread's stack every
+RUN_PROFILE_INTERVAL_MS (default 5) milliseconds for the whole run. Nothing is traced
+between samples, so the loops run at close to full speed. On exit it writes
+
+    <RUN_PROFILE_DIR>/<script>-<time>-<pid>.collapsed
+
+one "frame;frame;frame weight" line per distinct stack (root first), as read by
+flamegraph.pl, speedscope or inferno. A sample stands for the wall time since the
+previous one, in microseconds: while the main thread runs Python the sampler waits
+for the GIL, so plain counts would over-represent database calls, where the GIL is
+released. The summary goes into the run metrics
+(RUN_METRICS_PATH) and from there into the asset's Dagster metadata:
+
+    cpu_s       CPU time of the process (time.process_time)
+    db_wait_s   wall time of the samples taken inside a database call (a cursor
+                execute, commit, streamed fetch or connect, driver code included)
+    hotspots    the RUN_PROFILE_TOP (default 15) functions the most time was spent in
+"""
+from collections import Counter
+from datetime import datetime
+import atexit
+import os
+import sys
+import threading
+import time
+
+# Frames that wait on Postgres when they are the innermost Python frame: the
+# instrumented cursor and connection, server-side cursor fetches and connecting
+DB_FRAMES = {
+    "telemetry:execute",
+    "telemetry:executemany",
+    "telemetry:commit",
+    "sinks:_stream",
+    "psycopg2:connect",
+}
+# Modules whose frames wait on another thread, e.g. for the writer pool to drain
+WAIT_MODULES = {"threading", "queue"}
+
+
+def frame_label(code):
+    """module:function, with packages named by their directory instead of __init__"""
+    filename = code.co_filename
+    if filename.startswith("<frozen "):
+        module = filename[len("<frozen "):-1]
+    else:
+        module = os.path.splitext(os.path.basename(filename))[0]
+        if module == "__init__":
+            module = os.path.basename(os.path.dirname(filename))
+    return f"{module}:{code.co_name}"
+
+
+class SamplingProfiler:
+    """Samples one thread's stack (the calling thread by default) from a daemon thread"""
+
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.samples = 0
+        self.stacks = Counter()     # tuple of frame labels, root first -> microseconds
+        self.kinds = Counter()      # "cpu", "db" or "wait" -> microseconds
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._cpu_started = time.process_time()
+        self._thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.wall_s = time.perf_counter() - self._started
+        self.cpu_s = time.process_time() - self._cpu_started
+
+    def _sample(self):
+        previous = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            weight, previous = round((now - previous) * 1e6), now
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack[0] in DB_FRAMES:
+                self.kinds["db"] += weight
+            elif stack[0].split(":")[0] in WAIT_MODULES:
+                self.kinds["wait"] += weight
+            else:
+                self.kinds["cpu"] += weight
+            self.stacks[tuple(reversed(stack))] += weight
+            self.samples += 1
+            # Don't keep the sampled thread's frames alive until the next sample
+            frame = None
+
+    def collapsed(self):
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def hotspots(self, top=15):
+        """(function, time in it, time in it or its callees) of the top functions by own time"""
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for label in set(stack):
+                total[label] += count
+        return [(label, count, total[label]) for label, count in own.most_common(top)]
+
+    def summary(self, top=15):
+        sampled = sum(self.kinds.values())
+        share = {kind: self.kinds[kind] / sampled if sampled else 0.0 for kind in ("cpu", "db", "wait")}
+        return {
+            "samples": self.samples,
+            "interval_ms": round(self.interval * 1000, 3),
+            "wall_s": round(self.wall_s, 3),
+            "cpu_s": round(self.cpu_s, 3),
+            "db_wait_s": round(self.wall_s * share["db"], 3),
+            "thread_wait_s": round(self.wall_s * share["wait"], 3),
+            "hotspots": [
+                {"function": label, "own_pct": round(100 * own / sampled, 1), "total_pct": round(100 * total / sampled, 1)}
+                for label, own, total in self.hotspots(top)
+            ] if sampled else [],
+        }
+
+
+def start_from_env(metrics):
+    """Profile this run when RUN_PROFILE_DIR is set. Call after metrics.write is registered
+    with atexit, so the summary is in metrics.profile before it is written. Returns the
+    profiler, or None."""
+    directory = os.getenv("RUN_PROFILE_DIR")
+    if not directory:
+        return None
+    profiler = SamplingProfiler(float(os.getenv("RUN_PROFILE_INTERVAL_MS", "5")) / 1000).start()
+    script = os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0] or "python"
+
+    def finish():
+        profiler.stop()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{script}-{datetime.now():%Y%m%d_%H%M%S}-{os.getpid()}.collapsed")
+        with open(path, "w") as f:
+            f.write(profiler.collapsed())
+        metrics.profile = {**profiler.summary(int(os.getenv("RUN_PROFILE_TOP", "15"))), "collapsed": path}
+
+        summary = metrics.profile
+        print(f"\nProfile ({summary['samples']} samples): {summary['wall_s']:.2f}s wall, {summary['cpu_s']:.2f}s CPU, "
+              f"{summary['db_wait_s']:.2f}s in database calls -> {path}")
+        for hotspot in summary["hotspots"][:5]:
+            print(f"  {hotspot['own_pct']:>5.1f}%  {hotspot['function']}")
+
+    # atexit runs the last registered first
+    atexit.register(finish)
+    return profiler
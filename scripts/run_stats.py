@@ -0,0 +1,262 @@
+"""
+Run-statistics catalog: row counts per raw table and per category, kept as
+running totals instead of being recounted from the raw tables after every run.
+
+ops.run_stats holds what each run inserted, ops.table_stats the running totals.
+Both are updated by the Postgres sink in the same transaction as the rows they
+count, and a rolled back run subtracts its stats again, so they stay exact.
+
+    python scripts/run_stats.py show
+    python scripts/run_stats.py recount            # compare the catalog with the raw tables
+    python scripts/run_stats.py recount --fix      # and overwrite the catalog with the exact counts
+"""
+import argparse
+
+# Column counted per value (e.g. 'status=success'), and the event time column
+CATEGORY_COLUMNS = {
+    "raw.login_events": "status",
+    "raw.signup_events": "signup_method",
+    "raw.session_events": "event_type",
+    "raw.order_status_events": "status",
+    "raw.refund_return_events": "event_type",
+}
+TIME_COLUMNS = {
+    "raw.login_events": "timestamp",
+    "raw.signup_events": "timestamp",
+    "raw.session_events": "timestamp",
+    "raw.orders": "order_date",
+    "raw.order_status_events": "timestamp",
+    "raw.refund_return_events": "event_date",
+}
+
+# Counted exactly by recount; generators add to them themselves via Sink.add_stat
+DISTINCT_STATS = {
+    "raw.login_events": {"distinct_users": "user_id"},
+}
+
+STATS_DDL = """
+    CREATE SCHEMA IF NOT EXISTS ops;
+
+    CREATE TABLE IF NOT EXISTS ops.table_stats (
+        table_name VARCHAR(100),
+        stat VARCHAR(200),
+        value BIGINT,
+        min_time TIMESTAMP,
+        max_time TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT NOW(),
+        PRIMARY KEY (table_name, stat)
+    );
+
+    CREATE TABLE IF NOT EXISTS ops.run_stats (
+        run_id VARCHAR(64),
+        asset_name VARCHAR(100),
+        table_name VARCHAR(100),
+        stat VARCHAR(200),
+        value BIGINT,
+        min_time TIMESTAMP,
+        max_time TIMESTAMP,
+        recorded_at TIMESTAMP DEFAULT NOW(),
+        PRIMARY KEY (run_id, asset_name, table_name, stat)
+    );
+"""
+
+
+UPSERT_RUN_STAT = """
+    INSERT INTO ops.run_stats (run_id, asset_name, table_name, stat, value, min_time, max_time)
+    VALUES (%(run_id)s, %(asset_name)s, %(table_name)s, %(stat)s, %(value)s, %(min_time)s, %(max_time)s)
+    ON CONFLICT (run_id, asset_name, table_name, stat) DO UPDATE SET
+        value = ops.run_stats.value + EXCLUDED.value,
+        min_time = LEAST(ops.run_stats.min_time, EXCLUDED.min_time),
+        max_time = GREATEST(ops.run_stats.max_time, EXCLUDED.max_time),
+        recorded_at = NOW()
+"""
+
+UPSERT_TABLE_STAT = """
+    INSERT INTO ops.table_stats (table_name, stat, value, min_time, max_time)
+    VALUES (%(table_name)s, %(stat)s, %(value)s, %(min_time)s, %(max_time)s)
+    ON CONFLICT (table_name, stat) DO UPDATE SET
+        value = ops.table_stats.value + EXCLUDED.value,
+        min_time = LEAST(ops.table_stats.min_time, EXCLUDED.min_time),
+        max_time = GREATEST(ops.table_stats.max_time, EXCLUDED.max_time),
+        updated_at = NOW()
+"""
+
+
+class StatsCollector:
+    """Counts written rows in memory until the sink commits them"""
+
+    def __init__(self, column_positions):
+        # table -> (category index or None, time index or None), from the sink's column order
+        self.positions = {
+            table: (
+                columns.index(CATEGORY_COLUMNS[table]) if table in CATEGORY_COLUMNS else None,
+                columns.index(TIME_COLUMNS[table]) if table in TIME_COLUMNS else None,
+            )
+            for table, columns in column_positions.items()
+        }
+        self.pending = {}
+        self.run_totals = {}
+
+    def add(self, table, row):
+        category_index, time_index = self.positions[table]
+        timestamp = row[time_index] if time_index is not None else None
+        self._count(table, "rows", 1, timestamp)
+        if category_index is not None:
+            self._count(table, f"{CATEGORY_COLUMNS[table]}={row[category_index]}", 1, timestamp)
+
+    def add_stat(self, table, stat, value):
+        self._count(table, stat, value, None)
+
+    def _count(self, table, stat, value, timestamp):
+        key = (table, stat)
+        entry = self.pending.get(key)
+        if entry is None:
+            self.pending[key] = [value, timestamp, timestamp]
+            return
+        entry[0] += value
+        if timestamp is not None:
+            if entry[1] is None or timestamp < entry[1]:
+                entry[1] = timestamp
+            if entry[2] is None or timestamp > entry[2]:
+                entry[2] = timestamp
+
+    def flush(self, cur, run_id, asset_name):
+        """Add the pending counts to the run's stats and the running totals (caller commits)"""
+        for (table, stat), (value, min_time, max_time) in self.pending.items():
+            for statement in (UPSERT_RUN_STAT, UPSERT_TABLE_STAT):
+                cur.execute(statement, {
+                    "run_id": run_id, "asset_name": asset_name, "table_name": table,
+                    "stat": stat, "value": value, "min_time": min_time, "max_time": max_time,
+                })
+            total = self.run_totals.setdefault((table, stat), 0)
+            self.run_totals[(table, stat)] = total + value
+        self.pending = {}
+
+
+def rollback_run(cur, run_id, asset_name):
+    """Take a run's committed counts back out of the totals, once its rows are deleted.
+    min/max times can't be undone from the counts, so those stay as they were."""
+    cur.execute("""
+        UPDATE ops.table_stats t
+        SET value = t.value - r.value, updated_at = NOW()
+        FROM ops.run_stats r
+        WHERE r.run_id = %s AND r.asset_name = %s
+        AND t.table_name = r.table_name AND t.stat = r.stat
+    """, (run_id, asset_name))
+    cur.execute("DELETE FROM ops.run_stats WHERE run_id = %s AND asset_name = %s", (run_id, asset_name))
+
+
+def exact_stats(cur, table):
+    """Full scans of table: {stat: (value, min_time, max_time)}"""
+    time_column = TIME_COLUMNS.get(table)
+    time_select = f"MIN({time_column}), MAX({time_column})" if time_column else "NULL::timestamp, NULL::timestamp"
+
+    cur.execute(f"SELECT COUNT(*), {time_select} FROM {table}")
+    stats = {"rows": cur.fetchone()}
+
+    category = CATEGORY_COLUMNS.get(table)
+    if category:
+        cur.execute(f"SELECT {category}, COUNT(*), {time_select} FROM {table} GROUP BY {category}")
+        for value, count, min_time, max_time in cur.fetchall():
+            stats[f"{category}={value}"] = (count, min_time, max_time)
+
+    for stat, column in DISTINCT_STATS.get(table, {}).items():
+        cur.execute(f"SELECT COUNT(DISTINCT {column}) FROM {table}")
+        stats[stat] = (cur.fetchone()[0], None, None)
+
+    return stats
+
+
+def catalog_stats(cur, table):
+    cur.execute("SELECT stat, value, min_time, max_time FROM ops.table_stats WHERE table_name = %s", (table,))
+    return {stat: (value, min_time, max_time) for stat, value, min_time, max_time in cur.fetchall()}
+
+
+def replace_stats(cur, table, stats):
+    cur.execute("DELETE FROM ops.table_stats WHERE table_name = %s", (table,))
+    for stat, (value, min_time, max_time) in stats.items():
+        cur.execute(
+            "INSERT INTO ops.table_stats (table_name, stat, value, min_time, max_time) VALUES (%s, %s, %s, %s, %s)",
+            (table, stat, value, min_time, max_time)
+        )
+
+
+def initialize(cur, tables):
+    """Seed the totals of tables filled before the catalog existed, with one exact count each"""
+    cur.execute("SELECT DISTINCT table_name FROM ops.table_stats WHERE stat = 'rows'")
+    counted = {row[0] for row in cur.fetchall()}
+    for table in tables:
+        if table not in counted:
+            replace_stats(cur, table, exact_stats(cur, table))
+
+
+def print_summary(cur, tables, run_totals=None):
+    """DATABASE SUMMARY from the catalog: totals, time range and category counts per table.
+    With run_totals (StatsCollector.run_totals), what this run added is shown too."""
+    print("\n" + "=" * 50)
+    print("DATABASE SUMMARY")
+    print("=" * 50)
+
+    for table in tables:
+        stats = catalog_stats(cur, table)
+        rows, min_time, max_time = stats.get("rows", (0, None, None))
+        added = (run_totals or {}).get((table, "rows"))
+        print(f"{table}: {rows} rows" + (f" (+{added} this run)" if added else ""))
+        if min_time is not None:
+            print(f"  Date range: {min_time.date()} to {max_time.date()}")
+        for stat, (value, _, _) in sorted(stats.items(), key=lambda item: -item[1][0]):
+            if stat != "rows":
+                print(f"  {stat}: {value}")
+
+
+def main(argv=None):
+    from db import connect
+    from sinks import TABLES
+
+    parser = argparse.ArgumentParser(description="Show or audit the run-statistics catalog")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("show", help="Print the running totals")
+    recount = commands.add_parser("recount", help="Recount every raw table and compare with the catalog")
+    recount.add_argument('--fix', action='store_true', help='Overwrite the catalog with the exact counts')
+    args = parser.parse_args(argv)
+
+    conn = connect()
+    cur = conn.cursor()
+    cur.execute(STATS_DDL)
+    cur.execute("SELECT table_schema || '.' || table_name FROM information_schema.tables WHERE table_schema = 'raw'")
+    existing = {row[0] for row in cur.fetchall()}
+    tables = [table for table in TABLES if table in existing]
+
+    if args.command == "show":
+        print_summary(cur, tables)
+    else:
+        print("=" * 50)
+        print("EXACT RECOUNT")
+        print("=" * 50)
+        mismatches = 0
+        for table in tables:
+            exact = exact_stats(cur, table)
+            catalog = catalog_stats(cur, table)
+            for stat in sorted(set(exact) | set(catalog)):
+                expected = exact.get(stat, (0, None, None))[0]
+                recorded = catalog.get(stat, (0, None, None))[0]
+                if expected != recorded:
+                    mismatches += 1
+                    print(f"  {table} {stat}: catalog {recorded}, actual {expected}")
+            if args.fix:
+                replace_stats(cur, table, exact)
+
+        if mismatches == 0:
+            print("✅ Catalog matches the raw tables")
+        elif args.fix:
+            print(f"✅ Fixed {mismatches} mismatched stats")
+        else:
+            print(f"❌ {mismatches} mismatched stats (use --fix to overwrite)")
+
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1188 @@
+import psycopg2.extras
+from datetime import datetime
+import argparse
+import csv
+import hashlib
+import json
+import os
+import uuid
+
+import run_stats
+import telemetry
+from db import connect
+from writer_pool import WriterPool
+
+# Columns the generators write, in order, with the type used to serialise them.
+# Serial ids are left to the database; the Postgres sink appends the run id.
+TABLES = {
+    "raw.login_events": (
+        ("timestamp", "timestamp"), ("user_id", "text"), ("session_id", "text"),
+        ("status", "text"), ("ip_address", "text"), ("parameters", "json"),
+    ),
+    "raw.signup_events": (
+        ("user_id", "text"), ("timestamp", "timestamp"), ("email", "text"),
+        ("first_name", "text"), ("last_name", "text"), ("address", "text"),
+        ("city", "text"), ("state", "text"), ("postal_code", "text"),
+        ("country", "text"), ("signup_method", "text"),
+    ),
+    "raw.session_events": (
+        ("timestamp", "timestamp"), ("user_id", "text"), ("session_id", "text"),
+        ("event_type", "text"), ("parameters", "json"),
+    ),
+    "raw.orders": (
+        ("order_id", "text"), ("order_date", "timestamp"), ("user_id", "text"),
+        ("session_id", "text"), ("subtotal", "number"), ("discount_amount", "number"),
+        ("tax", "number"), ("shipping", "number"), ("total", "number"),
+    ),
+    "raw.order_items": (
+        ("order_id", "text"), ("product_id", "text"), ("product_name", "text"),
+        ("product_category", "text"), ("quantity", "int"), ("unit_price", "number"),
+        ("line_total", "number"),
+    ),
+    "raw.products": (
+        ("product_id", "text"), ("product_name", "text"), ("product_category", "text"),
+        ("product_price", "number"), ("product_brand", "text"),
+    ),
+    "raw.order_status_events": (
+        ("order_id", "text"), ("status", "text"), ("timestamp", "timestamp"),
+        ("tracking_number", "text"), ("carrier", "text"), ("notes", "text"),
+    ),
+    "raw.refund_return_events": (
+        ("order_id", "text"), ("event_type", "text"), ("event_date", "timestamp"),
+        ("refund_amount", "number"), ("returned_items", "json"), ("reason", "text"),
+        ("status", "text"),
+    ),
+}
+
+TABLE_DDL = {
+    "raw.login_events": """
+        CREATE TABLE IF NOT EXISTS raw.login_events (
+            event_id SERIAL PRIMARY KEY,
+            timestamp TIMESTAMP,
+            user_id VARCHAR(12),
+            session_id VARCHAR(50),
+            status VARCHAR(20),
+            ip_address VARCHAR(45),
+            parameters JSONB,
+            run_id VARCHAR(64)
+        );
+    """,
+    "raw.signup_events": """
+        CREATE TABLE IF NOT EXISTS raw.signup_events (
+            signup_id SERIAL PRIMARY KEY,
+            user_id VARCHAR(12),
+            timestamp TIMESTAMP,
+            email VARCHAR(100),
+            first_name VARCHAR(50),
+            last_name VARCHAR(50),
+            address VARCHAR(200),
+            city VARCHAR(100),
+            state VARCHAR(50),
+            postal_code VARCHAR(20),
+            country VARCHAR(10),
+            signup_method VARCHAR(50),
+            run_id VARCHAR(64)
+        );
+    """,
+    "raw.session_events": """
+        CREATE TABLE IF NOT EXISTS raw.session_events (
+            event_id SERIAL PRIMARY KEY,
+            timestamp TIMESTAMP,
+            user_id VARCHAR(12),
+            session_id VARCHAR(50),
+            event_type VARCHAR(50),
+            parameters JSONB,
+            run_id VARCHAR(64)
+        );
+    """,
+    "raw.orders": """
+        CREATE TABLE IF NOT EXISTS raw.orders (
+            order_id VARCHAR(50) PRIMARY KEY,
+            order_date TIMESTAMP,
+            user_id VARCHAR(12),
+            session_id VARCHAR(50),
+            subtotal DECIMAL(10,2),
+            discount_amount DECIMAL(10,2),
+            tax DECIMAL(10,2),
+            shipping DECIMAL(10,2),
+            total DECIMAL(10,2),
+            run_id VARCHAR(64)
+        );
+        -- Micro-batches place the orders of one time slice, see unplaced_orders
+        CREATE INDEX IF NOT EXISTS orders_order_date_idx ON raw.orders (order_date);
+    """,
+    "raw.order_items": """
+        CREATE TABLE IF NOT EXISTS raw.order_items (
+            order_item_id SERIAL PRIMARY KEY,
+            order_id VARCHAR(50),
+            product_id VARCHAR(20),
+            product_name VARCHAR(200),
+            product_category VARCHAR(100),
+            quantity INTEGER,
+            unit_price DECIMAL(10,2),
+            line_total DECIMAL(10,2),
+            run_id VARCHAR(64)
+        );
+    """,
+    "raw.products": """
+        CREATE TABLE IF NOT EXISTS raw.products (
+            product_id VARCHAR(20) PRIMARY KEY,
+            product_name VARCHAR(200),
+            product_category VARCHAR(100),
+            product_price DECIMAL(10,2),
+            product_brand VARCHAR(100),
+            created_at TIMESTAMP DEFAULT NOW(),
+            run_id VARCHAR(64)
+        );
+    """,
+    "raw.order_status_events": """
+        CREATE TABLE IF NOT EXISTS raw.order_status_events (
+            status_event_id SERIAL PRIMARY KEY,
+            order_id VARCHAR(50),
+            status VARCHAR(50),
+            timestamp TIMESTAMP,
+            tracking_number VARCHAR(100),
+            carrier VARCHAR(50),
+            notes TEXT,
+            run_id VARCHAR(64)
+        );
+        CREATE INDEX IF NOT EXISTS order_status_events_order_id_idx ON raw.order_status_events (order_id);
+    """,
+    "raw.refund_return_events": """
+        CREATE TABLE IF NOT EXISTS raw.refund_return_events (
+            event_id SERIAL PRIMARY KEY,
+            order_id VARCHAR(50),
+            event_type VARCHAR(20),
+            event_date TIMESTAMP,
+            refund_amount DECIMAL(10,2),
+            returned_items JSONB,
+            reason VARCHAR(100),
+            status VARCHAR(20),
+            run_id VARCHAR(64)
+        );
+    """,
+}
+
+TERMINAL_STATUSES = ('final', 'refunded')
+
+# Serial id column of the raw tables that have one
+SERIAL_IDS = {
+    "raw.login_events": "event_id",
+    "raw.signup_events": "signup_id",
+    "raw.session_events": "event_id",
+    "raw.order_items": "order_item_id",
+    "raw.order_status_events": "status_event_id",
+    "raw.refund_return_events": "event_id",
+}
+# Tables without one that a writer pool writes on the connection (and so in the
+# transactions) of the table referencing them by the column: (table, column)
+WRITTEN_WITH = {"raw.orders": ("raw.order_items", "order_id")}
+
+# Bulk loads write here first, see PostgresSink
+STAGING_SCHEMA = "raw_staging"
+
+OPS_DDL = """
+    CREATE SCHEMA IF NOT EXISTS ops;
+
+    CREATE TABLE IF NOT EXISTS ops.generator_runs (
+        run_id VARCHAR(64),
+        asset_name VARCHAR(100),
+        started_at TIMESTAMP DEFAULT NOW(),
+        finished_at TIMESTAMP,
+        watermarks_before JSONB,
+        checkpoint JSONB,
+        committed_ids JSONB,
+        PRIMARY KEY (run_id, asset_name)
+    );
+
+    CREATE TABLE IF NOT EXISTS ops.generator_watermarks (
+        name VARCHAR(100) PRIMARY KEY,
+        value BIGINT,
+        run_id VARCHAR(64),
+        updated_at TIMESTAMP DEFAULT NOW()
+    );
+"""
+
+
+def column_names(table):
+    return tuple(name for name, _ in TABLES[table])
+
+
+def staging_table(table):
+    return f"{STAGING_SCHEMA}.{table.split('.')[1]}"
+
+
+class Sink:
+    """Where generated rows go, plus the few reads the generators need to continue from existing data"""
+
+    connection = None
+
+    def ensure_tables(self, *tables, reads=()):
+        """Create the tables the generator writes, and the ones in reads it only reads"""
+        pass
+
+    def write(self, table, row):
+        raise NotImplementedError
+
+    def commit(self):
+        """Make everything written so far durable (and visible to later stages)"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def collect_ids(self, table, column):
+        """From now on, append the id (serial column) of every row written to table to
+        inserted_ids[table], in write order. Complete once the rows are flushed."""
+        raise NotImplementedError
+
+    # Run coordination. Only the Postgres sink is shared between processes, the
+    # others just keep watermarks so the scripts behave the same on every sink.
+
+    run_id = None
+    checkpoint = None
+
+    def begin_run(self, asset_name, run_id=None, resumable=False):
+        """Register this run of asset_name. Returns False if the run id already completed.
+
+        With resumable, a retry of an interrupted run id keeps what it committed and
+        checkpoint is set to its last saved position; otherwise it starts over.
+        """
+        self.run_id = run_id or uuid.uuid4().hex
+        self.checkpoint = None
+        return True
+
+    def set_checkpoint(self, value):
+        """Position of this run (JSON-serialisable), saved with the next commit like a watermark"""
+        self.checkpoint = value
+
+    def finish_run(self):
+        self.commit()
+
+    def add_stat(self, table, stat, value):
+        """Add to a run-statistics counter that can't be derived from single rows (e.g. distinct users)"""
+        pass
+
+    def watermark(self, name):
+        return self.watermarks.get(name)
+
+    def set_watermark(self, name, value):
+        """Takes effect with the next commit, together with the rows written before it"""
+        self.watermarks[name] = value
+
+    def high_water(self, table, writer):
+        """Highest row id in table that writer (an asset name) has committed"""
+        raise NotImplementedError
+
+    # Reads. Each returns rows shaped like the original SQL queries did.
+
+    def existing_user_ids(self, after_id=None):
+        """Distinct users of the logins with event_id > after_id (all of them by default),
+        in user_id order"""
+        raise NotImplementedError
+
+    def login_fingerprint(self, event_id):
+        """64-bit hash of the time, user and session of the login with this event_id (None if
+        there is none), which tells this table apart from another load that reached the same id"""
+        raise NotImplementedError
+
+    def users_without_signup(self, after_id=None, up_to_id=None):
+        """(user_id, first_login) for users with logins after_id < event_id <= up_to_id
+        but no signup, oldest first"""
+        raise NotImplementedError
+
+    def signed_up(self, user_ids):
+        """The ones of user_ids that have a signup"""
+        raise NotImplementedError
+
+    def has_rows(self, table):
+        raise NotImplementedError
+
+    def successful_logins(self, after_id=None, up_to_id=None):
+        """(event_id, session_id, user_id, timestamp) of successful logins with
+        after_id < event_id <= up_to_id, in event_id order"""
+        raise NotImplementedError
+
+    def last_login_with_sessions(self):
+        """Highest login event_id whose session has events, for tables filled before watermarks existed"""
+        raise NotImplementedError
+
+    def logins_with_sessions(self, after_id=None):
+        """event_ids of the logins with event_id > after_id whose session has events"""
+        raise NotImplementedError
+
+    def products(self):
+        """(product_id, product_name, product_category, product_price) for the whole catalog"""
+        raise NotImplementedError
+
+    def open_orders(self, as_of):
+        """(order_id, order_date, current_status, status_timestamp, tracking_number, carrier) of orders
+        placed by as_of that are not final or refunded, with their latest status as of as_of"""
+        raise NotImplementedError
+
+    def order_total(self, order_id):
+        raise NotImplementedError
+
+    def order_items(self, order_id):
+        """(product_id, product_name, product_category, quantity, unit_price) of one order"""
+        raise NotImplementedError
+
+    def unplaced_orders(self, after, as_of):
+        """(order_id, order_date) of orders with after < order_date <= as_of and no status yet"""
+        raise NotImplementedError
+
+    def latest_status_time(self):
+        raise NotImplementedError
+
+    def first_order_date(self):
+        raise NotImplementedError
+
+
+class PostgresSink(Sink):
+    """Buffers rows per table and writes them with multi-row INSERTs on flush.
+
+    With bulk_load, for initial loads and backfills, rows go to unlogged copies of
+    the tables in raw_staging with synchronous_commit off, and finish_run
+    publishes them into raw in one transaction. Runs of one asset are serialised
+    by its advisory lock and no two assets write the same table, so one staging
+    table per raw table is enough.
+
+    With writers > 1, flushes of the tables with a serial id (and of orders, which go
+    with their items) run on a WriterPool of that many connections; the rest stay on
+    the sink's connection. commit() commits the pool's transactions and then its own,
+    with the watermarks and the ids each table reached (committed_ids of the run). If
+    the run dies between the two, the next run of the asset deletes the rows past
+    those ids, so what is left agrees with the watermarks and checkpoint again.
+    """
+
+    def __init__(self, connection=None, batch_size=1000, bulk_load=False, writers=1):
+        self.connection = connection or connect()
+        self.cur = self.connection.cursor()
+        self.batch_size = batch_size
+        self.bulk_load = bulk_load
+        self.writers = writers
+        self._pool = None
+        self._pooled = set()        # Tables written through the pool since its last commit
+        self._committed_ids = {}    # Table -> serial id its rows reached, for a pool run
+        self._staged = {}
+        self._buffers = {}
+        self._watermark_updates = {}
+        self._checkpoint_update = None
+        self._returning = {}
+        self.inserted_ids = {}
+        self._locks = []
+        self._tables = []           # Tables the generator writes, not the ones it only reads
+        self._statements = {table: self._insert_statement(table, table) for table in TABLES}
+        self.stats = run_stats.StatsCollector({table: column_names(table) for table in TABLES})
+        self._json_columns = {
+            table: [i for i, (_, kind) in enumerate(columns) if kind == "json"]
+            for table, columns in TABLES.items()
+        }
+
+    @staticmethod
+    def _insert_statement(table, target):
+        return f"INSERT INTO {target} ({', '.join(column_names(table))}, run_id) VALUES %s"
+
+    def ensure_tables(self, *tables, reads=()):
+        written, tables = tables, (*tables, *reads)
+        # Concurrent CREATE ... IF NOT EXISTS can still collide, so DDL is serialised
+        self.cur.execute("SELECT pg_advisory_xact_lock(hashtext('analytics_ddl'))")
+        self.cur.execute("CREATE SCHEMA IF NOT EXISTS raw;")
+        for table in tables:
+            self.cur.execute(TABLE_DDL[table])
+
+        # Tables created before rows carried a run id. Checked first because ALTER
+        # TABLE locks the table even when the column already exists.
+        self.cur.execute("""
+            SELECT table_schema || '.' || table_name FROM information_schema.columns
+            WHERE table_schema = 'raw' AND column_name = 'run_id'
+        """)
+        migrated = {row[0] for row in self.cur.fetchall()}
+        for table in tables:
+            if table not in migrated:
+                self.cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS run_id VARCHAR(64)")
+
+        self.cur.execute(OPS_DDL)
+        self.cur.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = 'ops' AND table_name = 'generator_runs' AND column_name = 'checkpoint'
+        """)
+        if self.cur.fetchone() is None:
+            self.cur.execute("ALTER TABLE ops.generator_runs ADD COLUMN checkpoint JSONB")
+        self.cur.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = 'ops' AND table_name = 'generator_runs' AND column_name = 'committed_ids'
+        """)
+        if self.cur.fetchone() is None:
+            self.cur.execute("ALTER TABLE ops.generator_runs ADD COLUMN committed_ids JSONB")
+        self.cur.execute(run_stats.STATS_DDL)
+        run_stats.initialize(self.cur, tables)
+        self.connection.commit()
+        self._tables.extend(table for table in written if table not in self._tables)
+
+    def begin_run(self, asset_name, run_id=None, resumable=False):
+        """Take the asset's advisory lock (held until close) and register the run.
+
+        A run id that started before but never finished (a retried step) continues
+        from its checkpoint when resumable. Otherwise the rows it wrote to this asset's
+        tables are deleted and the asset's watermarks rolled back before starting again.
+        Every asset of a Dagster run shares its run id, so nothing another asset wrote
+        under it is touched.
+        """
+        super().begin_run(asset_name, run_id, resumable)
+        self._checkpoint_update = None
+        self._committed_ids = {}
+        self.asset_name = asset_name
+
+        lock_key = f"generator:{asset_name}"
+        self.cur.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (lock_key,))
+        if not self.cur.fetchone()[0]:
+            print(f"Waiting for another {asset_name} run to finish...")
+            self.cur.execute("SELECT pg_advisory_lock(hashtext(%s))", (lock_key,))
+        self._locks.append(lock_key)
+        self._discard_uncommitted(asset_name)
+
+        self.cur.execute(
+            "SELECT finished_at, watermarks_before, checkpoint FROM ops.generator_runs WHERE run_id = %s AND asset_name = %s",
+            (self.run_id, asset_name)
+        )
+        previous = self.cur.fetchone()
+        if previous and previous[0] is not None:
+            self.connection.commit()
+            return False
+
+        if previous and resumable:
+            # Rows, watermarks and the checkpoint were committed together, so they agree
+            self.checkpoint = previous[2]
+            print(f"Resuming run {self.run_id}" + (f" from checkpoint {json.dumps(self.checkpoint)}" if self.checkpoint else ""))
+        elif previous:
+            print(f"Rolling back partial rows of run {self.run_id}...")
+            # No two assets write the same table, so the run's rows in the ones this asset writes are its own
+            for table in self._tables:
+                self.cur.execute(f"DELETE FROM {table} WHERE run_id = %s", (self.run_id,))
+            run_stats.rollback_run(self.cur, self.run_id, asset_name)
+            self.cur.execute(
+                "UPDATE ops.generator_runs SET checkpoint = NULL WHERE run_id = %s AND asset_name = %s",
+                (self.run_id, asset_name)
+            )
+            # An asset's watermarks are named <asset>.<position>
+            self.cur.execute(
+                "SELECT name FROM ops.generator_watermarks WHERE run_id = %s AND name LIKE %s",
+                (self.run_id, f"{asset_name}.%")
+            )
+            for (name,) in self.cur.fetchall():
+                if name in previous[1]:
+                    self.cur.execute(
+                        "UPDATE ops.generator_watermarks SET value = %s, run_id = NULL, updated_at = NOW() WHERE name = %s",
+                        (previous[1][name], name)
+                    )
+                else:
+                    self.cur.execute("DELETE FROM ops.generator_watermarks WHERE name = %s", (name,))
+        else:
+            self.cur.execute("SELECT name, value FROM ops.generator_watermarks")
+            watermarks = dict(self.cur.fetchall())
+            self.cur.execute(
+                "INSERT INTO ops.generator_runs (run_id, asset_name, watermarks_before) VALUES (%s, %s, %s)",
+                (self.run_id, asset_name, psycopg2.extras.Json(watermarks))
+            )
+
+        if self.writers > 1 and not self.bulk_load:
+            # Rows after these ids are this run's from now on
+            for table in self._tables:
+                if table in SERIAL_IDS:
+                    self.cur.execute(f"SELECT COALESCE(MAX({SERIAL_IDS[table]}), 0) FROM {table}")
+                    self._committed_ids[table] = self.cur.fetchone()[0]
+            self._write_committed_ids()
+
+        if self.bulk_load:
+            # Losing the last commits on a crash is fine: staged rows are discarded anyway
+            self.cur.execute("SET synchronous_commit = off")
+        self.connection.commit()
+        return True
+
+    def _discard_uncommitted(self, asset_name):
+        """Delete the rows that unfinished pool runs of the asset committed after their
+        sink's last commit. Called with the asset's lock held, so those runs are dead."""
+        self.cur.execute("""
+            SELECT run_id, committed_ids FROM ops.generator_runs
+            WHERE asset_name = %s AND finished_at IS NULL AND committed_ids IS NOT NULL
+        """, (asset_name,))
+        for run_id, committed_ids in self.cur.fetchall():
+            print(f"Discarding rows of run {run_id} its last commit didn't cover...")
+            for table, committed_id in committed_ids.items():
+                self.cur.execute(
+                    f"DELETE FROM {table} WHERE run_id = %s AND {SERIAL_IDS[table]} > %s", (run_id, committed_id)
+                )
+            for table, (referencing, column) in WRITTEN_WITH.items():
+                if referencing in committed_ids:
+                    self.cur.execute(f"""
+                        DELETE FROM {table} t WHERE run_id = %s
+                        AND NOT EXISTS (SELECT 1 FROM {referencing} r WHERE r.{column} = t.{column})
+                    """, (run_id,))
+            self.cur.execute(
+                "UPDATE ops.generator_runs SET committed_ids = NULL WHERE run_id = %s AND asset_name = %s",
+                (run_id, asset_name)
+            )
+
+    def _write_committed_ids(self):
+        self.cur.execute(
+            "UPDATE ops.generator_runs SET committed_ids = %s WHERE run_id = %s AND asset_name = %s",
+            (psycopg2.extras.Json(self._committed_ids), self.run_id, self.asset_name)
+        )
+
+    def _commit_writers(self):
+        """Commit the pool's transactions. Outside bulk loads, first note the serial id each
+        table reached, for the sink's commit that follows."""
+        if not self._pooled:
+            return
+        if not self.bulk_load and self.run_id is not None:
+            for table in self._pooled:
+                if table not in SERIAL_IDS:
+                    continue
+
+                def read_id(cur, table=table):
+                    # The worker is the only connection inserting into table, so its last id is the highest
+                    cur.execute("SELECT currval(pg_get_serial_sequence(%s, %s))", (table, SERIAL_IDS[table]))
+                    self._committed_ids[table] = cur.fetchone()[0]
+
+                self._pool.submit(table, read_id)
+        self._pool.commit()
+        self._pooled = set()
+        if not self.bulk_load and self.run_id is not None:
+            self._write_committed_ids()
+
+    def finish_run(self):
+        self.flush()
+        if self._pool is not None:
+            self._commit_writers()
+        if self._staged:
+            self._publish()
+        self._write_watermarks()
+        self._write_stats()
+        self.cur.execute(
+            "UPDATE ops.generator_runs SET finished_at = NOW() WHERE run_id = %s AND asset_name = %s",
+            (self.run_id, self.asset_name)
+        )
+        self.commit()
+
+    def _stage(self, table):
+        """Point inserts for table at a fresh unlogged copy of it, with no indexes"""
+        staging = staging_table(table)
+
+        def create(cur):
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext('analytics_ddl'))")
+            cur.execute(f"CREATE SCHEMA IF NOT EXISTS {STAGING_SCHEMA}")
+            # Left over when an earlier run of this asset failed before publishing
+            cur.execute(f"DROP TABLE IF EXISTS {staging}")
+            cur.execute(f"CREATE UNLOGGED TABLE {staging} (LIKE {table} INCLUDING DEFAULTS)")
+            if self._pool is not None:
+                # Committed at once, or a connection creating another staging table would
+                # wait for the DDL lock until this one's transaction ends (at the sink's
+                # commit, which waits for that connection). Staged rows it commits with
+                # it aren't visible before the publish anyway.
+                cur.connection.commit()
+
+        if self._uses_pool(table):
+            self._pool.submit(table, create)
+            self._pooled.add(table)
+        else:
+            create(self.cur)
+        self._statements[table] = self._insert_statement(table, staging)
+        self._staged[table] = 0
+
+    def _uses_pool(self, table):
+        return self._pool is not None and (table in SERIAL_IDS or table in WRITTEN_WITH)
+
+    def _publish(self):
+        """Move staged rows into raw, in the transaction that finish_run commits.
+
+        When the load is bigger than the table it lands in, the table's indexes
+        and keys are dropped and built once afterwards instead of being
+        maintained row by row. Every table is analyzed before the commit.
+        """
+        # Not a metrics cursor: the rows were counted when they were staged
+        cur = self.connection.cursor(cursor_factory=psycopg2.extensions.cursor)
+        cur.execute("SET LOCAL synchronous_commit = on")
+
+        for table, staged_rows in self._staged.items():
+            staging = staging_table(table)
+            cur.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", (table,))
+            estimate = cur.fetchone()[0]
+            if estimate < 0:
+                # Never analyzed, so no estimate
+                cur.execute(f"SELECT EXISTS (SELECT 1 FROM {table})")
+                estimate = staged_rows if cur.fetchone()[0] else 0
+            rebuild = staged_rows > estimate
+
+            if rebuild:
+                cur.execute("""
+                    SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+                    WHERE conrelid = %s::regclass AND contype IN ('p', 'u')
+                """, (table,))
+                constraints = cur.fetchall()
+                cur.execute("""
+                    SELECT indexrelid::regclass::text, pg_get_indexdef(indexrelid) FROM pg_index
+                    WHERE indrelid = %s::regclass
+                    AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = indexrelid)
+                """, (table,))
+                indexes = cur.fetchall()
+                for name, _ in constraints:
+                    cur.execute(f"ALTER TABLE {table} DROP CONSTRAINT {name}")
+                for name, _ in indexes:
+                    cur.execute(f"DROP INDEX {name}")
+
+            cur.execute(f"INSERT INTO {table} SELECT * FROM {staging}")
+
+            if rebuild:
+                for name, definition in constraints:
+                    cur.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+                for _, definition in indexes:
+                    cur.execute(definition)
+            cur.execute(f"ANALYZE {table}")
+            cur.execute(f"DROP TABLE {staging}")
+            print(f"  Published {staged_rows} rows to {table}" + (" (indexes rebuilt)" if rebuild else ""))
+
+        cur.close()
+        for table in self._staged:
+            self._statements[table] = self._insert_statement(table, table)
+        self._staged = {}
+
+    def _source(self, table):
+        """table, plus its staged rows while a bulk load is in progress. For reads of tables the run writes."""
+        if table in self._staged:
+            return f"(SELECT * FROM {table} UNION ALL SELECT * FROM {staging_table(table)})"
+        return table
+
+    def watermark(self, name):
+        if name in self._watermark_updates:
+            return self._watermark_updates[name]
+        self.cur.execute("SELECT value FROM ops.generator_watermarks WHERE name = %s", (name,))
+        row = self.cur.fetchone()
+        return row[0] if row else None
+
+    def set_watermark(self, name, value):
+        self._watermark_updates[name] = value
+
+    def set_checkpoint(self, value):
+        super().set_checkpoint(value)
+        self._checkpoint_update = value
+
+    def high_water(self, table, writer):
+        # A shared lock on the writer's key waits out a run of it that is still inserting,
+        # so no lower id can commit after the maximum is read
+        lock_key = f"generator:{writer}"
+        self.cur.execute("SELECT pg_advisory_lock_shared(hashtext(%s))", (lock_key,))
+        self.cur.execute(f"SELECT MAX(event_id) FROM {table}")
+        value = self.cur.fetchone()[0]
+        self.cur.execute("SELECT pg_advisory_unlock_shared(hashtext(%s))", (lock_key,))
+        return value
+
+    def add_stat(self, table, stat, value):
+        self.stats.add_stat(table, stat, value)
+
+    def write(self, table, row):
+        if self.writers > 1 and self._pool is None:
+            self._pool = WriterPool(self.writers, {table: group[0] for table, group in WRITTEN_WITH.items()})
+        if self.bulk_load and table not in self._staged:
+            self._stage(table)
+        self.stats.add(table, row)
+        json_columns = self._json_columns[table]
+        row = list(row)
+        for i in json_columns:
+            if row[i] is not None:
+                row[i] = psycopg2.extras.Json(row[i])
+        row.append(self.run_id)
+        buffer = self._buffers.setdefault(table, [])
+        buffer.append(row)
+        if len(buffer) >= self.batch_size:
+            self._flush_table(table)
+
+    def collect_ids(self, table, column):
+        self._returning[table] = column
+        self.inserted_ids.setdefault(table, [])
+
+    def _flush_table(self, table):
+        rows = self._buffers.get(table)
+        if not rows:
+            return
+        statement, returning = self._statements[table], self._returning.get(table)
+
+        def insert(cur):
+            if returning:
+                # Staging tables share the raw table's sequence, so the ids survive the publish
+                ids = psycopg2.extras.execute_values(
+                    cur, f"{statement} RETURNING {returning}", rows, page_size=self.batch_size, fetch=True
+                )
+                self.inserted_ids[table].extend(row[0] for row in ids)
+            else:
+                psycopg2.extras.execute_values(cur, statement, rows, page_size=self.batch_size)
+
+        if self._uses_pool(table):
+            self._pool.submit(table, insert)
+            self._pooled.add(table)
+        else:
+            insert(self.cur)
+        if table in self._staged:
+            self._staged[table] += len(rows)
+        self._buffers[table] = []
+
+    def flush(self):
+        for table in self._buffers:
+            self._flush_table(table)
+        if self._pool is not None:
+            self._pool.drain()
+
+    def commit(self):
+        self.flush()
+        if self._pool is not None:
+            self._commit_writers()
+        # Watermarks and run statistics move in the same transaction as the rows they
+        # cover (right after them, for a writer pool). Staged rows aren't in raw yet, so
+        # during a bulk load they wait for the publish.
+        if not self._staged:
+            self._write_watermarks()
+            self._write_stats()
+        self.connection.commit()
+
+    def _write_stats(self):
+        # Rows written outside a registered run (no begin_run) aren't counted
+        if self.run_id is not None:
+            self.stats.flush(self.cur, self.run_id, self.asset_name)
+
+    def _write_watermarks(self):
+        for name, value in self._watermark_updates.items():
+            self.cur.execute("""
+                INSERT INTO ops.generator_watermarks (name, value, run_id) VALUES (%s, %s, %s)
+                ON CONFLICT (name) DO UPDATE
+                SET value = EXCLUDED.value, run_id = EXCLUDED.run_id, updated_at = NOW()
+            """, (name, value, self.run_id))
+        self._watermark_updates = {}
+
+        if self._checkpoint_update is not None:
+            self.cur.execute(
+                "UPDATE ops.generator_runs SET checkpoint = %s WHERE run_id = %s AND asset_name = %s",
+                (psycopg2.extras.Json(self._checkpoint_update), self.run_id, self.asset_name)
+            )
+            self._checkpoint_update = None
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+        # Session advisory locks go with the connection, but a shared connection lives on
+        for lock_key in self._locks:
+            self.cur.execute("SELECT pg_advisory_unlock(hashtext(%s))", (lock_key,))
+        self._locks = []
+        self.cur.close()
+        self.connection.close()
+
+    def _stream(self, name, query, params=None, withhold=False):
+        """Server-side cursor so large reads come in batches instead of one fetchall()"""
+        self.flush()
+        cursor = self.connection.cursor(name=name, withhold=withhold)
+        cursor.itersize = self.batch_size
+        cursor.execute(query, params)
+        try:
+            yield from cursor
+        finally:
+            cursor.close()
+
+    def existing_user_ids(self, after_id=None):
+        # Ordered, so seeded runs build the same pool whatever the plan (and the cached pool matches)
+        for (user_id,) in self._stream("existing_users", """
+            SELECT DISTINCT user_id FROM raw.login_events
+            WHERE event_id > COALESCE(%s, 0)
+            ORDER BY user_id
+        """, (after_id,)):
+            yield user_id
+
+    def login_fingerprint(self, event_id):
+        self.cur.execute("""
+            SELECT hashtextextended(concat_ws('|', timestamp, user_id, session_id), 0)
+            FROM raw.login_events WHERE event_id = %s
+        """, (event_id,))
+        row = self.cur.fetchone()
+        return row[0] if row else None
+
+    def users_without_signup(self, after_id=None, up_to_id=None):
+        # withhold: the caller commits while iterating
+        return self._stream("new_users", """
+            SELECT l.user_id, MIN(l.timestamp) as first_login
+            FROM raw.login_events l
+            LEFT JOIN raw.signup_events s ON l.user_id = s.user_id
+            WHERE s.user_id IS NULL
+            AND l.event_id > COALESCE(%s, 0)
+            AND l.event_id <= COALESCE(%s, l.event_id)
+            GROUP BY l.user_id
+            ORDER BY first_login
+        """, (after_id, up_to_id), withhold=True)
+
+    def signed_up(self, user_ids):
+        self.flush()
+        self.cur.execute("SELECT user_id FROM raw.signup_events WHERE user_id = ANY(%s)", (list(user_ids),))
+        return {row[0] for row in self.cur.fetchall()}
+
+    def has_rows(self, table):
+        self.flush()
+        self.cur.execute(f"SELECT EXISTS (SELECT 1 FROM {self._source(table)} t)")
+        return self.cur.fetchone()[0]
+
+    def successful_logins(self, after_id=None, up_to_id=None):
+        return self._stream("successful_logins", """
+            SELECT event_id, session_id, user_id, timestamp
+            FROM raw.login_events
+            WHERE status = 'success'
+            AND event_id > COALESCE(%s, 0)
+            AND event_id <= COALESCE(%s, event_id)
+            ORDER BY event_id
+        """, (after_id, up_to_id), withhold=True)
+
+    def last_login_with_sessions(self):
+        self.flush()
+        self.cur.execute("""
+            SELECT MAX(l.event_id)
+            FROM raw.login_events l
+            WHERE EXISTS (SELECT 1 FROM raw.session_events s WHERE s.session_id = l.session_id)
+        """)
+        return self.cur.fetchone()[0]
+
+    def logins_with_sessions(self, after_id=None):
+        self.flush()
+        self.cur.execute("""
+            SELECT l.event_id
+            FROM raw.login_events l
+            WHERE l.event_id > COALESCE(%s, 0)
+            AND EXISTS (SELECT 1 FROM raw.session_events s WHERE s.session_id = l.session_id)
+        """, (after_id,))
+        return {row[0] for row in self.cur.fetchall()}
+
+    def products(self):
+        self.flush()
+        self.cur.execute("SELECT product_id, product_name, product_category, product_price FROM raw.products")
+        return self.cur.fetchall()
+
+    def open_orders(self, as_of):
+        # The latest status row carries the tracking details when the order has shipped
+        status_events = self._source("raw.order_status_events")
+        return self._stream("open_orders", f"""
+            with latest_status as (
+                select distinct on (order_id)
+                order_id
+                , status
+                , timestamp
+                , tracking_number
+                , carrier
+                from {status_events} ose
+                where timestamp <= %s
+                order by order_id, timestamp desc
+            )
+
+            select o.order_id
+                , o.order_date
+                , coalesce(ls.status, 'new') as current_status
+                , ls.timestamp as status_timestamp
+                , ls.tracking_number
+                , ls.carrier
+            from raw.orders o
+            left join latest_status ls
+                on o.order_id = ls.order_id
+            where o.order_date <= %s
+            and not exists (
+                select 1
+                from {status_events} ose
+                where ose.order_id = o.order_id
+                and ose.status in ('final', 'refunded')
+                    )
+            -- A fixed order, so seeded runs draw the same random numbers for the same orders
+            order by o.order_id
+        """, (as_of, as_of))
+
+    def unplaced_orders(self, after, as_of):
+        status_events = self._source("raw.order_status_events")
+        return self._stream("unplaced_orders", f"""
+            select o.order_id, o.order_date
+            from raw.orders o
+            where o.order_date > %s
+            and o.order_date <= %s
+            and not exists (select 1 from {status_events} ose where ose.order_id = o.order_id)
+            order by o.order_id
+        """, (after, as_of))
+
+    # Orders and their items are written by the session generator, never by the
+    # run looking them up, so point lookups don't need to flush first.
+
+    def order_total(self, order_id):
+        self.cur.execute("SELECT total FROM raw.orders WHERE order_id = %s", (order_id,))
+        return float(self.cur.fetchone()[0])
+
+    def order_items(self, order_id):
+        self.cur.execute("""
+            SELECT product_id, product_name, product_category, quantity, unit_price
+            FROM raw.order_items
+            WHERE order_id = %s
+            ORDER BY order_item_id
+        """, (order_id,))
+        return self.cur.fetchall()
+
+    def latest_status_time(self):
+        self.flush()
+        self.cur.execute(f"SELECT MAX(timestamp) FROM {self._source('raw.order_status_events')} ose")
+        return self.cur.fetchone()[0]
+
+    def first_order_date(self):
+        self.flush()
+        self.cur.execute("SELECT MIN(order_date) FROM raw.orders")
+        return self.cur.fetchone()[0]
+
+
+class MemorySink(Sink):
+    """Keeps every row in memory and answers reads from it. For benchmarks and tests."""
+
+    def __init__(self):
+        self.rows = {table: [] for table in TABLES}
+        self.watermarks = {}
+        self.inserted_ids = {}
+        self._pending = {}
+
+    def write(self, table, row):
+        self.rows[table].append(tuple(row))
+        self._pending[table] = self._pending.get(table, 0) + 1
+        if table in self.inserted_ids:
+            self.inserted_ids[table].append(len(self.rows[table]))
+
+    def collect_ids(self, table, column):
+        self.inserted_ids.setdefault(table, [])
+
+    def commit(self):
+        for table, count in self._pending.items():
+            telemetry.metrics.record_insert(table, count)
+        self._pending = {}
+        telemetry.metrics.batch_done()
+
+    def existing_user_ids(self, after_id=None):
+        return sorted({row[1] for row in self.rows["raw.login_events"][after_id or 0:]})
+
+    def login_fingerprint(self, event_id):
+        if not 0 < event_id <= len(self.rows["raw.login_events"]):
+            return None
+        timestamp, user_id, session_id = self.rows["raw.login_events"][event_id - 1][:3]
+        digest = hashlib.sha256(f"{timestamp}|{user_id}|{session_id}".encode()).digest()
+        return int.from_bytes(digest[:8], "little", signed=True)
+
+    def users_without_signup(self, after_id=None, up_to_id=None):
+        signed_up = {row[0] for row in self.rows["raw.signup_events"]}
+        first_login = {}
+        for timestamp, user_id, *_ in self.rows["raw.login_events"][after_id or 0:up_to_id]:
+            if user_id not in signed_up and (user_id not in first_login or timestamp < first_login[user_id]):
+                first_login[user_id] = timestamp
+        return sorted(first_login.items(), key=lambda item: item[1])
+
+    def signed_up(self, user_ids):
+        user_ids = set(user_ids)
+        return {row[0] for row in self.rows["raw.signup_events"] if row[0] in user_ids}
+
+    def has_rows(self, table):
+        return len(self.rows[table]) > 0
+
+    # Row ids are 1-based positions in the table, like a serial column
+
+    def high_water(self, table, writer):
+        return len(self.rows[table]) or None
+
+    def successful_logins(self, after_id=None, up_to_id=None):
+        logins = self.rows["raw.login_events"][after_id or 0:up_to_id]
+        return [
+            (event_id, session_id, user_id, timestamp)
+            for event_id, (timestamp, user_id, session_id, status, *_) in enumerate(logins, (after_id or 0) + 1)
+            if status == 'success'
+        ]
+
+    def last_login_with_sessions(self):
+        sessions = {row[2] for row in self.rows["raw.session_events"]}
+        return max(
+            (event_id for event_id, row in enumerate(self.rows["raw.login_events"], 1) if row[2] in sessions),
+            default=None
+        )
+
+    def logins_with_sessions(self, after_id=None):
+        sessions = {row[2] for row in self.rows["raw.session_events"]}
+        logins = self.rows["raw.login_events"][after_id or 0:]
+        return {event_id for event_id, row in enumerate(logins, (after_id or 0) + 1) if row[2] in sessions}
+
+    def products(self):
+        return [row[:4] for row in self.rows["raw.products"]]
+
+    def open_orders(self, as_of):
+        latest = {}
+        closed = set()
+        for order_id, status, timestamp, tracking, carrier, _ in self.rows["raw.order_status_events"]:
+            if status in TERMINAL_STATUSES:
+                closed.add(order_id)
+            if timestamp <= as_of and (order_id not in latest or timestamp > latest[order_id][1]):
+                latest[order_id] = (status, timestamp, tracking, carrier)
+
+        for order_id, order_date, *_ in self.rows["raw.orders"]:
+            if order_date <= as_of and order_id not in closed:
+                status, timestamp, tracking, carrier = latest.get(order_id, ('new', None, None, None))
+                yield order_id, order_date, status, timestamp, tracking, carrier
+
+    def unplaced_orders(self, after, as_of):
+        placed = {row[0] for row in self.rows["raw.order_status_events"]}
+        return sorted(
+            (order_id, order_date) for order_id, order_date, *_ in self.rows["raw.orders"]
+            if after < order_date <= as_of and order_id not in placed
+        )
+
+    def order_total(self, order_id):
+        for row in self.rows["raw.orders"]:
+            if row[0] == order_id:
+                return float(row[8])
+
+    def order_items(self, order_id):
+        return [
+            (product_id, product_name, product_category, quantity, unit_price)
+            for item_order_id, product_id, product_name, product_category, quantity, unit_price, _
+            in self.rows["raw.order_items"]
+            if item_order_id == order_id
+        ]
+
+    def latest_status_time(self):
+        return max((row[2] for row in self.rows["raw.order_status_events"]), default=None)
+
+    def first_order_date(self):
+        return min((row[1] for row in self.rows["raw.orders"]), default=None)
+
+
+class NullSink(MemorySink):
+    """Counts rows and throws them away, to time a single generator without any I/O"""
+
+    def write(self, table, row):
+        self._pending[table] = self._pending.get(table, 0) + 1
+
+
+def _serialise(value, kind):
+    if value is None:
+        return None
+    if kind == "json":
+        return json.dumps(value)
+    if kind == "timestamp":
+        return value.isoformat(sep=" ")
+    return value
+
+
+def _parse(value, kind):
+    if value == "":
+        return None
+    if kind == "json":
+        return json.loads(value)
+    if kind == "timestamp":
+        return datetime.fromisoformat(value)
+    if kind == "number":
+        return float(value)
+    if kind == "int":
+        return int(value)
+    return value
+
+
+class FileSink(MemorySink):
+    """Appends COPY-ready CSV files, one per raw table, plus a load.sql to import them.
+
+    Existing files in the directory are read back on open, so the chain of
+    generators can run across processes on a machine without a database.
+    """
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._unwritten = {table: [] for table in TABLES}
+
+        for table, columns in TABLES.items():
+            path = self.path(table)
+            if os.path.exists(path):
+                with open(path, newline="") as f:
+                    reader = csv.reader(f)
+                    next(reader)
+                    self.rows[table] = [
+                        tuple(_parse(value, kind) for value, (_, kind) in zip(row, columns))
+                        for row in reader
+                    ]
+
+        if os.path.exists(self.watermarks_path()):
+            with open(self.watermarks_path()) as f:
+                self.watermarks = json.load(f)
+
+    def path(self, table):
+        return os.path.join(self.directory, f"{table}.csv")
+
+    def watermarks_path(self):
+        return os.path.join(self.directory, "watermarks.json")
+
+    def write(self, table, row):
+        super().write(table, row)
+        self._unwritten[table].append(row)
+
+    def commit(self):
+        for table, rows in self._unwritten.items():
+            if not rows:
+                continue
+            path = self.path(table)
+            new_file = not os.path.exists(path)
+            kinds = [kind for _, kind in TABLES[table]]
+            with open(path, "a", newline="") as f:
+                writer = csv.writer(f)
+                if new_file:
+                    writer.writerow(column_names(table))
+                writer.writerows(
+                    [_serialise(value, kind) for value, kind in zip(row, kinds)]
+                    for row in rows
+                )
+            self._unwritten[table] = []
+        with open(self.watermarks_path(), "w") as f:
+            json.dump(self.watermarks, f)
+        super().commit()
+
+    def close(self):
+        """Write load.sql with the DDL and a \\copy for every table that has a file"""
+        with open(os.path.join(self.directory, "load.sql"), "w") as f:
+            f.write("-- psql -f load.sql, run from this directory\n")
+            f.write("CREATE SCHEMA IF NOT EXISTS raw;\n")
+            for table in TABLES:
+                if not os.path.exists(self.path(table)):
+                    continue
+                f.write(TABLE_DDL[table].strip() + "\n")
+                f.write(
+                    f"\\copy {table} ({', '.join(column_names(table))}) "
+                    f"FROM '{table}.csv' WITH (FORMAT csv, HEADER true)\n"
+                )
+
+
+def sink_arguments():
+    """Arguments shared by every generator script, for use as an argparse parent"""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--sink', choices=['postgres', 'file', 'memory', 'null'],
+                        default=os.getenv("GENERATOR_SINK", "postgres"),
+                        help='Where generated rows go (default: $GENERATOR_SINK or postgres)')
+    parser.add_argument('--output-dir', default=os.getenv("SINK_DIR", "generated"),
+                        help='Directory for the file sink (default: $SINK_DIR or ./generated)')
+    parser.add_argument('--bulk-load', action='store_true',
+                        default=os.getenv("GENERATOR_BULK_LOAD", "").lower() in ("1", "true"),
+                        help='Postgres sink: stage into unlogged tables and publish in one transaction at the end, '
+                             'for initial loads and backfills (default: $GENERATOR_BULK_LOAD)')
+    parser.add_argument('--writers', type=int, default=int(os.getenv("GENERATOR_WRITERS", "1")),
+                        help='Postgres sink: connections that write rows in parallel, one table (orders with their items) each '
+                             '(default: $GENERATOR_WRITERS or 1, the sink\'s own connection)')
+    parser.add_argument('--run-id', default=os.getenv("GENERATOR_RUN_ID"),
+                        help='Idempotency key recorded on every row; re-running a finished run id is a no-op '
+                             '(default: $GENERATOR_RUN_ID or a new id)')
+    return parser
+
+
+def open_sink(args, batch_size=1000):
+    if args.sink == "file":
+        return FileSink(args.output_dir)
+    if args.sink == "memory":
+        return MemorySink()
+    if args.sink == "null":
+        return NullSink()
+    return PostgresSink(batch_size=batch_size, bulk_load=args.bulk_load, writers=args.writers)
@@ -0,0 +1,279 @@
+"""
+Snapshots of the complete raw schema, so an environment can be rebuilt by loading
+files instead of re-running the generators and the order simulation.
+
+A snapshot is a directory of gzipped per-table CSV files plus manifest.json, keyed
+by the workload (which includes the seed) and the number of simulated days:
+
+    python scripts/snapshots.py build --workload scripts/workloads/small.json --seed 42 --simulate-days 30
+    python scripts/snapshots.py restore --key 1f3a...
+    python scripts/snapshots.py list
+
+'build' restores from the local cache when the snapshot exists and otherwise runs
+the generator chain and exports the result for next time. It is the only way in to
+the cache: a snapshot is the state after the whole chain, so the generator scripts,
+run on their own or from Dagster, always generate.
+
+Only seeded workloads are cached. Without a seed the chain writes different rows
+every run, so there is nothing a key could stand for: 'build' then generates without
+exporting, and 'export' and 'restore' (without --key) refuse.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from datetime import datetime
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import telemetry
+from db import connect
+from sinks import TABLES, PostgresSink
+from workload import load_workload, workload_arguments
+
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".snapshots")
+MANIFEST = "manifest.json"
+FORMAT_VERSION = 7
+
+# Watermarks and running totals travel with the rows, so generators and summaries
+# continue correctly after a restore
+SNAPSHOT_TABLES = [*TABLES, "ops.generator_watermarks", "ops.table_stats"]
+
+
+def snapshot_dir():
+    return os.getenv("SNAPSHOT_DIR", DEFAULT_DIR)
+
+
+def snapshot_key(workload, simulate_days):
+    """Stable short hash of everything that shapes the generated data"""
+    spec = {"workload": asdict(workload), "simulate_days": simulate_days, "version": FORMAT_VERSION}
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def load_manifest(path):
+    with open(os.path.join(path, MANIFEST)) as f:
+        return json.load(f)
+
+
+def list_snapshots(directory=None):
+    directory = directory or snapshot_dir()
+    if not os.path.isdir(directory):
+        return []
+    return [
+        load_manifest(os.path.join(directory, name))
+        for name in sorted(os.listdir(directory))
+        if os.path.exists(os.path.join(directory, name, MANIFEST))
+    ]
+
+
+def serial_columns(cur, table):
+    schema, name = table.split(".")
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = %s AND table_name = %s AND column_default LIKE 'nextval%%'
+    """, (schema, name))
+    return [row[0] for row in cur.fetchall()]
+
+
+def _export_table(table, path):
+    conn = connect()
+    with conn.cursor() as cur, gzip.open(path, "wb", compresslevel=3) as f:
+        cur.copy_expert(f"COPY {table} TO STDOUT WITH (FORMAT csv, HEADER true)", f)
+        rows = cur.rowcount
+    conn.close()
+    return {"file": os.path.basename(path), "rows": rows, "bytes": os.path.getsize(path)}
+
+
+def export_snapshot(key, workload, simulate_days, jobs=4, directory=None):
+    """Export every raw table in parallel into <directory>/<key>, replacing it atomically.
+    Tables are copied on separate connections, so nothing should be writing meanwhile."""
+    directory = directory or snapshot_dir()
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=directory, prefix=f"{key}.tmp")
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            table: pool.submit(_export_table, table, os.path.join(tmp_path, f"{table}.csv.gz"))
+            for table in SNAPSHOT_TABLES
+        }
+        tables = {table: future.result() for table, future in futures.items()}
+
+    manifest = {
+        "key": key,
+        "version": FORMAT_VERSION,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "simulate_days": simulate_days,
+        "workload": asdict(workload),
+        "tables": tables,
+    }
+    with open(os.path.join(tmp_path, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    path = os.path.join(directory, key)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+    return manifest
+
+
+def _restore_table(table, path, expected_rows):
+    conn = connect()
+    with conn.cursor() as cur, gzip.open(path, "rb") as f:
+        cur.execute(f"TRUNCATE {table}")
+        cur.copy_expert(f"COPY {table} FROM STDIN WITH (FORMAT csv, HEADER true)", f)
+        if cur.rowcount != expected_rows:
+            raise Exception(f"{table}: loaded {cur.rowcount} rows, manifest says {expected_rows}")
+
+        # Continue serial ids after the restored rows
+        for column in serial_columns(cur, table):
+            cur.execute(
+                f"SELECT setval(pg_get_serial_sequence(%s, %s), COALESCE(MAX({column}), 0) + 1, false) FROM {table}",
+                (table, column)
+            )
+    conn.commit()
+    conn.close()
+    return expected_rows
+
+
+def restore_snapshot(path, jobs=4):
+    """Replace the raw tables with the snapshot, one connection and transaction per table"""
+    manifest = load_manifest(path)
+
+    sink = PostgresSink()
+    sink.ensure_tables(*TABLES)
+    with sink.connection.cursor() as cur:
+        # Tables the snapshot doesn't have are emptied so the result matches it exactly
+        for table in SNAPSHOT_TABLES:
+            if table not in manifest["tables"]:
+                cur.execute(f"TRUNCATE {table}")
+    sink.commit()
+    sink.close()
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            table: pool.submit(_restore_table, table, os.path.join(path, entry["file"]), entry["rows"])
+            for table, entry in manifest["tables"].items()
+        }
+        for table, future in futures.items():
+            telemetry.metrics.record_insert(table, future.result())
+
+    return manifest
+
+
+def generate_dataset(workload_argv, simulate_days):
+    """Run the generator chain from empty raw tables, the same order as a fresh environment"""
+    import generate_login_events
+    import generate_products
+    import generate_session_events
+    import generate_signups
+    import update_order_status
+
+    sink = PostgresSink()
+    sink.ensure_tables(*TABLES)
+    with sink.connection.cursor() as cur:
+        cur.execute(f"TRUNCATE {', '.join(SNAPSHOT_TABLES)}")
+    sink.commit()
+
+    generate_login_events.main(workload_argv, sink)
+    generate_products.main(workload_argv, sink)
+    generate_signups.main(workload_argv, sink)
+    generate_session_events.main(workload_argv, sink)
+    update_order_status.main(workload_argv, sink)
+    if simulate_days:
+        update_order_status.main([*workload_argv, "--simulate-days", str(simulate_days)], sink)
+    sink.close()
+
+
+def generator_argv(args):
+    """The workload arguments of args, to pass on to the generators"""
+    return [
+        *(["--workload", args.workload] if args.workload else []),
+        *(["--scale-factor", str(args.scale_factor)] if args.scale_factor else []),
+        *(["--seed", str(args.seed)] if args.seed is not None else []),
+    ]
+
+
+def print_manifest(manifest):
+    total = sum(entry["rows"] for entry in manifest["tables"].values())
+    size_mb = sum(entry["bytes"] for entry in manifest["tables"].values()) / 1024 / 1024
+    print(f"  {manifest['key']}  created {manifest['created_at']}  "
+          f"sf={manifest['workload']['scale_factor']} seed={manifest['workload']['seed']} "
+          f"simulate_days={manifest['simulate_days']}  {total} rows  {size_mb:.1f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export, restore and cache raw schema snapshots")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in [
+        ("build", "Restore the snapshot for this workload, generating and exporting it if not cached"),
+        ("export", "Export the current raw schema as the snapshot for this workload"),
+        ("restore", "Restore the snapshot for this workload (or --key)"),
+    ]:
+        command = commands.add_parser(name, parents=[workload_arguments()], help=help_text)
+        command.add_argument('--simulate-days', type=int, default=0, help='Days of order simulation in the snapshot')
+        command.add_argument('--jobs', type=int, default=4, help='Tables exported/restored in parallel')
+        if name == "build":
+            command.add_argument('--refresh', action='store_true', help='Regenerate even if the snapshot is cached')
+        if name == "restore":
+            command.add_argument('--key', help='Snapshot key, as shown by list')
+    commands.add_parser("list", help="Show cached snapshots")
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        print("=" * 50)
+        print(f"SNAPSHOTS IN {snapshot_dir()}")
+        print("=" * 50)
+        for manifest in list_snapshots():
+            print_manifest(manifest)
+        return
+
+    workload = load_workload(args)
+    if workload.seed is None and args.command == "export":
+        raise SystemExit("Unseeded workloads aren't reproducible, so they aren't cached (pass --seed)")
+    if workload.seed is None and args.command == "restore" and not args.key:
+        raise SystemExit("Unseeded workloads aren't cached, pass --seed or --key")
+    key = getattr(args, "key", None) or snapshot_key(workload, args.simulate_days)
+    path = os.path.join(snapshot_dir(), key)
+
+    if args.command == "export":
+        manifest = export_snapshot(key, workload, args.simulate_days, args.jobs)
+        print(f"✅ Exported snapshot {key} to {path}")
+        print_manifest(manifest)
+        return
+
+    cached = os.path.exists(os.path.join(path, MANIFEST))
+    if args.command == "restore" and not cached:
+        raise SystemExit(f"No snapshot {key} in {snapshot_dir()} (run 'build' first)")
+
+    if args.command == "build" and workload.seed is None:
+        print("=" * 50)
+        print("UNSEEDED WORKLOAD, GENERATING WITHOUT CACHING")
+        print("=" * 50)
+        generate_dataset(generator_argv(args), args.simulate_days)
+        print("✅ Generated (pass --seed to cache the result)")
+        return
+
+    if args.command == "build" and (args.refresh or not cached):
+        print("=" * 50)
+        print(f"SNAPSHOT {key} NOT CACHED, GENERATING")
+        print("=" * 50)
+        generate_dataset(generator_argv(args), args.simulate_days)
+        manifest = export_snapshot(key, workload, args.simulate_days, args.jobs)
+        print(f"✅ Generated and exported snapshot {key}")
+        print_manifest(manifest)
+        return
+
+    print("=" * 50)
+    print(f"RESTORING SNAPSHOT {key}")
+    print("=" * 50)
+    manifest = restore_snapshot(path, args.jobs)
+    for table, entry in manifest["tables"].items():
+        print(f"  {table}: {entry['rows']} rows")
+    print(f"✅ Restored snapshot {key} (created {manifest['created_at']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""
+Continuous load: login events at a target rate, with their sessions played out in
+real time, written in small time-ordered micro-batches until stopped.
+
+    python scripts/stream_events.py --rate 50
+    python scripts/stream_events.py --rate 20 --profile diurnal --day-seconds 600 --burst-every 120
+
+Sessions are generated from committed logins past the session_events watermark,
+the same way generate_session_events.py picks them up, and each event is written
+once its timestamp has passed. An order and its items always land in the same
+commit. On SIGINT/SIGTERM the remaining events of sessions in progress are
+written, the watermark is advanced past them and both runs are finished.
+
+Sessions end out of login order, so while streaming the watermark stays below the
+oldest session in progress and sessions of later logins are already committed past
+it. After a crash or SIGKILL the next start skips the logins past the watermark
+whose sessions have events: sessions that finished are not written again, and those
+cut off stay as far as they got, each order still with all of its items.
+"""
+from datetime import datetime, timedelta
+import argparse
+import heapq
+import math
+import random
+import signal
+import time
+
+from generate_login_events import EVENT_TIME_WATERMARK, make_login_event
+from generate_session_events import LOGIN_WATERMARK, generate_session_events
+from sinks import open_sink, sink_arguments
+from user_pool import UserPool, load_existing, new_user_ids, sampler
+from value_pools import ValuePools
+from workload import load_workload, reseed, workload_arguments
+
+
+class SessionCapture:
+    """Sink stand-in that keeps a session's rows with the time each one happens"""
+
+    def __init__(self):
+        self.rows = []
+        self._last_time = None
+
+    def write(self, table, row):
+        if table == "raw.session_events":
+            self._last_time = row[0]
+        elif table == "raw.orders":
+            self._last_time = row[1]
+        # Order items have no timestamp of their own and go with their order
+        self.rows.append((self._last_time, table, row))
+
+
+def target_rate(args, elapsed, day_start):
+    """Events per second wanted at elapsed seconds into the run"""
+    rate = args.rate
+
+    if args.profile == "diurnal":
+        # Trough around 03:00, peak around 15:00 of the (possibly compressed) day
+        day_fraction = (day_start + elapsed * 86400 / args.day_seconds) % 86400 / 86400
+        rate *= 1 + args.diurnal_amplitude * math.sin(2 * math.pi * (day_fraction - 0.375))
+
+    if args.burst_every and elapsed % args.burst_every < args.burst_seconds:
+        rate *= args.burst_multiplier
+
+    return max(rate, 0.0)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))]
+
+
+class StreamStats:
+    """Target vs achieved rate and event-time-to-commit latency, per report window and overall"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.logins = 0
+        self.session_events = 0
+        self.target_events = 0.0
+        self.latencies = []
+        self._reset_window()
+
+    def _reset_window(self):
+        self.window_started = time.monotonic()
+        self.window_logins = 0
+        self.window_target = 0.0
+        self.window_latencies = []
+
+    def record(self, logins, session_events, target, event_times, committed_at):
+        self.logins += logins
+        self.session_events += session_events
+        self.target_events += target
+        self.window_logins += logins
+        self.window_target += target
+        latencies = [(committed_at - event_time).total_seconds() * 1000 for event_time in event_times]
+        self.latencies.extend(latencies)
+        self.window_latencies.extend(latencies)
+
+    def report(self, pending_sessions):
+        elapsed = time.monotonic() - self.window_started
+        print(
+            f"  target {self.window_target / elapsed:7.1f}/s  achieved {self.window_logins / elapsed:7.1f}/s  "
+            f"latency p50 {percentile(self.window_latencies, 50):7.1f} ms  "
+            f"p95 {percentile(self.window_latencies, 95):7.1f} ms  "
+            f"open sessions {pending_sessions}"
+        )
+        self._reset_window()
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        print("-" * 50)
+        print(f"Ran for {elapsed:.0f}s")
+        print(f"Login events: {self.logins} ({self.logins / elapsed:.1f}/s, target {self.target_events / elapsed:.1f}/s)")
+        print(f"Session events: {self.session_events} ({self.session_events / elapsed:.1f}/s)")
+        print(f"Write latency: p50 {percentile(self.latencies, 50):.1f} ms, "
+              f"p95 {percentile(self.latencies, 95):.1f} ms, p99 {percentile(self.latencies, 99):.1f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(parents=[workload_arguments(), sink_arguments()])
+    parser.add_argument('--rate', type=float, default=10.0, help='Target login events per second (the daily mean for diurnal)')
+    parser.add_argument('--profile', choices=['flat', 'diurnal'], default='flat')
+    parser.add_argument('--diurnal-amplitude', type=float, default=0.6, help='Peak/trough swing as a fraction of --rate')
+    parser.add_argument('--day-seconds', type=float, default=86400, help='Length of one diurnal cycle, shorten to compress a day')
+    parser.add_argument('--burst-every', type=float, default=0, help='Seconds between bursts (0 = no bursts)')
+    parser.add_argument('--burst-seconds', type=float, default=10, help='Length of each burst')
+    parser.add_argument('--burst-multiplier', type=float, default=5, help='Rate multiplier during a burst')
+    parser.add_argument('--interval', type=float, default=1.0, help='Seconds per micro-batch')
+    parser.add_argument('--duration', type=float, help='Stop after this many seconds (default: run until interrupted)')
+    parser.add_argument('--report-every', type=float, default=10, help='Seconds between rate/latency reports')
+    args = parser.parse_args(argv)
+    workload = load_workload(args)
+    pools = ValuePools(workload.value_pools)
+
+    # Logins and sessions are separate assets with separate locks and runs. Only the
+    # Postgres sink can be opened twice onto the same data.
+    login_sink = open_sink(args, workload.batch_size)
+    session_sink = open_sink(args, workload.batch_size) if args.sink == "postgres" else login_sink
+    login_sink.ensure_tables("raw.login_events")
+    session_sink.ensure_tables("raw.session_events", "raw.orders", "raw.order_items", reads=("raw.login_events", "raw.products"))
+    login_sink.begin_run("login_events", args.run_id)
+    session_sink.begin_run("session_events", args.run_id)
+
+    products = session_sink.products()
+    if not products:
+        raise SystemExit("raw.products is empty, run generate_products.py first")
+
+    user_pool, through_event_id = load_existing(login_sink)
+    reseed(workload, "login_events", through_event_id)
+    unseen_users = set()
+    if not len(user_pool):
+        user_pool = UserPool([new_user_ids(random.randint(*workload.initial_users), user_pool)])
+        unseen_users = set(user_pool)
+    users = sampler(user_pool)
+    power_users = sampler(user_pool.head(int(len(user_pool) * 0.2)) or user_pool)
+
+    last_login = session_sink.watermark(LOGIN_WATERMARK)
+    if last_login is None and session_sink.has_rows("raw.session_events"):
+        last_login = session_sink.last_login_with_sessions()
+    # Left by a stream that didn't stop cleanly, see above
+    written_sessions = session_sink.logins_with_sessions(after_id=last_login)
+
+    stop = False
+
+    def request_stop(signum, frame):
+        nonlocal stop
+        stop = True
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    print("=" * 50)
+    print(f"STREAMING MODE: {args.rate} logins/s ({args.profile}"
+          + (f", {args.burst_multiplier}x bursts every {args.burst_every:.0f}s" if args.burst_every else "") + ")")
+    print("=" * 50)
+    print(f"User pool: {len(user_pool)} users, micro-batches every {args.interval}s")
+    print("-" * 50)
+
+    now = datetime.now()
+    day_start = (now - now.replace(hour=0, minute=0, second=0, microsecond=0)).total_seconds()
+    pending = []         # (event time, sequence, login id, table, row), earliest first
+    open_sessions = {}   # login id -> events still pending
+    sequence = 0
+    owed = 0.0
+    stats = StreamStats()
+    started = time.monotonic()
+    next_tick = started
+    next_report = started + args.report_every
+
+    while not stop:
+        elapsed = time.monotonic() - started
+        if args.duration and elapsed >= args.duration:
+            break
+
+        # Logins for this tick, spread over the interval that just passed, in time order
+        rate = target_rate(args, elapsed, day_start)
+        owed += rate * args.interval
+        count = int(owed)
+        owed -= count
+        now = datetime.now()
+        login_times = sorted(now - timedelta(seconds=random.uniform(0, args.interval)) for _ in range(count))
+        for login_time in login_times:
+            row = make_login_event(workload, pools, users, power_users, login_time)
+            login_sink.write("raw.login_events", row)
+            if row[1] in unseen_users:
+                unseen_users.discard(row[1])
+                login_sink.add_stat("raw.login_events", "distinct_users", 1)
+        login_sink.set_watermark(EVENT_TIME_WATERMARK, int(now.timestamp()))
+        login_sink.commit()
+
+        # Sessions for every committed login not picked up yet, played out as time passes
+        for login_id, session_id, user_id, login_time in session_sink.successful_logins(after_id=last_login):
+            last_login = login_id
+            if login_id in written_sessions:
+                written_sessions.discard(login_id)
+                continue
+            capture = SessionCapture()
+            generate_session_events(capture, workload, products, session_id, user_id, login_time)
+            for event_time, table, row in capture.rows:
+                heapq.heappush(pending, (event_time, sequence, login_id, table, row))
+                sequence += 1
+            if capture.rows:
+                open_sessions[login_id] = len(capture.rows)
+
+        now = datetime.now()
+        event_times = []
+        while pending and pending[0][0] <= now:
+            event_time, _, login_id, table, row = heapq.heappop(pending)
+            session_sink.write(table, row)
+            if table == "raw.session_events":
+                event_times.append(event_time)
+            open_sessions[login_id] -= 1
+            if open_sessions[login_id] == 0:
+                del open_sessions[login_id]
+
+        # Only logins whose sessions are completely written count as processed
+        if last_login is not None:
+            session_sink.set_watermark(LOGIN_WATERMARK, min(open_sessions) - 1 if open_sessions else last_login)
+        session_sink.commit()
+        stats.record(count, len(event_times), rate * args.interval, login_times + event_times, datetime.now())
+
+        if time.monotonic() >= next_report:
+            stats.report(len(open_sessions))
+            next_report += args.report_every
+
+        next_tick += args.interval
+        delay = next_tick - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            # Falling behind: don't try to catch up with a burst of ticks
+            next_tick = time.monotonic()
+
+    print("\nStopping, writing the rest of the open sessions...")
+    while pending:
+        _, _, _, table, row = heapq.heappop(pending)
+        session_sink.write(table, row)
+    if last_login is not None:
+        session_sink.set_watermark(LOGIN_WATERMARK, last_login)
+    session_sink.finish_run()
+    login_sink.finish_run()
+
+    stats.summary()
+    print(f"✅ Stream stopped cleanly, {len(open_sessions)} open sessions completed")
+
+    if session_sink is not login_sink:
+        session_sink.close()
+    login_sink.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import psycopg2
+import psycopg2.extensions
+import psycopg2.sql
+import atexit
+import json
+import os
+import re
+import resource
+import threading
+import time
+
+import profiler
+
+# Matches the target table of an INSERT so row counts can be attributed per table
+# (quoted as sql.Identifier quotes it, too)
+INSERT_TABLE = re.compile(r"\s*INSERT\s+INTO\s+([\w.\"]+)", re.IGNORECASE)
+
+
+def reported_table(table):
+    """Bulk loads insert into raw_staging first; count those rows against the raw table.
+    Bookkeeping in ops (runs, watermarks, statistics) isn't generated data and isn't counted."""
+    if table.startswith("raw_staging."):
+        return "raw." + table[len("raw_staging."):]
+    if table.startswith("ops."):
+        return None
+    return table
+
+
+class RunMetrics:
+    """Counters for one script run, written as JSON on exit when RUN_METRICS_PATH is set.
+    Thread-safe, for the connections of a writer pool and parallel restores."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.round_trips = 0
+        self.rows = {}
+        self.batches = []
+        self._batch_started = self.started
+        self._batch_rows = 0
+        self.profile = None
+
+    def count_round_trip(self):
+        with self._lock:
+            self.round_trips += 1
+
+    def record_insert(self, table, rowcount):
+        if rowcount > 0:
+            with self._lock:
+                self.rows[table] = self.rows.get(table, 0) + rowcount
+                self._batch_rows += rowcount
+
+    def batch_done(self):
+        """Close the current batch (called on every commit) and keep its size and latency"""
+        now = time.perf_counter()
+        with self._lock:
+            if self._batch_rows:
+                self.batches.append((self._batch_rows, round(now - self._batch_started, 6)))
+            self._batch_started = now
+            self._batch_rows = 0
+
+    def as_dict(self):
+        wall_time = time.perf_counter() - self.started
+        total_rows = sum(self.rows.values())
+        return {
+            "wall_time_s": round(wall_time, 3),
+            "rows_inserted": dict(self.rows),
+            "total_rows": total_rows,
+            "rows_per_sec": round(total_rows / wall_time, 1) if wall_time > 0 else 0.0,
+            "db_round_trips": self.round_trips,
+            # ru_maxrss is reported in KB on Linux
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "batches": self.batches,
+            "profile": self.profile
+        }
+
+    def write(self):
+        path = os.getenv("RUN_METRICS_PATH")
+        if not path:
+            return
+        with open(path, "w") as f:
+            json.dump(self.as_dict(), f)
+
+
+metrics = RunMetrics()
+atexit.register(metrics.write)
+# Opt-in sampling profile of the run ($RUN_PROFILE_DIR), summarized into the metrics
+profiler.start_from_env(metrics)
+
+
+class MetricsCursor(psycopg2.extensions.cursor):
+    """Cursor that counts round trips and inserted rows per table"""
+
+    def execute(self, query, vars=None):
+        metrics.count_round_trip()
+        result = super().execute(query, vars)
+        self._record_insert(query)
+        return result
+
+    def executemany(self, query, vars_list):
+        metrics.count_round_trip()
+        result = super().executemany(query, vars_list)
+        self._record_insert(query)
+        return result
+
+    def _record_insert(self, query):
+        # Queries also come pre-encoded or as psycopg2.sql objects
+        if isinstance(query, psycopg2.sql.Composable):
+            query = query.as_string(self)
+        head = query[:64]
+        if isinstance(head, bytes):
+            # The cut may split a multibyte character, which only a table name after it could need
+            head = head.decode(errors="replace")
+        match = INSERT_TABLE.match(head)
+        table = match and reported_table(match.group(1).replace('"', ''))
+        if table:
+            metrics.record_insert(table, self.rowcount)
+
+
+class MetricsConnection(psycopg2.extensions.connection):
+    """Connection that counts commits as round trips and as batch boundaries"""
+
+    # Off for the connections of a writer pool, which commit just before the sink; its commit ends the batch
+    ends_batches = True
+
+    def commit(self):
+        metrics.count_round_trip()
+        super().commit()
+        if self.ends_batches:
+            metrics.batch_done()
@@ -0,0 +1,177 @@
+"""
+The login generator's user pool as packed int64 user ids instead of a list of
+12-character strings: 8 bytes per user instead of about 60, formatted to a string
+only when a user is drawn for a row. sampler() draws users a batch of indexes at a
+time (random.choices over the index range) and formats the batch in one pass, which
+is faster than random.choice over a list of strings.
+
+With a cache directory, the pool is saved after each run together with the login
+event_id it covers and a fingerprint of that login, and the next run memory-maps it
+and only reads the users of logins written since. Without one, or when the table's
+login at that event_id isn't the one the pool was saved after (a restored snapshot,
+a database rebuilt to the same or a larger event_id), the pool is read from the sink.
+A cache file belongs to one database or output directory.
+
+Pools read from the sink and cached pools are both in user_id order (the ids are
+all 12 digits, so text and integer order agree), which keeps the power users and
+every draw of a seeded run the same with or without the cache.
+"""
+from array import array
+import bisect
+import hashlib
+import heapq
+import mmap
+import os
+import random
+import struct
+import tempfile
+
+ID_MIN, ID_MAX = 100000000000, 999999999999
+ID_RANGE = range(ID_MIN, ID_MAX + 1)
+
+# File layout: header, then count packed int64 ids, readable straight from an mmap
+MAGIC = b"UPOOL\x02"
+HEADER = struct.Struct("<6sxxqqQ")   # magic, login event_id the pool covers, its fingerprint, count
+
+
+class UserPool:
+    """Read-only sequence of user ids made of packed int64 parts (usually the cached ids
+    and this run's new users), so random.choice and slicing work without copying"""
+
+    def __init__(self, parts):
+        self.parts = [part for part in parts if len(part)]
+        self._starts = []
+        total = 0
+        for part in self.parts:
+            self._starts.append(total)
+            total += len(part)
+        self._len = total
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.step not in (None, 1) or index.start not in (None, 0):
+                raise ValueError("only leading slices are supported")
+            return self.head(len(self) if index.stop is None else index.stop)
+        if index < 0:
+            index += self._len
+        if len(self.parts) == 1:
+            return str(self.parts[0][index])
+        part = bisect.bisect_right(self._starts, index) - 1
+        return str(self.parts[part][index - self._starts[part]])
+
+    def __iter__(self):
+        for user_id in self.ids():
+            yield str(user_id)
+
+    def head(self, count):
+        """The first count users, sharing memory with this pool"""
+        parts = []
+        for part in self.parts:
+            if count <= 0:
+                break
+            parts.append(memoryview(part)[:count])
+            count -= len(part)
+        return UserPool(parts)
+
+    def ids(self):
+        for part in self.parts:
+            yield from part
+
+    def take(self, indexes):
+        """The users at indexes, as strings"""
+        if len(self.parts) == 1:
+            part = self.parts[0]
+            return [str(part[i]) for i in indexes]
+        if len(self.parts) == 2:
+            # The existing users and this run's new ones: one comparison instead of a bisect
+            first, second = self.parts
+            split = len(first)
+            return [str(first[i]) if i < split else str(second[i - split]) for i in indexes]
+        return [self[i] for i in indexes]
+
+
+def sampler(pool, batch=4096):
+    """Endless iterator of uniformly drawn users of pool, as strings. Indexes are drawn
+    batch at a time from a stream of their own, seeded from the random module, so seeded
+    runs repeat and a refill doesn't move the caller's other draws."""
+    rng = random.Random(random.getrandbits(64))
+    indexes = range(len(pool))
+
+    def draw():
+        while True:
+            yield from pool.take(rng.choices(indexes, k=batch))
+
+    return draw()
+
+
+def new_user_ids(count, existing):
+    """count random ids that collide neither with each other nor with the existing pool"""
+    ids = array("q", random.choices(ID_RANGE, k=count))
+    while True:
+        drawn = set(ids)
+        # Set operations over the packed parts, one pass over each without a Python loop
+        taken = set().union(*(drawn.intersection(part) for part in existing.parts))
+        if len(drawn) == len(ids) and not taken:
+            return ids
+        # Collisions are rare (ids are 12 digits), so they are found and redrawn one by one
+        seen = set()
+        redraw = [i for i, user_id in enumerate(ids) if user_id in taken or user_id in seen or seen.add(user_id)]
+        for i in redraw:
+            ids[i] = random.choice(ID_RANGE)
+
+
+def cache_path(directory, key):
+    """Pool file for one database or output directory"""
+    return os.path.join(directory, f"users-{hashlib.sha256(key.encode()).hexdigest()[:12]}.pool")
+
+
+def load_cached(path):
+    """(event_id the pool covers, fingerprint of that login, memory-mapped ids) or None"""
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(mm) < HEADER.size:
+        return None
+    magic, through_event_id, fingerprint, count = HEADER.unpack_from(mm, 0)
+    if magic != MAGIC or len(mm) != HEADER.size + 8 * count:
+        return None
+    return through_event_id, fingerprint, memoryview(mm)[HEADER.size:].cast("q")
+
+
+def merged(existing, added):
+    """The sorted ids of existing and the ids in added, as one packed part"""
+    return array("q", heapq.merge(*existing.parts, sorted(added)))
+
+
+def save(path, pool, through_event_id, fingerprint):
+    """Write the pool (sorted) atomically, so a run reading the previous file keeps its mapping"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(HEADER.pack(MAGIC, through_event_id or 0, fingerprint or 0, len(pool)))
+        for part in pool.parts:
+            f.write(part)
+    os.replace(tmp_path, path)
+
+
+def load_existing(sink, cache=None):
+    """(pool of the users in raw.login_events, login event_id it covers), from the cache
+    plus the logins since when it matches the table"""
+    through_event_id = sink.high_water("raw.login_events", "login_events")
+    cached = load_cached(cache) if cache else None
+    if cached is not None and through_event_id is not None and cached[0] <= through_event_id \
+            and sink.login_fingerprint(cached[0]) == cached[1]:
+        cached_through, _, ids = cached
+        pool = UserPool([ids])
+        if cached_through == through_event_id:
+            return pool, through_event_id
+        recent = set(map(int, sink.existing_user_ids(after_id=cached_through)))
+        recent.difference_update(ids)
+        return UserPool([merged(pool, recent)]), through_event_id
+
+    return UserPool([array("q", map(int, sink.existing_user_ids()))]), through_event_id
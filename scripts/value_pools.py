@@ -0,0 +1,144 @@
+import argparse
+import mmap
+import os
+import random
+import socket
+import struct
+import tempfile
+from array import array
+
+from workload import load_workload, workload_arguments
+
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".value_pools")
+DEFAULT_LOCALE = "en_US"
+
+# File layout: header, then either (count + 1) uint32 offsets followed by a UTF-8
+# blob, or count packed integers. Everything can be read straight from an mmap.
+MAGIC = b"VPOOL\x01"
+HEADER = struct.Struct("<6sBxQ")
+KIND_TEXT = 0
+KIND_IPV4 = 1
+KIND_MAC = 2
+
+# Pool name -> (Faker provider, storage kind, default size). Sizes are draws, not
+# unique values, so Faker's own weighting (e.g. common last names) carries over.
+FIELDS = {
+    "first_name": ("first_name", KIND_TEXT, 10000),
+    "last_name": ("last_name", KIND_TEXT, 10000),
+    "street_address": ("street_address", KIND_TEXT, 50000),
+    "city": ("city", KIND_TEXT, 20000),
+    "state": ("state", KIND_TEXT, 2000),
+    "postcode": ("postcode", KIND_TEXT, 50000),
+    "country_code": ("country_code", KIND_TEXT, 10000),
+    "free_email_domain": ("free_email_domain", KIND_TEXT, 1000),
+    "company": ("company", KIND_TEXT, 20000),
+    "ipv4": ("ipv4", KIND_IPV4, 200000),
+    "mac_address": ("mac_address", KIND_MAC, 200000),
+}
+
+
+class ValuePool:
+    """Read-only pool of precomputed values, memory-mapped from disk and sampled by index"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.kind, self.count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a value pool file")
+
+        view = memoryview(self._mm)
+        if self.kind == KIND_TEXT:
+            self._blob_start = HEADER.size + 4 * (self.count + 1)
+            self._offsets = view[HEADER.size:self._blob_start].cast("I")
+        elif self.kind == KIND_IPV4:
+            self._values = view[HEADER.size:HEADER.size + 4 * self.count].cast("I")
+        else:
+            self._values = view[HEADER.size:HEADER.size + 8 * self.count].cast("Q")
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if self.kind == KIND_TEXT:
+            start = self._blob_start + self._offsets[index]
+            end = self._blob_start + self._offsets[index + 1]
+            return self._mm[start:end].decode()
+        value = self._values[index]
+        if self.kind == KIND_IPV4:
+            return f"{value >> 24}.{(value >> 16) & 255}.{(value >> 8) & 255}.{value & 255}"
+        return value.to_bytes(6, "big").hex(":")
+
+    def sample(self, rng=random):
+        return self[rng.randrange(self.count)]
+
+
+def build_pool(path, provider, kind, size, locale):
+    """Draw size values from Faker and write them atomically, so concurrent builders are safe"""
+    from faker import Faker
+
+    fake = Faker(locale)
+    fake.seed_instance(0)  # Same pool contents on every machine, so seeded runs repeat
+    generate = getattr(fake, provider)
+    values = [generate() for _ in range(size)]
+
+    if kind == KIND_TEXT:
+        offsets = array("I", [0])
+        blob = bytearray()
+        for value in values:
+            blob += value.encode()
+            offsets.append(len(blob))
+        payload = offsets.tobytes() + bytes(blob)
+    elif kind == KIND_IPV4:
+        payload = array("I", (int.from_bytes(socket.inet_aton(value), "big") for value in values)).tobytes()
+    else:
+        payload = array("Q", (int(value.replace(":", ""), 16) for value in values)).tobytes()
+
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(HEADER.pack(MAGIC, kind, size))
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+class ValuePools:
+    """Lazily loads (building on first use) one pool per field, e.g. pools.city.sample()"""
+
+    def __init__(self, sizes=None, directory=None, locale=DEFAULT_LOCALE):
+        self.sizes = {name: default_size for name, (_, _, default_size) in FIELDS.items()}
+        self.sizes.update(sizes or {})
+        self.directory = directory or os.getenv("VALUE_POOL_DIR", DEFAULT_DIR)
+        self.locale = locale
+        self._pools = {}
+
+    def path(self, name):
+        return os.path.join(self.directory, f"{name}-{self.locale}-{self.sizes[name]}.pool")
+
+    def get(self, name):
+        if name not in self._pools:
+            provider, kind, _ = FIELDS[name]
+            path = self.path(name)
+            if not os.path.exists(path):
+                build_pool(path, provider, kind, self.sizes[name], self.locale)
+            self._pools[name] = ValuePool(path)
+        return self._pools[name]
+
+    def __getattr__(self, name):
+        if name in FIELDS:
+            return self.get(name)
+        raise AttributeError(name)
+
+
+if __name__ == "__main__":
+    # Prebuild every pool for the workload, e.g. once per image or machine
+    parser = argparse.ArgumentParser(parents=[workload_arguments()])
+    parser.add_argument('--locale', default=DEFAULT_LOCALE)
+    args = parser.parse_args()
+    pools = ValuePools(load_workload(args).value_pools, locale=args.locale)
+
+    for name in FIELDS:
+        pool = pools.get(name)
+        print(f"  {name}: {len(pool)} values -> {pools.path(name)}")
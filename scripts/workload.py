@@ -0,0 +1,92 @@
+from dataclasses import dataclass, field, fields, replace
+import argparse
+import json
+import os
+import random
+
+# Volumes multiplied by the scale factor. Rates, history length and batch size are not.
+SCALED_FIELDS = ("initial_users", "initial_events", "daily_events", "catalog_size")
+
+
+@dataclass(frozen=True)
+class Workload:
+    """Volumes and rates shared by every generator. Defaults are scale factor 1."""
+
+    scale_factor: float = 1.0
+    history_days: int = 60                      # Days of history in the initial load
+    initial_users: tuple = (25000, 45000)       # User pool size range for the initial load
+    initial_events: int = 400000                # Login events in the initial load
+    daily_events: tuple = (5000, 15000)         # Login events per incremental (daily) run
+    new_user_rate: float = 0.2                  # New users per incremental run, relative to existing users
+    power_user_rate: float = 0.2                # Share of events from the top 20% of users
+    catalog_size: int = 50                      # Products in raw.products
+    conversion_rate: float = 0.15               # Sessions that result in a purchase
+    review_rate: float = 0.30                   # Purchases that get a review
+    batch_size: int = 10000                     # Rows per commit and per server-side fetch
+    value_pools: dict = field(default_factory=dict)  # Per-field Faker pool sizes, see value_pools.py
+    seed: int = None                            # Seeds the random module and keyed_random streams, for repeatable runs
+
+    def scaled(self):
+        """Return the workload with the scale factor applied to every volume"""
+        values = {}
+        for name in SCALED_FIELDS:
+            value = getattr(self, name)
+            if name == "catalog_size":
+                # The catalog only grows, so small workloads still cover every base product
+                values[name] = max(value, int(value * self.scale_factor))
+                continue
+            if isinstance(value, tuple):
+                values[name] = tuple(max(1, int(v * self.scale_factor)) for v in value)
+            else:
+                values[name] = max(1, int(value * self.scale_factor))
+        return replace(self, **values)
+
+
+def load_spec(path):
+    with open(path) as f:
+        spec = json.load(f)
+
+    known = {field.name for field in fields(Workload)}
+    unknown = set(spec) - known
+    if unknown:
+        raise ValueError(f"Unknown workload settings in {path}: {', '.join(sorted(unknown))}")
+
+    return {name: tuple(value) if isinstance(value, list) else value for name, value in spec.items()}
+
+
+def workload_arguments():
+    """Arguments shared by every generator script, for use as an argparse parent"""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--workload', help='Workload spec JSON file (default: $WORKLOAD_SPEC)')
+    parser.add_argument('--scale-factor', type=float, help='Overrides the spec scale factor (default: $WORKLOAD_SCALE_FACTOR)')
+    parser.add_argument('--seed', type=int, help='Overrides the spec seed (default: $WORKLOAD_SEED)')
+    return parser
+
+
+def load_workload(args=None):
+    """Build the scaled workload from CLI args, then env vars, then the spec file, then defaults.
+    A seed, if any, is applied to the random module here."""
+    spec_path = getattr(args, "workload", None) or os.getenv("WORKLOAD_SPEC")
+    settings = load_spec(spec_path) if spec_path else {}
+
+    scale_factor = getattr(args, "scale_factor", None) or os.getenv("WORKLOAD_SCALE_FACTOR")
+    if scale_factor:
+        settings["scale_factor"] = float(scale_factor)
+
+    seed = getattr(args, "seed", None)
+    if seed is None:
+        seed = os.getenv("WORKLOAD_SEED")
+    if seed is not None:
+        settings["seed"] = int(seed)
+    # The spec file's seed too
+    if settings.get("seed") is not None:
+        random.seed(settings["seed"])
+
+    return Workload(**settings).scaled()
+
+
+def reseed(workload, *position):
+    """With a seed, restart the random stream at a checkpoint position, so a resumed
+    run writes the same rows an uninterrupted one would (and never repeats earlier ones)"""
+    if workload.seed is not None:
+        random.seed(":".join(str(part) for part in (workload.seed, *position)))
@@ -0,0 +1,114 @@
+"""
+Worker threads, each with its own connection, that run the Postgres sink's flushes
+while the generator carries on producing rows.
+
+Every table is written by one worker (tables are dealt out round-robin as they
+are first written), so the batches of a table run in the order they were flushed
+and serial ids come out in write order, as on a single connection. A table can be
+grouped with another to share its worker, and so its transactions: orders go with
+their order items. Different workers write at the same time. At most max_in_flight
+batches are queued or running; flushing more waits for one to finish, which bounds
+the rows held in memory.
+
+Workers write straight into the tables and keep their transaction open until the
+sink commits: commit() commits every worker, then the sink commits the watermarks
+covering the rows on its own connection. See PostgresSink for what happens to the
+rows of a run that dies between the two.
+"""
+import queue
+import threading
+
+from db import connect
+
+# Queued instead of a task to commit the worker's transaction
+COMMIT = object()
+
+
+class WriterPool:
+    def __init__(self, writers, groups=None, max_in_flight=None):
+        """groups maps a table to the table whose worker (and transactions) it shares"""
+        self._slots = threading.BoundedSemaphore(max_in_flight or 2 * writers)
+        self._idle = threading.Condition()
+        self._pending = 0
+        self._error = None
+        self._groups = groups or {}
+        self._assigned = {}     # table -> worker index
+        self._queues = []
+        self._threads = []
+        for _ in range(writers):
+            conn = connect()
+            # Only the sink's commit ends a batch in the run metrics
+            conn.ends_batches = False
+            with conn.cursor() as cur:
+                # The sink's synchronous commit comes after the workers' in the WAL and
+                # flushes their commit records with its own
+                cur.execute("SET synchronous_commit = off")
+            conn.commit()
+            tasks = queue.SimpleQueue()
+            thread = threading.Thread(target=self._work, args=(conn, tasks), daemon=True)
+            thread.start()
+            self._queues.append(tasks)
+            self._threads.append(thread)
+
+    def submit(self, table, task):
+        """Run task(cursor) on the worker of table, after the tasks submitted for it before.
+        Blocks while max_in_flight batches are outstanding."""
+        table = self._groups.get(table, table)
+        worker = self._assigned.setdefault(table, len(self._assigned) % len(self._queues))
+        self._put(self._queues[worker], task)
+
+    def commit(self):
+        """Commit every worker's transaction once its tasks have run; raises the first error of a worker"""
+        for tasks in self._queues:
+            self._put(tasks, COMMIT)
+        self.drain()
+
+    def drain(self):
+        """Wait until every submitted task has run; raises the first error of a worker"""
+        with self._idle:
+            self._idle.wait_for(lambda: self._pending == 0)
+        self._raise_error()
+
+    def close(self):
+        """Stop the workers. Whatever they haven't committed is rolled back."""
+        for tasks in self._queues:
+            tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._queues, self._threads = [], []
+
+    def _put(self, tasks, task):
+        self._raise_error()
+        self._slots.acquire()
+        with self._idle:
+            self._pending += 1
+        tasks.put(task)
+
+    def _raise_error(self):
+        # Kept: the batches after a failed one were skipped, so nothing more may be committed
+        if self._error is not None:
+            raise self._error
+
+    def _work(self, conn, tasks):
+        cur = conn.cursor()
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            try:
+                # After an error the remaining tasks are skipped; the sink raises it on its next flush
+                if self._error is None:
+                    if task is COMMIT:
+                        conn.commit()
+                    else:
+                        task(cur)
+            except Exception as e:
+                conn.rollback()
+                self._error = e
+            finally:
+                self._slots.release()
+                with self._idle:
+                    self._pending -= 1
+                    self._idle.notify_all()
+        cur.close()
+        conn.close()